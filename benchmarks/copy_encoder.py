@@ -0,0 +1,76 @@
+"""Measure how fast shapefile records are encoded for COPY.
+
+The records of a shapefile are repeated to make a larger layer and read
+through ``PGShapeReader`` in blocks the way ``cursor.copy_from`` reads
+them. The previous string concatenation reader is timed for comparison,
+as is the binary format ``PGBinaryShapeReader``.
+
+    python benchmarks/copy_encoder.py [SHAPEFILE] [-n RECORDS] [-s SIZE]
+"""
+import argparse
+import itertools
+import os
+import time
+
+from shapefile import Reader
+
+from slingshot import COPY_BUFFER_SIZE
+from slingshot.db import PGBinaryShapeReader, PGShapeReader
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), os.pardir, 'tests',
+                       'fixtures', 'bermuda', 'bermuda.shp')
+
+
+class Layer:
+    """Stands in for a ``shapefile.Reader`` with repeated records."""
+    def __init__(self, path, count):
+        with Reader(path) as sf:
+            self.fields = sf.fields
+            self.records = list(sf.iterShapeRecords())
+        self.count = count
+
+    def iterShapeRecords(self):
+        return itertools.islice(itertools.cycle(self.records), self.count)
+
+
+class ConcatReader(PGShapeReader):
+    """The reader as it was before batching, for comparison."""
+    def __init__(self, shapefile, srid):
+        super().__init__(shapefile, srid)
+        self._buffer = u''
+
+    def read(self, size=-1):
+        while len(self._buffer) < size:
+            try:
+                self._buffer += self._record_to_str(next(self._g))
+            except StopIteration:
+                break
+        buf = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return buf
+
+
+def run(cls, layer, size):
+    reader = cls(layer, 4326)
+    start = time.perf_counter()
+    while reader.read(size):
+        pass
+    return layer.count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('shapefile', nargs='?', default=FIXTURE)
+    parser.add_argument('-n', '--records', type=int, default=100000)
+    parser.add_argument('-s', '--size', type=int, action='append')
+    args = parser.parse_args()
+    layer = Layer(args.shapefile, args.records)
+    for size in args.size or [8192, COPY_BUFFER_SIZE]:
+        for cls in (ConcatReader, PGShapeReader, PGBinaryShapeReader):
+            print('{:<20} {:>9} bytes {:>10.0f} rows/s'.format(
+                cls.__name__, size, run(cls, layer, size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare the row-wise and columnar COPY encoders on a wide table.
+
+A point shapefile is generated with the given number of features, each
+with text, integer, float, date and logical attributes, and read to the
+end through each COPY reader.
+
+    python benchmarks/dbf_decoder.py [-n FEATURES] [-s SIZE]
+"""
+import argparse
+from datetime import date
+import os
+import tempfile
+import time
+
+from shapefile import POINT, Reader, Writer
+
+from slingshot import COPY_BUFFER_SIZE
+from slingshot.db import (
+    PGBinaryShapeReader,
+    PGColumnarShapeReader,
+    PGShapeReader,
+)
+
+
+def generate(path, features):
+    with Writer(path, shapeType=POINT, encoding='cp1252') as w:
+        w.field('name', 'C', 40)
+        w.field('kind', 'C', 10)
+        w.field('count', 'N', 10)
+        w.field('area', 'N', 18, 6)
+        w.field('updated', 'D')
+        w.field('active', 'L')
+        for i in range(features):
+            w.point(i % 360 - 180, i % 180 - 90)
+            w.record('Feature nº {}'.format(i), 'k{}'.format(i % 7), i,
+                     i / 7, date(2000 + i % 20, i % 12 + 1, i % 28 + 1),
+                     i % 3 == 0)
+
+
+def readers():
+    yield 'PGShapeReader', lambda sf: PGShapeReader(sf, 4326, 'cp1252')
+    yield 'PGBinaryShapeReader', \
+        lambda sf: PGBinaryShapeReader(sf, 4326, 'cp1252')
+    yield 'columnar text', \
+        lambda sf: PGColumnarShapeReader(sf, 4326, 'cp1252')
+    yield 'columnar binary', \
+        lambda sf: PGColumnarShapeReader(sf, 4326, 'cp1252', 'binary')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--features', type=int, default=100000)
+    parser.add_argument('-s', '--size', type=int, default=COPY_BUFFER_SIZE)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'points')
+        generate(path, args.features)
+        for name, make in readers():
+            with Reader(path, encoding='cp1252') as sf:
+                reader = make(sf)
+                start = time.perf_counter()
+                while reader.read(args.size):
+                    pass
+                elapsed = time.perf_counter() - start
+            print('{:<20} {:>10.0f} rows/s'.format(
+                name, args.features / elapsed))
+
+
+if __name__ == '__main__':
+    main()
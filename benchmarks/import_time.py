@@ -0,0 +1,52 @@
+"""Measure how long it takes to start the slingshot command line tool.
+
+Each module is imported in a fresh interpreter using ``-X importtime`` and
+the cumulative import time of the module itself is reported. The time to
+run ``slingshot --help`` end to end is reported as well.
+
+    python benchmarks/import_time.py [-n RUNS]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+MODULES = ('slingshot.cli', 'slingshot.app', 'slingshot.proj')
+
+
+def import_time(module):
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          'import {}'.format(module)],
+                         stderr=subprocess.PIPE, check=True)
+    for line in res.stderr.decode().splitlines():
+        fields = [f.strip() for f in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e6
+    raise RuntimeError('No import time reported for {}'.format(module))
+
+
+def help_time():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c',
+                    'from slingshot.cli import main; main(["--help"])'],
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    args = parser.parse_args()
+    for module in MODULES:
+        times = [import_time(module) for _ in range(args.runs)]
+        print('import {:<16} {:8.1f} ms'.format(
+            module, statistics.median(times) * 1000))
+    times = [help_time() for _ in range(args.runs)]
+    print('slingshot --help        {:8.1f} ms'.format(
+        statistics.median(times) * 1000))
+
+
+if __name__ == '__main__':
+    main()
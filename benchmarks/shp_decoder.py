@@ -0,0 +1,72 @@
+"""Compare ways of turning shapefile polygons into COPY geometries.
+
+A polygon shapefile is generated with the given number of features and
+its geometries are encoded as WKT through pyshp (the text COPY path), as
+EWKB from pyshp shapes, and as EWKB from ``ShpReader`` batches.
+
+    python benchmarks/shp_decoder.py [-n FEATURES] [-v VERTICES]
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+
+from geomet import wkt
+from shapefile import POLYGON, Reader, Writer
+
+from slingshot import COPY_BATCH_SIZE
+from slingshot.db import multiply
+from slingshot.ewkb import ewkb, ewkb_batch
+from slingshot.shp import ShpReader
+
+
+def generate(path, features, vertices):
+    with Writer(path, shapeType=POLYGON) as w:
+        w.field('id', 'N')
+        for i in range(features):
+            cx, cy = (i % 1000) * 10.0, (i // 1000) * 10.0
+            ring = [[cx + 4 * math.cos(-a * 2 * math.pi / vertices),
+                     cy + 4 * math.sin(-a * 2 * math.pi / vertices)]
+                    for a in range(vertices)]
+            ring.append(ring[0])
+            w.poly([ring])
+            w.record(i)
+
+
+def pyshp_wkt(path):
+    with Reader(path) as sf:
+        for shape in sf.iterShapes():
+            'SRID=4326;' + wkt.dumps(multiply(shape.__geo_interface__))
+
+
+def pyshp_ewkb(path):
+    with Reader(path) as sf:
+        for shape in sf.iterShapes():
+            ewkb(shape, 4326)
+
+
+def shp_reader_ewkb(path):
+    with open(path + '.shp', 'rb') as shp, open(path + '.shx', 'rb') as shx:
+        for batch in ShpReader(shp, shx).batches(COPY_BATCH_SIZE):
+            ewkb_batch(batch, 4326)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--features', type=int, default=100000)
+    parser.add_argument('-v', '--vertices', type=int, default=32)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'polygons')
+        generate(path, args.features, args.vertices)
+        for func in (pyshp_wkt, pyshp_ewkb, shp_reader_ewkb):
+            start = time.perf_counter()
+            func(path)
+            elapsed = time.perf_counter() - start
+            print('{:<16} {:>10.0f} features/s'.format(
+                func.__name__, args.features / elapsed))
+
+
+if __name__ == '__main__':
+    main()
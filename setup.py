@@ -22,18 +22,23 @@ setup(
     author='Mike Graves',
     author_email='mgraves@mit.edu',
     packages=find_packages(exclude=['tests']),
+    package_data={'slingshot': ['data/*.csv']},
     install_requires=[
         'attrs',
         'boto3',
         'click',
         'geoalchemy2',
         'geomet',
+        'numpy',
         'plyplus',
         'psycopg2-binary',
         'pymarc',
         'pyshp',
         'requests',
     ],
+    extras_require={
+        'async': ['aiobotocore'],
+    },
     python_requires='>=3.7.1',
     entry_points={
         'console_scripts': [
@@ -12,6 +12,82 @@ DATASTORE = "pg"
 #: when reading the shapefile for loading into Postgres.
 S3_BUFFER_SIZE = 1 << 24  # 16 MiB
 
+#: Size and number of the aligned blocks kept by an S3IO block cache. The
+#: defaults keep at most 16 MiB of an object in memory.
+S3_BLOCK_SIZE = 1 << 18  # 256 KiB
+S3_CACHE_BLOCKS = 64
+
+#: Number of threads used to upload the parts of a single multipart upload.
+#: At most this many parts are held in memory at once, so each upload uses
+#: up to ``S3_UPLOAD_WORKERS * S3_BUFFER_SIZE`` bytes.
+S3_UPLOAD_WORKERS = 4
+
+#: Metadata objects in a layer (FGDC, GeoBlacklight JSON, .prj and .cst)
+#: no larger than this are fetched whole with one request and kept in
+#: memory. Larger FGDC candidates are identified by reading only the first
+#: ``METADATA_SNIFF_SIZE`` bytes.
+METADATA_FETCH_SIZE = 1 << 20  # 1 MiB
+METADATA_SNIFF_SIZE = 1 << 13  # 8 KiB
+
+#: Number of zip members extracted at once by ``unpack_zip`` and the limit
+#: on how many bytes those extractions may be buffering at any time.
+UNPACK_WORKERS = 4
+UNPACK_MAX_INFLIGHT = 1 << 28  # 256 MiB
+
+#: Tile size suggested to GeoServer for a GeoTIFF that is not tiled. Tiled
+#: GeoTIFFs use their own tile size.
+GEOTIFF_TILE_SIZE = 512
+
+#: Tile size used when converting a GeoTIFF to a Cloud Optimized GeoTIFF.
+COG_TILE_SIZE = 512
+
+#: Shapefiles are loaded into PostGIS with COPY. Records are encoded in
+#: batches of ``COPY_BATCH_SIZE`` and sent to Postgres in blocks of
+#: ``COPY_BUFFER_SIZE`` bytes.
+COPY_BATCH_SIZE = 1000
+COPY_BUFFER_SIZE = 1 << 20  # 1 MiB
+
+#: A large shapefile is split into up to ``COPY_WORKERS`` ranges of
+#: records which are copied into its table concurrently, each over its
+#: own database connection. A range has at least ``COPY_PARTITION_MIN``
+#: records, so smaller shapefiles use fewer connections.
+COPY_WORKERS = 4
+COPY_PARTITION_MIN = 100000
+
+#: Session settings used to build the spatial index of a table loaded in
+#: bulk-load mode. PostgreSQL does not build GiST indexes in parallel, so
+#: BULK_INDEX_WORKERS only applies to B-tree indexes and does not speed up
+#: the spatial index.
+BULK_MAINTENANCE_WORK_MEM = '1GB'
+BULK_INDEX_WORKERS = 4
+
+#: A republished shapefile is loaded into a table named with this suffix
+#: and then synced to its existing table. If more than
+#: ``SYNC_MAX_CHANGES`` of the existing rows would change, the new table
+#: replaces the old one instead.
+STAGING_SUFFIX = '__staging'
+SYNC_MAX_CHANGES = 0.1
+
+#: Shapefiles loaded in Hilbert order are sorted by the index of each
+#: record's bounding box centre on a ``2 ** HILBERT_ORDER`` grid over the
+#: layer. Encoded rows are sorted in memory up to
+#: ``HILBERT_SORT_MEMORY`` bytes, beyond which sorted runs are spilled to
+#: temporary files and merged.
+HILBERT_ORDER = 16
+HILBERT_SORT_MEMORY = 1 << 28  # 256 MiB
+
+#: Solr documents added through a ``SolrBatcher`` are sent once there are
+#: ``SOLR_BATCH_DOCS`` of them, they take up ``SOLR_BATCH_BYTES``, or the
+#: oldest has waited ``SOLR_BATCH_WAIT`` seconds. Solr is asked to commit
+#: them within ``SOLR_COMMIT_WITHIN`` milliseconds.
+SOLR_BATCH_DOCS = 100
+SOLR_BATCH_BYTES = 1 << 20  # 1 MiB
+SOLR_BATCH_WAIT = 1.0
+SOLR_COMMIT_WITHIN = 10000
+
+#: Default size limit for the local disk cache of S3 objects.
+DISK_CACHE_SIZE = 1 << 30  # 1 GiB
+
 
 class state:
     PENDING = 0
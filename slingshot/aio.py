@@ -0,0 +1,456 @@
+"""Asyncio versions of the S3 helpers used by the publish pipeline.
+
+This module requires `aiobotocore <https://github.com/aio-libs/aiobotocore>`_
+which can be installed with the ``async`` extra. All functions take an
+aiobotocore S3 client, which can be created with :func:`client`::
+
+    async with client(endpoint_url=s3_endpoint) as s3:
+        manifest = await unpack_zip("upload", "bermuda.zip", "store", s3)
+
+"""
+import asyncio
+from contextlib import asynccontextmanager
+import io
+import os
+import zlib
+from zipfile import BadZipFile, ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:  # pragma: no cover
+    get_session = None
+
+from slingshot import (S3_BUFFER_SIZE, S3_UPLOAD_WORKERS, UNPACK_MAX_INFLIGHT,
+                       UNPACK_WORKERS)
+from slingshot.layer import Manifest, PackageError
+from slingshot.zipstream import LOCAL_HEADER, LOCAL_SIG
+
+#: How much of the end of a zipfile is fetched to find the central directory.
+_ZIP_TAIL_SIZE = (1 << 16) + 22
+
+
+def client(endpoint_url=None, region_name=None, max_pool_connections=100):
+    """Create an aiobotocore S3 client.
+
+    The returned client must be used as an async context manager.
+    """
+    if get_session is None:
+        raise ImportError("aiobotocore is required for slingshot.aio")
+    config = AioConfig(max_pool_connections=max_pool_connections)
+    return get_session().create_client('s3', endpoint_url=endpoint_url,
+                                       region_name=region_name, config=config)
+
+
+class AsyncS3IO:
+    """An async, seekable binary stream over an S3 object.
+
+    This is the asyncio counterpart of :class:`slingshot.s3.S3IO`. Each
+    ``read()`` is a ranged ``GetObject`` request.
+    """
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self._position = 0
+        self._length = None
+
+    async def content_length(self):
+        if self._length is None:
+            head = await self.client.head_object(Bucket=self.bucket,
+                                                 Key=self.key)
+            self._length = head['ContentLength']
+        return self._length
+
+    def tell(self):
+        return self._position
+
+    async def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = await self.content_length() + offset
+        return self._position
+
+    async def read(self, size=-1):
+        if size == 0 or self.tell() >= await self.content_length():
+            return b''
+        if size is None or size < 0:
+            rng = "bytes={:d}-".format(self.tell())
+        else:
+            rng = "bytes={:d}-{:d}".format(self.tell(), self.tell() + size-1)
+        resp = await self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                            Range=rng)
+        async with resp['Body'] as body:
+            data = await body.read()
+        self._position += len(data)
+        return data
+
+
+async def upload(fp, bucket, key, client, chunksize=S3_BUFFER_SIZE,
+                 window=S3_UPLOAD_WORKERS):
+    """Upload the async file-like object ``fp`` as a multipart upload.
+
+    This is the asyncio counterpart of :func:`slingshot.s3.upload`. At most
+    ``window`` parts are read ahead and in flight at once, and the upload
+    is aborted if any part fails.
+    """
+    mp = await client.create_multipart_upload(Bucket=bucket, Key=key)
+    mp_id = mp["UploadId"]
+    parts = []
+    pending = set()
+    try:
+        try:
+            i = 1
+            while True:
+                if len(pending) >= window:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED)
+                    parts.extend(t.result() for t in done)
+                chunk = await fp.read(chunksize)
+                if not chunk:
+                    break
+                pending.add(asyncio.ensure_future(
+                    _upload_part(client, chunk, bucket, key, i, mp_id)))
+                i += 1
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                parts.extend(t.result() for t in done)
+        except BaseException:
+            for t in pending:
+                t.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+        parts.sort(key=lambda p: p["PartNumber"])
+        res = await client.complete_multipart_upload(
+            Bucket=bucket, Key=key, MultipartUpload={"Parts": parts},
+            UploadId=mp_id)
+    except BaseException:
+        await client.abort_multipart_upload(Bucket=bucket, Key=key,
+                                            UploadId=mp_id)
+        raise
+    return res
+
+
+async def _upload_part(client, chunk, bucket, key, part_number, upload_id):
+    res = await client.upload_part(Body=chunk, Bucket=bucket, Key=key,
+                                   PartNumber=part_number, UploadId=upload_id)
+    return {"PartNumber": part_number, "ETag": res["ETag"]}
+
+
+async def copy(src_bucket, src_key, start, length, bucket, key, client,
+               chunksize=S3_BUFFER_SIZE, workers=S3_UPLOAD_WORKERS):
+    """Asyncio counterpart of :func:`slingshot.s3.copy`.
+
+    Up to ``workers`` parts are copied at once.
+    """
+    if not length:
+        return await client.put_object(Bucket=bucket, Key=key, Body=b'')
+    source = {"Bucket": src_bucket, "Key": src_key}
+    mp = await client.create_multipart_upload(Bucket=bucket, Key=key)
+    mp_id = mp["UploadId"]
+    semaphore = asyncio.Semaphore(workers)
+
+    async def copy_part(i, offset):
+        last = min(offset + chunksize, start + length) - 1
+        async with semaphore:
+            res = await client.upload_part_copy(
+                Bucket=bucket, Key=key, CopySource=source,
+                CopySourceRange="bytes={:d}-{:d}".format(offset, last),
+                PartNumber=i, UploadId=mp_id)
+        return {"PartNumber": i, "ETag": res["CopyPartResult"]["ETag"]}
+
+    try:
+        parts = await asyncio.gather(*[
+            copy_part(i, offset) for i, offset in
+            enumerate(range(start, start + length, chunksize), start=1)])
+        return await client.complete_multipart_upload(
+            Bucket=bucket, Key=key, MultipartUpload={"Parts": list(parts)},
+            UploadId=mp_id)
+    except BaseException:
+        await client.abort_multipart_upload(Bucket=bucket, Key=key,
+                                            UploadId=mp_id)
+        raise
+
+
+async def unpack_zip(src_bucket, key, dest_bucket, client,
+                     workers=UNPACK_WORKERS,
+                     max_inflight=UNPACK_MAX_INFLIGHT):
+    """Asyncio counterpart of :func:`slingshot.app.unpack_zip`.
+
+    The central directory is read with one or two range requests from the
+    end of the zipfile. For each member the local header is read and its
+    data is then streamed with a single range request. Stored members are
+    copied server-side. Up to ``workers`` members are extracted at once.
+    Returns a :class:`slingshot.layer.Manifest` of the extracted objects.
+    """
+    name = os.path.splitext(key)[0]
+    manifest = Manifest(dest_bucket, name)
+    members = await _read_central_directory(client, src_bucket, key)
+    budget = _AsyncByteBudget(max_inflight)
+    members = [m for m in members if not m.is_dir()]
+    queue = iter(enumerate(members))
+    entries = [None] * len(members)
+
+    async def extract(info):
+        dest = os.path.join(name, os.path.basename(info.filename))
+        fp = _AsyncMember(client, src_bucket, key, info)
+        if info.compress_type == ZIP_STORED and not info.flag_bits & 0x1:
+            start = await fp.data_offset()
+            res = await copy(src_bucket, key, start, info.file_size,
+                             dest_bucket, dest, client)
+        else:
+            cost = min(info.file_size, S3_BUFFER_SIZE * S3_UPLOAD_WORKERS)
+            async with budget.reserve(cost):
+                try:
+                    res = await upload(fp, dest_bucket, dest, client)
+                finally:
+                    await fp.close()
+        return dest, info.file_size, res['ETag']
+
+    async def worker():
+        # The workers share one iterator, so each member is taken once.
+        for i, info in queue:
+            entries[i] = await extract(info)
+
+    await asyncio.gather(*[worker() for _ in range(workers)])
+    for entry in entries:
+        manifest.add(*entry)
+    return manifest
+
+
+async def _read_central_directory(client, bucket, key):
+    fp = AsyncS3IO(client, bucket, key)
+    size = await fp.content_length()
+    start = max(0, size - _ZIP_TAIL_SIZE)
+    while True:
+        await fp.seek(start)
+        tail = _Tail(size, start, await fp.read())
+        try:
+            with ZipFile(tail) as zf:
+                return zf.infolist()
+        except _OutOfRange as e:
+            if e.offset >= start:
+                raise BadZipFile("Could not read central directory")
+            start = e.offset
+
+
+class _OutOfRange(Exception):
+    def __init__(self, offset):
+        self.offset = offset
+
+
+class _Tail(io.RawIOBase):
+    """A seekable view of the end of an object.
+
+    Reading before the fetched region raises ``_OutOfRange`` with the
+    offset that would have been needed.
+    """
+    def __init__(self, size, start, data):
+        self._size = size
+        self._start = start
+        self._data = data
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._size + offset
+        return self._position
+
+    def readinto(self, b):
+        if self._position < self._start:
+            raise _OutOfRange(self._position)
+        offset = self._position - self._start
+        data = self._data[offset:offset + len(b)]
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class _AsyncMember:
+    """An async file-like object of the uncompressed data of a zip member.
+
+    The member's local header and compressed data are streamed from a
+    single range request.
+    """
+    def __init__(self, client, bucket, key, info):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.info = info
+        self._body = None
+        self._left = 0
+        self._crc = 0
+        self._buffer = bytearray()
+        if info.compress_type == ZIP_DEFLATED:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif info.compress_type == ZIP_STORED:
+            self._decompressor = None
+        else:
+            raise BadZipFile('Unsupported compression method {} for {}'
+                             .format(info.compress_type, info.filename))
+
+    async def data_offset(self):
+        fp = AsyncS3IO(self.client, self.bucket, self.key)
+        await fp.seek(self.info.header_offset)
+        header = LOCAL_HEADER.unpack(await fp.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_SIG:
+            raise BadZipFile("Bad local file header for {}"
+                             .format(self.info.filename))
+        return self.info.header_offset + LOCAL_HEADER.size + header[-2] + \
+            header[-1]
+
+    async def read(self, size=-1):
+        """Read ``size`` bytes, or fewer only at the end of the member.
+
+        As with :class:`slingshot.zipstream.ZipStream`, a read is only
+        short at the end of the data so that each part of a multipart
+        upload is a full ``chunksize``.
+        """
+        if self._body is None:
+            await self._open()
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                data = await self.read(S3_BUFFER_SIZE)
+                if not data:
+                    return b''.join(chunks)
+                chunks.append(data)
+        while len(self._buffer) < size and self._left:
+            self._buffer += await self._read(size - len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._crc = zlib.crc32(data, self._crc)
+        if not self._left and not self._buffer and self._crc != self.info.CRC:
+            raise BadZipFile('Bad CRC-32 for file {}'
+                             .format(self.info.filename))
+        return data
+
+    async def _read(self, size):
+        chunk = await self._body.read(min(size, self._left))
+        if not chunk:
+            raise BadZipFile('Unexpected end of data for file {}'
+                             .format(self.info.filename))
+        self._left -= len(chunk)
+        if self._decompressor is None:
+            return chunk
+        data = self._decompressor.decompress(chunk)
+        if not self._left:
+            data += self._decompressor.flush()
+        return data
+
+    async def close(self):
+        if self._body is not None:
+            self._body.close()
+
+    async def _open(self):
+        start = await self.data_offset()
+        self._left = self.info.compress_size
+        if not self._left:
+            self._body = _Empty()
+            return
+        rng = "bytes={:d}-{:d}".format(start, start + self._left - 1)
+        resp = await self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                            Range=rng)
+        self._body = resp['Body']
+
+
+class _Empty:
+    async def read(self, size=-1):
+        return b''
+
+    def close(self):
+        pass
+
+
+class _AsyncByteBudget:
+    """Asyncio counterpart of :class:`slingshot.app._ByteBudget`."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self.used or
+                                      self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+
+
+class AsyncS3Layer:
+    """Asyncio counterpart of :class:`slingshot.layer.S3Layer`.
+
+    Only the accessors for the files in the layer are provided. Each
+    returns an :class:`AsyncS3IO`.
+    """
+    def __init__(self, bucket, key, client, manifest=None):
+        self.bucket = bucket
+        self.key = key
+        self.client = client
+        self._manifest = manifest
+
+    async def manifest(self):
+        """The :class:`slingshot.layer.Manifest` for this layer."""
+        if self._manifest is None:
+            manifest = Manifest(self.bucket, self.key)
+            paginator = self.client.get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=self.bucket,
+                                                 Prefix=self.key):
+                for obj in page.get('Contents', []):
+                    if not obj['Key'].endswith('/'):
+                        manifest.add(obj['Key'], obj['Size'], obj['ETag'])
+            self._manifest = manifest
+        return self._manifest
+
+    async def open(self, ext):
+        """Return the single file in the layer with the extension ``ext``."""
+        keys = [k for k in await self.manifest() if k.endswith(ext)]
+        if not keys:
+            raise PackageError('Could not find file with extension {}'
+                               .format(ext))
+        if len(keys) > 1:
+            raise PackageError('Multiple files with extension {}'.format(ext))
+        return AsyncS3IO(self.client, self.bucket, keys[0])
+
+    async def gbl_record(self):
+        return await self.open('geoblacklight.json')
+
+    async def shp(self):
+        return await self.open('.shp')
+
+    async def shx(self):
+        return await self.open('.shx')
+
+    async def dbf(self):
+        return await self.open('.dbf')
+
+    async def prj(self):
+        return await self.open('.prj')
+
+    async def tif(self):
+        try:
+            return await self.open('.tif')
+        except PackageError:
+            return await self.open('.tiff')
@@ -1,25 +1,36 @@
-import base64
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+import logging
 import os
+import tempfile
 import threading
-import uuid
-from zipfile import ZipFile
+from zipfile import BadZipFile, ZIP_STORED, ZipFile
 
 import attr
-import requests
 
-from slingshot import PUBLIC_WORKSPACE, RESTRICTED_WORKSPACE, DATASTORE
+from slingshot import (COPY_WORKERS, PUBLIC_WORKSPACE, RESTRICTED_WORKSPACE,
+                       S3_BUFFER_SIZE, S3_UPLOAD_WORKERS, UNPACK_MAX_INFLIGHT,
+                       UNPACK_WORKERS)
+from slingshot.cog import to_cog
 from slingshot.db import load_layer
-from slingshot.layer import create_layer
+from slingshot.layer import create_layer, Manifest, PackageError
 from slingshot.parsers import FGDCParser, parse
-from slingshot.record import Record
-from slingshot.s3 import S3IO, session, upload
+from slingshot.record import make_slug, Record
+from slingshot.s3 import (BlockCache, ClientObject, clients, copy, S3IO,
+                          upload)
+from slingshot.tiff import TiffError
+from slingshot.zipstream import LOCAL_HEADER, LOCAL_SIG, ZipStream
 
 
 SUPPORTED_EXT = ('.shp', '.tif', '.tiff')
 
+logger = logging.getLogger(__name__)
 
-def unpack_zip(src_bucket, key, dest_bucket, endpoint=None):
+
+def unpack_zip(src_bucket, key, dest_bucket, endpoint=None,
+               workers=UNPACK_WORKERS, max_inflight=UNPACK_MAX_INFLIGHT,
+               streaming=False):
     """Extract contents of s3://<src_bucket>/<key> into destination bucket.
 
     The uploaded zipfile contains both metadata and data and the structure
@@ -28,17 +39,102 @@ def unpack_zip(src_bucket, key, dest_bucket, endpoint=None):
     the uploaded file as a key prefix. Any subdirectories within the
     uploaded zipfile are removed leaving a flattened structure in the new
     object.
+
+    Members that are stored without compression are copied server-side
+    from their byte range in the zipfile. Only compressed members are
+    streamed through this process.
+
+    Up to ``workers`` members are extracted concurrently, each worker
+    reading through its own ``ZipFile``. A member being streamed reserves
+    the memory its upload can use, and no more than ``max_inflight`` bytes
+    will be reserved at once.
+
+    With ``streaming`` set, the zipfile is instead read from start to
+    finish with a single request and members are extracted one at a time
+    as they are reached. See :class:`slingshot.zipstream.ZipStream`.
+
+    Returns a :class:`slingshot.layer.Manifest` of the extracted objects.
     """
-    s3 = session().resource('s3', endpoint_url=endpoint)
     name = os.path.splitext(key)[0]
-    obj = S3IO(s3.Object(src_bucket, key))
-    client = session().client('s3', endpoint_url=endpoint)
-    with ZipFile(obj) as zf:
-        for f in [m for m in zf.infolist() if not m.is_dir()]:
-            dest = os.path.join(name, os.path.basename(f.filename))
-            with zf.open(f) as fp:
-                upload(fp, dest_bucket, dest, client)
-    return dest_bucket, name
+    manifest = Manifest(dest_bucket, name)
+    client = clients.client('s3', endpoint_url=endpoint)
+    src = ClientObject(client, src_bucket, key)
+    if streaming:
+        body = src.get()['Body']
+        for info, fp in ZipStream(body):
+            if not info.is_dir():
+                dest = os.path.join(name, os.path.basename(info.filename))
+                res = upload(fp, dest_bucket, dest, client)
+                manifest.add(dest, fp.size, res['ETag'])
+        return manifest
+    with ZipFile(S3IO(src, cache=BlockCache())) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir()]
+    budget = _ByteBudget(max_inflight)
+    handles = threading.local()
+    opened = []
+
+    def extract(info):
+        try:
+            obj, zf = handles.obj, handles.zf
+        except AttributeError:
+            obj = S3IO(ClientObject(client, src_bucket, key,
+                                    src.content_length), cache=BlockCache())
+            zf = ZipFile(obj)
+            handles.obj, handles.zf = obj, zf
+            opened.append(zf)
+        dest = os.path.join(name, os.path.basename(info.filename))
+        if info.compress_type == ZIP_STORED and not info.flag_bits & 0x1:
+            res = copy(src_bucket, key, _data_offset(obj, info),
+                       info.file_size, dest_bucket, dest, client)
+        else:
+            cost = min(info.file_size, S3_BUFFER_SIZE * S3_UPLOAD_WORKERS)
+            with budget.reserve(cost):
+                with zf.open(info) as fp:
+                    res = upload(fp, dest_bucket, dest, client)
+        return dest, info.file_size, res['ETag']
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(extract, m) for m in members]:
+                manifest.add(*future.result())
+    finally:
+        for zf in opened:
+            zf.close()
+    return manifest
+
+
+class _ByteBudget:
+    """Limit the number of bytes reserved across threads.
+
+    A reservation larger than the whole limit is allowed once nothing else
+    is reserved, so a single large member can never deadlock.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, size):
+        with self._cond:
+            self._cond.wait_for(lambda: not self.used or
+                                self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+
+
+def _data_offset(fp, info):
+    """Return the offset of a zip member's data in the archive."""
+    fp.seek(info.header_offset)
+    header = LOCAL_HEADER.unpack(fp.read(LOCAL_HEADER.size))
+    if header[0] != LOCAL_SIG:
+        raise BadZipFile("Bad local file header for {}".format(info.filename))
+    return info.header_offset + LOCAL_HEADER.size + header[-2] + header[-1]
 
 
 def create_record(layer, geoserver, download_url):
@@ -76,170 +172,86 @@ def create_record(layer, geoserver, download_url):
     return record
 
 
-def make_uuid(value, namespace='mit.edu'):
-    ns = uuid.uuid5(uuid.NAMESPACE_DNS, namespace)
-    return uuid.uuid5(ns, value)
-
+def publish_layer(bucket, key, geoserver, solr, destination, ogc_proxy,
+                  download_url, s3_url=None, require_cog=False,
+                  convert_cog=False, copy_format='text',
+                  copy_workers=COPY_WORKERS, bulk_load=False,
+                  unlogged=False, sync=False, generalize_at=(),
+                  hilbert=False):
+    """Publish an uploaded layer package.
+
+    Returns the name of the layer. If ``solr`` is a
+    :class:`slingshot.services.SolrBatcher`, the record is only queued, and
+    a future is returned instead which resolves to the name once the
+    record has been added, so that the caller is free to publish the next
+    layer in the meantime.
+    """
+    manifest = unpack_zip(bucket, key, destination, s3_url)
+    layer = create_layer(manifest.bucket, manifest.prefix, s3_url, manifest)
+    if layer.format == "GeoTiff":
+        if convert_cog and not layer.tiff.is_cog:
+            try:
+                convert_geotiff(layer)
+            except TiffError as e:
+                logger.warning("Could not convert {} to a Cloud Optimized "
+                               "GeoTIFF: {}".format(layer.name, e))
+        check_geotiff(layer, require_cog)
+    layer.record = create_record(layer, ogc_proxy, download_url)
+    layer.fgdc.obj.Acl().put(ACL="public-read")
+    if layer.format == "Shapefile":
+        load_layer(layer, copy_format=copy_format, workers=copy_workers,
+                   bulk=bulk_load, unlogged=unlogged, sync=sync,
+                   generalize_at=generalize_at, hilbert=hilbert)
+    geoserver.add(layer)
+    indexed = solr.add(layer.record.as_dict())
+    if indexed is None:
+        return layer.name
+    return _then(indexed, layer.name)
 
-def make_slug(name):
-    uid = make_uuid(name)
-    b32 = base64.b32encode(uid.bytes[:8])
-    return 'mit-' + b32.decode('ascii').rstrip('=').lower()
 
+def _then(future, value):
+    """Return a future for ``value`` once ``future`` has succeeded."""
+    chained = Future()
 
-class HttpSession:
-    """Threadsafe requests.Session.
+    def done(f):
+        if f.exception() is not None:
+            chained.set_exception(f.exception())
+        else:
+            chained.set_result(value)
 
-    This can be used more or less like the usual requests.Session. The only
-    method it supports is ``request``. For example::
+    future.add_done_callback(done)
+    return chained
 
-        session = HttpSession()
-        def run():
-            session.request("GET", "https://httpbin.org")
 
-        t = threading.Thread(target=run)
-        t.start()
+def convert_geotiff(layer):
+    """Rewrite a GeoTiff layer as a Cloud Optimized GeoTIFF.
 
+    The TIFF is converted into a local temporary file by
+    :func:`slingshot.cog.to_cog` which then replaces the original in S3.
     """
-    def __init__(self):
-        self._session = threading.local()
+    obj = layer.s3.Object(layer.bucket, layer.tif)
+    with tempfile.TemporaryFile() as fp:
+        to_cog(S3IO(obj), fp)
+        layer.replace_tif(fp)
 
-    @property
-    def session(self):
-        try:
-            return self._session.s
-        except AttributeError:
-            self._session.s = requests.Session()
-        return self._session.s
-
-    def request(self, method, url, **kwargs):
-        return self.session.request(method, url, **kwargs)
-
-
-class HttpMethodMixin:
-    def post(self, url, **kwargs):
-        return self.request("POST", url, **kwargs)
-
-    def put(self, url, **kwargs):
-        return self.request("PUT", url, **kwargs)
-
-    def delete(self, url, **kwargs):
-        return self.request("DELETE", url, **kwargs)
-
-
-class GeoServer(HttpMethodMixin):
-    def __init__(self, url, client, auth=None, s3_alias="s3"):
-        self.url = url.rstrip("/")
-        self.client = client
-        self.auth = auth
-        self.s3_alias = s3_alias
-
-    def request(self, method, path, **kwargs):
-        """Make a request.
-
-        Note the use of ``stream=False`` here. This ensures the session pool
-        still gets used even if the response is not fully read. This
-        shouldn't be a problem as none of the responses received here will be
-        very large.
-        """
-        kwargs = {"stream": False, "auth": self.auth, **kwargs}
-        url = "{}/rest/{}".format(self.url, path.lstrip("/"))
-        r = self.client.request(method, url, **kwargs)
-        r.raise_for_status()
-        return r
-
-    def add(self, layer):
-        """Add the layer to GeoServer.
-
-        In the case of of a Shapefile, the layer should already exist in the
-        PostGIS database. In the case of a GeoTiff, the file should already
-        exist in S3.
-        """
-        if layer.format == 'Shapefile':
-            self._add_feature(layer)
-        elif layer.format == 'GeoTiff':
-            self._add_coverage(layer)
-        else:
-            raise Exception("Unknown format")
-
-    def _add_coverage(self, layer):
-        workspace = PUBLIC_WORKSPACE if layer.is_public() else \
-            RESTRICTED_WORKSPACE
-        data = {
-            "coverageStore": {
-                "name": layer.name,
-                "type": "S3GeoTiff",
-                "enabled": True,
-                "url": "{}://{}/{}".format(self.s3_alias, layer.bucket,
-                                           layer.tif),
-                "workspace": {"name": workspace},
-            }
-        }
-        url = "/workspaces/{}/coveragestores".format(workspace)
-        self.post(url, json=data)
-        data = {
-            "coverage": {
-                "enabled": True,
-                "name": layer.name,
-                "nativeName": layer.name,
-                "nativeFormat": "S3GeoTiff",
-                "defaultInterpolationMethod": "nearest neighbor",
-                "parameters": {
-                    "entry": [
-                        {"string": ["SUGGESTED_TILE_SIZE", "512,512"]},
-                        {"string": ["AwsRegion", "US_EAST_1"]},
-                    ]
-                }
-            }
-        }
-        url = "/workspaces/{}/coveragestores/{}/coverages".format(workspace,
-                                                                  layer.name)
-        self.post(url, json=data)
-
-    def _add_feature(self, layer):
-        workspace = PUBLIC_WORKSPACE if layer.is_public() else \
-            RESTRICTED_WORKSPACE
-        data = {"featureType": {"name": layer.name}}
-        url = "/workspaces/{}/datastores/{}/featuretypes".format(workspace,
-                                                                 DATASTORE)
-        self.post(url, json=data)
-
-
-class Solr(HttpMethodMixin):
-    def __init__(self, url, client, auth=None):
-        self.url = url.rstrip("/")
-        self.client = client
-        self.auth = auth
-
-    def request(self, method, path, **kwargs):
-        kwargs = {"stream": False, "auth": self.auth, **kwargs}
-        url = "{}/{}".format(self.url, path.lstrip("/"))
-        r = self.client.request(method, url, **kwargs)
-        r.raise_for_status()
-        return r
-
-    def add(self, record, soft_commit=True):
-        params = {"softCommit": "true"} if soft_commit else None
-        self.post('update/json/docs', params=params, json=record)
-
-    def delete(self, query='dct_provenance_s:MIT'):
-        self.post('update', json={'delete': {'query': query}})
-
-    def commit(self):
-        self.post('update', json={'commit': {}})
 
+def check_geotiff(layer, require_cog=False):
+    """Check that a GeoTiff layer is a Cloud Optimized GeoTIFF.
 
-def publish_layer(bucket, key, geoserver, solr, destination, ogc_proxy,
-                  download_url, s3_url=None):
-    unpacked = unpack_zip(bucket, key, destination, s3_url)
-    layer = create_layer(*unpacked, s3_url)
-    layer.record = create_record(layer, ogc_proxy, download_url)
-    layer.fgdc.obj.Acl().put(ACL="public-read")
-    if layer.format == "Shapefile":
-        load_layer(layer)
-    geoserver.add(layer)
-    solr.add(layer.record.as_dict())
-    return layer.name
+    GeoServer reads GeoTIFFs from S3 a tile at a time, which is very slow
+    for a striped TIFF or one without overviews. A layer that is not a COG
+    is logged, or if ``require_cog`` is set, raises a
+    :class:`slingshot.layer.PackageError`.
+    """
+    tiff = layer.tiff
+    if tiff.is_cog:
+        return
+    msg = "{} is not a Cloud Optimized GeoTIFF (tiled: {}, overviews: {}, " \
+        "compression: {})".format(layer.name, tiff.tiled, len(tiff.overviews),
+                                  tiff.compression)
+    if require_cog:
+        raise PackageError(msg)
+    logger.warning(msg)
 
 
 def publishable_layers(bucket, dynamodb):
@@ -0,0 +1,121 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+
+from slingshot import DISK_CACHE_SIZE, S3_BUFFER_SIZE
+
+
+class DiskCache:
+    """A content-addressed disk cache for S3 objects.
+
+    Objects are stored in a local directory under a name derived from their
+    bucket, key and ETag, so a changed object is never served stale. Cached
+    objects are read back through memory-mapped files. When the total size
+    of the directory grows past ``max_size`` the least recently used files
+    are removed.
+
+    The cache is disabled until :meth:`configure` is called. Use the global
+    module-level ``disk_cache`` instance of this class.
+    """
+    def __init__(self):
+        self.directory = None
+        self.max_size = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def configure(self, directory, max_size=DISK_CACHE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def get(self, s3_obj):
+        """Return a memory map of the contents of the ``s3_obj``.
+
+        If the object is not already in the cache it will be downloaded.
+        This returns ``None`` when the cache is disabled or the object is
+        too big to be cached. An empty object is returned as ``b''`` since
+        an empty file cannot be memory-mapped.
+
+        Files are only opened, replaced and removed while holding the lock,
+        and space for a download is set aside before it starts, so that
+        concurrent downloads do not take the cache past ``max_size``. A
+        file that is evicted after it was mapped stays readable through
+        the map.
+        """
+        if not self.enabled:
+            return None
+        size = s3_obj.content_length
+        if size > self.max_size:
+            return None
+        if not size:
+            return b''
+        path = os.path.join(self.directory, self._name(s3_obj))
+        with self._lock:
+            try:
+                os.utime(path)
+                return self._map(path)
+            except FileNotFoundError:
+                self._pending += size
+                self._evict()
+        try:
+            tmp = self._download(s3_obj)
+        except Exception:
+            with self._lock:
+                self._pending -= size
+            raise
+        with self._lock:
+            self._pending -= size
+            os.replace(tmp, path)
+            local = self._map(path)
+            self._evict()
+        return local
+
+    def _name(self, s3_obj):
+        ident = "{}/{}/{}".format(s3_obj.bucket_name, s3_obj.key,
+                                  s3_obj.e_tag)
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+    def _download(self, s3_obj):
+        """Download the ``s3_obj`` to a temporary file and return its path."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                body = s3_obj.get(IfMatch=s3_obj.e_tag)['Body']
+                for chunk in body.iter_chunks(S3_BUFFER_SIZE):
+                    fp.write(chunk)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return tmp
+
+    def _map(self, path):
+        with open(path, 'rb') as fp:
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _evict(self):
+        """Remove the least recently used files until the cache, counting
+        the downloads in progress, fits in ``max_size``. The caller must
+        hold the lock."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(e[1] for e in entries) + self._pending
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+disk_cache = DiskCache()
@@ -1,4 +1,5 @@
-from concurrent.futures import as_completed, ThreadPoolExecutor
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
 from datetime import datetime
 import io
 import itertools
@@ -8,20 +9,19 @@ import traceback
 from urllib.parse import urlparse
 
 import click
-from sqlalchemy.engine.url import URL
 
 from slingshot import (state, PUBLIC_WORKSPACE, RESTRICTED_WORKSPACE,
-                       DATASTORE, S3_BUFFER_SIZE)
-from slingshot.app import (GeoServer, HttpSession, publish_layer,
-                           publishable_layers, Solr)
-from slingshot.db import engine
-from slingshot.marc import filter_record, MarcParser
-from slingshot.record import Record
-from slingshot.s3 import session, S3IO
+                       DATASTORE, COPY_WORKERS, DISK_CACHE_SIZE,
+                       S3_BUFFER_SIZE, S3_UPLOAD_WORKERS, UNPACK_WORKERS)
 
+# Only lightweight modules are imported here. Each command imports what it
+# needs itself so that short-lived invocations, like ``--help``, do not pay
+# for loading boto3, SQLAlchemy and the rest.
 
 logger = logging.getLogger()
 logger.setLevel(logging.ERROR)
+# Non-COG GeoTIFFs are reported as warnings when publishing.
+logging.getLogger('slingshot.app').setLevel(logging.WARNING)
 
 
 @click.group()
@@ -52,6 +52,8 @@ def initialize(geoserver, geoserver_user, geoserver_password, db_host, db_port,
     This command will create the workspaces and datastores the are needed
     for loading data into GeoServer.
     """
+    from slingshot.services import GeoServer, HttpSession
+
     datastore = {
         "dataStore": {
             "name": DATASTORE,
@@ -135,15 +137,68 @@ def initialize(geoserver, geoserver_user, geoserver_password, db_host, db_port,
 @click.option('--upload-bucket', help="Name of S3 bucket for uploaded layers")
 @click.option('--storage-bucket', help="Name of S3 bucket for stored layers")
 @click.option('--num-workers', default=1,
-              help="Number of worker threads to use. There is likely not much "
-                   "point in setting this higher than the database connection "
-                   "pool size which is 5 by default. Defaults to 1.")
+              help="Number of worker threads to use. The database and S3 "
+                   "connection pools are sized from this. Defaults to 1.")
+@click.option('--cache-dir', envvar='SLINGSHOT_CACHE_DIR',
+              help="Directory for caching the layer files read from S3. "
+                   "Files are only cached if this is set.")
+@click.option('--cache-size', envvar='SLINGSHOT_CACHE_SIZE',
+              default=DISK_CACHE_SIZE,
+              help="Maximum size in bytes of the S3 object cache. Default "
+                   "value: 1 GiB")
+@click.option('--require-cog', is_flag=True,
+              help="Fail to publish GeoTIFFs that are not Cloud Optimized "
+                   "GeoTIFFs. Otherwise a warning is logged.")
+@click.option('--convert-cog', is_flag=True,
+              help="Rewrite striped GeoTIFFs as Cloud Optimized GeoTIFFs "
+                   "before publishing them.")
+@click.option('--copy-format', type=click.Choice(['text', 'binary']),
+              default='text',
+              help="Format used to COPY shapefiles into PostGIS. The binary "
+                   "format sends geometries as EWKB. Default value: text")
+@click.option('--copy-workers', default=COPY_WORKERS,
+              help="Maximum number of concurrent COPYs, each on its own "
+                   "database connection, used to load a single large "
+                   "shapefile. Default value: 4")
+@click.option('--bulk-load', is_flag=True,
+              help="Create, load and index each shapefile's table in a "
+                   "single transaction, using COPY FREEZE and analyzing the "
+                   "table afterwards. Shapefiles are then loaded over one "
+                   "connection.")
+@click.option('--unlogged', is_flag=True,
+              help="Load shapefiles into UNLOGGED tables which are switched "
+                   "to LOGGED once loaded and indexed.")
+@click.option('--sync', is_flag=True,
+              help="When a shapefile's table already exists, load the "
+                   "shapefile into a staging table and apply only the rows "
+                   "that changed, or replace the table if most of it "
+                   "changed. Otherwise republishing a shapefile fails.")
+@click.option('--generalize', type=float, multiple=True,
+              help="Tolerance, in the units of the layer's coordinate "
+                   "system, at which to make a simplified copy of line and "
+                   "polygon shapefiles for rendering at small scales. The "
+                   "copies are added to GeoServer as their own feature "
+                   "types. Can be given more than once.")
+@click.option('--hilbert', is_flag=True,
+              help="Load shapefile records in Hilbert curve order of their "
+                   "bounding boxes so tables are spatially clustered. Each "
+                   "shapefile is then copied over one connection.")
 def publish(layers, db_uri, db_user, db_password, db_host, db_port, db_name,
             db_schema, geoserver, geoserver_user,
             geoserver_password, solr, solr_user, solr_password,
             s3_endpoint, s3_alias, dynamo_endpoint, dynamo_table, aws_region,
             upload_bucket, storage_bucket, num_workers, publish_all,
-            ogc_proxy, download_url):
+            ogc_proxy, download_url, cache_dir, cache_size, require_cog,
+            convert_cog, copy_format, copy_workers, bulk_load, unlogged,
+            sync, generalize, hilbert):
+    from sqlalchemy.engine.url import URL
+
+    from slingshot.app import publish_layer, publishable_layers
+    from slingshot.cache import disk_cache
+    from slingshot.db import engine
+    from slingshot.s3 import clients
+    from slingshot.services import GeoServer, HttpSession, Solr
+
     if not any((layers, publish_all)) or all((layers, publish_all)):
         raise click.ClickException(
             "You must specify either one or more uploaded layer package names "
@@ -157,40 +212,64 @@ def publish(layers, db_uri, db_user, db_password, db_host, db_port, db_name,
     else:
         uri = URL("postgresql", username=db_user, password=db_password,
                   host=db_host, port=db_port, database=db_name)
-    engine.configure(uri, db_schema)
+    pool_size = max(5, num_workers * copy_workers)
+    engine.configure(uri, db_schema, pool_size=pool_size)
+    if cache_dir:
+        disk_cache.configure(cache_dir, cache_size)
     geo_svc = GeoServer(geoserver, HttpSession(), auth=geo_auth,
                         s3_alias=s3_alias)
     solr_svc = Solr(solr, HttpSession(), auth=solr_auth)
-    dynamo = session().resource("dynamodb", endpoint_url=dynamo_endpoint,
-                                region_name=aws_region)
-    s3 = session().resource("s3", endpoint_url=s3_endpoint,
-                            region_name=aws_region)
+    # Each worker extracts UNPACK_WORKERS members at once, and each of
+    # those uploads S3_UPLOAD_WORKERS parts at once.
+    clients.configure(max_pool_connections=max(
+        10, num_workers * UNPACK_WORKERS * S3_UPLOAD_WORKERS))
+    dynamo = clients.resource("dynamodb", endpoint_url=dynamo_endpoint,
+                              region_name=aws_region)
+    s3 = clients.resource("s3", endpoint_url=s3_endpoint,
+                          region_name=aws_region)
     dynamodb = dynamo.Table(dynamo_table)
     if publish_all:
         work = publishable_layers(s3.Bucket(upload_bucket), dynamodb)
     else:
         work = layers
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        futures = {executor.submit(publish_layer, upload_bucket, layer,
-                                   geo_svc, solr_svc, storage_bucket,
-                                   ogc_proxy, download_url, s3_endpoint):
+    with solr_svc.batcher() as batcher, \
+            ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = {executor.submit(publish_layer, upload_bucket, layer,
+                                   geo_svc, batcher, storage_bucket,
+                                   ogc_proxy, download_url, s3_endpoint,
+                                   require_cog, convert_cog, copy_format,
+                                   copy_workers, bulk_load, unlogged,
+                                   sync, generalize, hilbert):
                    layer for layer in work}
-        for future in as_completed(futures):
-            layer = futures[future]
-            try:
-                res = future.result()
-            except Exception:
-                click.echo(f"Failed to publish {layer}")
-                click.echo(traceback.format_exc())
-                dynamodb.put_item(Item={
-                    "LayerName": os.path.splitext(layer)[0],
-                    "LastMod": datetime.utcnow().isoformat(timespec="seconds"),
-                    "State": state.FAILED})
-            else:
+        running = set(pending)
+        while pending:
+            if not running:
+                # Only records queued in Solr are left to wait for.
+                batcher.flush()
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                layer = pending.pop(future)
+                running.discard(future)
+                try:
+                    res = future.result()
+                except Exception:
+                    click.echo(f"Failed to publish {layer}")
+                    click.echo(traceback.format_exc())
+                    dynamodb.put_item(Item={
+                        "LayerName": os.path.splitext(layer)[0],
+                        "LastMod": datetime.utcnow().isoformat(
+                            timespec="seconds"),
+                        "State": state.FAILED})
+                    continue
+                if isinstance(res, Future):
+                    # The layer is published once its record is in Solr.
+                    pending[res] = layer
+                    continue
                 click.echo("Published {}".format(res))
                 dynamodb.put_item(Item={
                     "LayerName": os.path.splitext(layer)[0],
-                    "LastMod": datetime.utcnow().isoformat(timespec="seconds"),
+                    "LastMod": datetime.utcnow().isoformat(
+                        timespec="seconds"),
                     "State": state.PUBLISHED})
 
 
@@ -229,9 +308,14 @@ def marc(marc_file, solr, solr_user, solr_password, s3_endpoint, s3_alias,
     "Paper Map" or "Cartographic Material", and then index all appropriate
     records from the provided MARC file.
     """
+    from slingshot.marc import filter_record, MarcParser
+    from slingshot.record import Record
+    from slingshot.s3 import clients, S3IO
+    from slingshot.services import HttpSession, Solr
+
     fparts = urlparse(marc_file)
-    s3 = session().resource("s3", endpoint_url=s3_endpoint,
-                            region_name=aws_region)
+    s3 = clients.resource("s3", endpoint_url=s3_endpoint,
+                          region_name=aws_region)
     marc = io.BufferedReader(
                 S3IO(s3.Object(fparts.netloc, fparts.path.lstrip('/'))),
                 buffer_size=S3_BUFFER_SIZE)
@@ -0,0 +1,354 @@
+import shutil
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+from slingshot import COG_TILE_SIZE, S3_BUFFER_SIZE
+from slingshot.tiff import (BITS_PER_SAMPLE, COLORMAP, COMPRESSION,
+                            EXTRA_SAMPLES, IMAGE_LENGTH, IMAGE_WIDTH,
+                            NEW_SUBFILE_TYPE, PHOTOMETRIC, PLANAR_CONFIG,
+                            read_tiff, SAMPLE_FORMAT, SAMPLES_PER_PIXEL,
+                            STRIP_BYTE_COUNTS, STRIP_OFFSETS, TILE_BYTE_COUNTS,
+                            TILE_LENGTH, TILE_OFFSETS, TILE_WIDTH, TiffError)
+
+
+#: GeoTIFF and GDAL tags copied from the source image. The georeferencing
+#: tags are only written to the full resolution image.
+GEO_TAGS = (33550, 33922, 34264, 34735, 34736, 34737)
+GDAL_TAGS = (42112, 42113)
+
+#: Compression codes that can be read when converting.
+DEFLATE = (8, 32946)
+
+#: numpy kinds for the SampleFormat tag.
+SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+SAMPLE_FORMATS = {v: k for k, v in SAMPLE_KINDS.items()}
+
+#: Output files at least this large are written as BigTIFF.
+BIGTIFF_LIMIT = 1 << 32
+
+
+def to_cog(src, dst, tile_size=COG_TILE_SIZE, compress_level=6):
+    """Rewrite a striped GeoTIFF as a Cloud Optimized GeoTIFF.
+
+    ``src`` is a seekable file-like object for the source TIFF and the COG
+    is written to the file-like object ``dst``. The source must be striped
+    with chunky pixels, and either uncompressed or deflated with no
+    predictor or horizontal differencing. The output is tiled and deflated
+    with overviews, each half the size of the last, until the smallest fits
+    in a single tile.
+
+    Strips are read in order, a few rows at a time, and the image is cut
+    into tiles one row of tiles at a time. Overviews are made by decimating
+    the rows as they arrive, so memory use is bounded by a few rows of
+    tiles at each level rather than by the size of the raster. Tiles are
+    spooled to temporary files and copied into place once the size of
+    every IFD is known.
+    """
+    info = read_tiff(src)
+    ifd = info.image
+    dtype = _dtype(info, ifd)
+    if ifd.tiled:
+        raise TiffError('Only striped TIFFs can be converted')
+    if ifd.planar_config != 1:
+        raise TiffError('Only chunky (interleaved) TIFFs can be converted')
+    if ifd.compression not in (1,) + DEFLATE:
+        raise TiffError('Cannot convert TIFF with compression {}'
+                        .format(info.compression))
+    if ifd.predictor not in (1, 2) or (ifd.predictor == 2 and
+                                       dtype.kind == 'f'):
+        raise TiffError('Cannot convert TIFF with predictor {}'
+                        .format(ifd.predictor))
+    levels = _levels(ifd.width, ifd.height, tile_size)
+    spp = ifd.samples_per_pixel
+    pyramid = None
+    for width, height in reversed(levels):
+        pyramid = _Level(width, height, spp, dtype, tile_size,
+                         compress_level, pyramid)
+    try:
+        offsets = info.read_tag(src, ifd, STRIP_OFFSETS)
+        counts = info.read_tag(src, ifd, STRIP_BYTE_COUNTS)
+        if offsets is None or counts is None:
+            raise TiffError('TIFF has no strip offsets')
+        rows = ifd.block_height
+        row_bytes = ifd.width * spp * dtype.itemsize
+        for i, chunks in enumerate(_read_strips(src, offsets, counts)):
+            if ifd.compression in DEFLATE:
+                chunks = _inflate(chunks)
+            n = min(rows, ifd.height - i * rows)
+            for data in _whole_rows(chunks, row_bytes, n):
+                strip = np.frombuffer(data, dtype)
+                strip = strip.reshape(-1, ifd.width, spp)
+                if ifd.predictor == 2:
+                    strip = np.cumsum(strip, axis=1, dtype=dtype)
+                pyramid.add(strip)
+        pyramid.finish()
+        _write(dst, info, src, pyramid, tile_size)
+    finally:
+        level = pyramid
+        while level is not None:
+            level.close()
+            level = level.next
+
+
+class _Level:
+    """One level of the output pyramid.
+
+    Rows are copied into a buffer one row of tiles high until it is full,
+    at which point the tiles are compressed and spooled to a temporary
+    file. Every
+    other row and column is passed on to the next, smaller level.
+    """
+    def __init__(self, width, height, samples, dtype, tile_size,
+                 compress_level, next_level=None):
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.dtype = dtype
+        self.tile_size = tile_size
+        self.compress_level = compress_level
+        self.next = next_level
+        self.rows = 0
+        self.tiles = []
+        self.size = 0
+        self.file = tempfile.TemporaryFile()
+        self._band = np.zeros((tile_size, self.across * tile_size, samples),
+                              dtype)
+        self._pending_rows = 0
+
+    @property
+    def across(self):
+        return -(-self.width // self.tile_size)
+
+    def add(self, rows):
+        if self.next is not None:
+            decimated = rows[self.rows % 2::2, ::2]
+            if len(decimated):
+                self.next.add(decimated)
+        self.rows += len(rows)
+        while len(rows):
+            start = self._pending_rows
+            n = min(self.tile_size - start, len(rows))
+            self._band[start:start + n, :self.width] = rows[:n]
+            self._pending_rows += n
+            rows = rows[n:]
+            if self._pending_rows == self.tile_size:
+                self._flush(self.tile_size)
+
+    def finish(self):
+        if self._pending_rows:
+            self._flush(self._pending_rows)
+        if self.rows != self.height:
+            raise TiffError('Expected {} rows but read {}'
+                            .format(self.height, self.rows))
+        if self.next is not None:
+            self.next.finish()
+
+    def close(self):
+        self.file.close()
+
+    def _flush(self, n):
+        ts = self.tile_size
+        # The rows below a partial band still hold the previous band.
+        self._band[n:] = 0
+        self._pending_rows = 0
+        tiles = self._band.reshape(ts, self.across, ts, self.samples)
+        for i in range(self.across):
+            data = zlib.compress(
+                np.ascontiguousarray(tiles[:, i]).tobytes(),
+                self.compress_level)
+            self.file.write(data)
+            self.tiles.append((self.size, len(data)))
+            self.size += len(data)
+
+
+def _levels(width, height, tile_size):
+    levels = [(width, height)]
+    while width > tile_size or height > tile_size:
+        width, height = -(-width // 2), -(-height // 2)
+        levels.append((width, height))
+    return levels
+
+
+def _dtype(info, ifd):
+    bits = set(ifd.bits_per_sample)
+    formats = set(ifd.sample_format)
+    if len(bits) != 1 or len(formats) != 1:
+        raise TiffError('Samples must all have the same type')
+    bits, fmt = bits.pop(), formats.pop()
+    if bits not in (8, 16, 32, 64) or fmt not in SAMPLE_KINDS:
+        raise TiffError('Cannot convert {}-bit samples with format {}'
+                        .format(bits, fmt))
+    return np.dtype('{}{}{}'.format(info.byteorder, SAMPLE_KINDS[fmt],
+                                    bits // 8))
+
+
+def _read_strips(fp, offsets, counts):
+    """Yield the data of each strip as an iterator of chunks.
+
+    Strips that follow one another in the file are read with a single read
+    of up to ``S3_BUFFER_SIZE`` bytes so that a file with many small strips
+    does not need a request per strip. A strip larger than that is read
+    ``S3_BUFFER_SIZE`` bytes at a time as its chunks are consumed.
+    """
+    i = 0
+    while i < len(offsets):
+        if counts[i] > S3_BUFFER_SIZE:
+            yield _read_chunks(fp, offsets[i], counts[i])
+            i += 1
+            continue
+        j = i + 1
+        end = offsets[i] + counts[i]
+        while j < len(offsets) and offsets[j] == end and \
+                end + counts[j] - offsets[i] <= S3_BUFFER_SIZE:
+            end += counts[j]
+            j += 1
+        data = next(_read_chunks(fp, offsets[i], end - offsets[i]))
+        pos = 0
+        for k in range(i, j):
+            yield iter([data[pos:pos + counts[k]]])
+            pos += counts[k]
+        i = j
+
+
+def _read_chunks(fp, offset, count):
+    for pos in range(0, count, S3_BUFFER_SIZE):
+        size = min(S3_BUFFER_SIZE, count - pos)
+        fp.seek(offset + pos)
+        data = fp.read(size)
+        if len(data) < size:
+            raise TiffError('Unexpected end of TIFF file')
+        yield data
+
+
+def _inflate(chunks):
+    """Decompress a deflated strip, ``S3_BUFFER_SIZE`` bytes at a time."""
+    d = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk:
+            yield d.decompress(chunk, S3_BUFFER_SIZE)
+            chunk = d.unconsumed_tail
+    yield d.flush()
+
+
+def _whole_rows(chunks, row_bytes, rows):
+    """Regroup the data of a strip into blocks of whole rows.
+
+    Only the first ``rows`` rows are yielded, as the last strip may be
+    padded.
+    """
+    buf = bytearray()
+    left = rows * row_bytes
+    for chunk in chunks:
+        buf += chunk
+        size = min(len(buf) // row_bytes * row_bytes, left)
+        if size:
+            yield buf[:size]
+            del buf[:size]
+            left -= size
+        if not left:
+            return
+
+
+def _write(dst, info, src, pyramid, tile_size):
+    levels = []
+    level = pyramid
+    while level is not None:
+        levels.append(level)
+        level = level.next
+    total = sum(lvl.size for lvl in levels)
+    bigtiff = total + (1 << 20) >= BIGTIFF_LIMIT
+    bo = info.byteorder
+    off_type, off_fmt = (16, 'Q') if bigtiff else (4, 'L')
+    ifd = info.image
+    photometric = 1 if ifd.photometric is None else ifd.photometric
+    copied = {}
+    for tag in (COLORMAP, EXTRA_SAMPLES) + GDAL_TAGS + GEO_TAGS:
+        raw = info.read_raw(src, ifd, tag)
+        if raw is not None and raw[0] not in (16, 17, 18):
+            copied[tag] = raw
+
+    def entries(i, lvl, data_offset):
+        offsets = [data_offset + o for o, _ in lvl.tiles]
+        counts = [n for _, n in lvl.tiles]
+        spp = lvl.samples
+        bits = [lvl.dtype.itemsize * 8] * spp
+        formats = [SAMPLE_FORMATS[lvl.dtype.kind]] * spp
+        tags = {
+            NEW_SUBFILE_TYPE: (4, 1, _pack(bo, 'L', [1 if i else 0])),
+            IMAGE_WIDTH: (4, 1, _pack(bo, 'L', [lvl.width])),
+            IMAGE_LENGTH: (4, 1, _pack(bo, 'L', [lvl.height])),
+            BITS_PER_SAMPLE: (3, spp, _pack(bo, 'H', bits)),
+            COMPRESSION: (3, 1, _pack(bo, 'H', [8])),
+            PHOTOMETRIC: (3, 1, _pack(bo, 'H', [photometric])),
+            SAMPLES_PER_PIXEL: (3, 1, _pack(bo, 'H', [spp])),
+            PLANAR_CONFIG: (3, 1, _pack(bo, 'H', [1])),
+            TILE_WIDTH: (3, 1, _pack(bo, 'H', [tile_size])),
+            TILE_LENGTH: (3, 1, _pack(bo, 'H', [tile_size])),
+            TILE_OFFSETS: (off_type, len(offsets),
+                           _pack(bo, off_fmt, offsets)),
+            TILE_BYTE_COUNTS: (off_type, len(counts),
+                               _pack(bo, off_fmt, counts)),
+            SAMPLE_FORMAT: (3, spp, _pack(bo, 'H', formats)),
+        }
+        for tag, raw in copied.items():
+            if i == 0 or tag not in GEO_TAGS:
+                tags[tag] = raw
+        return sorted(tags.items())
+
+    # The size of each IFD does not depend on the offsets written into it,
+    # so lay them out once to find where the tile data starts.
+    header = 16 if bigtiff else 8
+    sizes = [len(_ifd(bo, bigtiff, entries(i, lvl, 0), 0, 0))
+             for i, lvl in enumerate(levels)]
+    data_offset = header + sum(sizes)
+    # Tile data is written smallest overview first, so that the full
+    # resolution image is at the end of the file.
+    starts = {}
+    for lvl in reversed(levels):
+        starts[id(lvl)] = data_offset
+        data_offset += lvl.size
+    dst.write(b'II' if bo == '<' else b'MM')
+    if bigtiff:
+        dst.write(struct.pack(bo + 'HHHQ', 43, 8, 0, header))
+    else:
+        dst.write(struct.pack(bo + 'HL', 42, header))
+    pos = header
+    for i, lvl in enumerate(levels):
+        nxt = pos + sizes[i] if i < len(levels) - 1 else 0
+        dst.write(_ifd(bo, bigtiff, entries(i, lvl, starts[id(lvl)]), pos,
+                       nxt))
+        pos += sizes[i]
+    for lvl in reversed(levels):
+        lvl.file.seek(0)
+        shutil.copyfileobj(lvl.file, dst, S3_BUFFER_SIZE)
+
+
+def _ifd(bo, bigtiff, entries, offset, next_offset):
+    """Serialize an IFD at ``offset`` followed by its out-of-line values."""
+    if bigtiff:
+        count_fmt, entry_fmt, off_fmt, inline = 'Q', 'HHQ', 'Q', 8
+    else:
+        count_fmt, entry_fmt, off_fmt, inline = 'H', 'HHL', 'L', 4
+    size = struct.calcsize(bo + count_fmt) + len(entries) * \
+        (struct.calcsize(bo + entry_fmt) + inline) + \
+        struct.calcsize(bo + off_fmt)
+    head = bytearray(struct.pack(bo + count_fmt, len(entries)))
+    extra = bytearray()
+    for tag, (typ, count, data) in entries:
+        head += struct.pack(bo + entry_fmt, tag, typ, count)
+        if len(data) <= inline:
+            head += data.ljust(inline, b'\x00')
+        else:
+            head += struct.pack(bo + off_fmt, offset + size + len(extra))
+            extra += data
+            if len(extra) % 2:
+                extra += b'\x00'
+    head += struct.pack(bo + off_fmt, next_offset)
+    return bytes(head + extra)
+
+
+def _pack(bo, fmt, values):
+    return struct.pack(bo + fmt * len(values), *values)
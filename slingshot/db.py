@@ -1,8 +1,17 @@
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date
 import io
+from itertools import chain, islice
+import logging
 import re
+import struct
+import sys
+import time
 
 from geoalchemy2 import Geometry
 from geomet import wkt
+import numpy as np
 from shapefile import Reader
 from sqlalchemy import (
     Boolean,
@@ -13,10 +22,35 @@ from sqlalchemy import (
     Integer,
     MetaData,
     Table,
+    text,
     Text,
 )
 
-from slingshot import S3_BUFFER_SIZE
+from slingshot import (
+    BULK_INDEX_WORKERS,
+    BULK_MAINTENANCE_WORK_MEM,
+    COPY_BATCH_SIZE,
+    COPY_BUFFER_SIZE,
+    COPY_PARTITION_MIN,
+    COPY_WORKERS,
+    HILBERT_SORT_MEMORY,
+    S3_BUFFER_SIZE,
+    STAGING_SUFFIX,
+    SYNC_MAX_CHANGES,
+)
+from slingshot.dbf import (
+    binary_cells,
+    binary_rows,
+    Cells,
+    DbfReader,
+    deleted,
+    text_cells,
+    text_rows,
+)
+from slingshot.ewkb import ewkb, ewkb_batch
+from slingshot.hilbert import hilbert_keys, sort_rows
+from slingshot.layer import PackageError
+from slingshot.shp import ShpReader
 
 
 GEOM_TYPES = {
@@ -28,6 +62,14 @@ GEOM_TYPES = {
 
 quote = re.compile(r'(\t|\n|\r|\\.)')
 
+#: Signature, flags and header extension length that start a binary COPY.
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+PGCOPY_NULL = struct.pack('>i', -1)
+PG_EPOCH = date(2000, 1, 1).toordinal()
+
+logger = logging.getLogger(__name__)
+
 
 class Engine:
     _engine = None
@@ -35,8 +77,8 @@ class Engine:
     def __call__(self):
         return self._engine
 
-    def configure(self, url, schema=None):
-        self._engine = self._engine or create_engine(url)
+    def configure(self, url, schema=None, **kwargs):
+        self._engine = self._engine or create_engine(url, **kwargs)
         metadata.configure(schema=schema)
         metadata().bind = self._engine
 
@@ -55,15 +97,19 @@ engine = Engine()
 metadata = Metadata()
 
 
-def table(name, gtype, srid, fields):
-    """Create an ``sqlalchemy.Table`` with a geometry column."""
+def table(name, gtype, srid, fields, unlogged=False):
+    """Create an ``sqlalchemy.Table`` with a geometry column.
+
+    With ``unlogged`` the table is created as an ``UNLOGGED`` table.
+    """
     cols = [_make_column(f) for f in fields]
     if gtype == 'POLYGON':
         gtype = 'MULTIPOLYGON'
     elif gtype == 'LINESTRING':
         gtype = 'MULTILINESTRING'
     cols.append(Column('geom', Geometry(gtype, srid, spatial_index=False)))
-    return Table(name, metadata(), *cols)
+    prefixes = ['UNLOGGED'] if unlogged else []
+    return Table(name, metadata(), *cols, prefixes=prefixes)
 
 
 def table_name(table):
@@ -102,6 +148,45 @@ def prep_field(field, _type, encoding):
     return str(field)
 
 
+def binary_field(_type, precision, encoding):
+    """Return a function encoding a DBF field for a binary COPY.
+
+    The function returns the field's value in PostgreSQL's binary format,
+    prefixed with its length, to match the column made by
+    :func:`_make_column`. ``None`` and values that cannot be converted,
+    like malformed dates, are written as NULL.
+    """
+    null = PGCOPY_NULL
+    if _type in ('N', 'F'):
+        fmt = struct.Struct('>ii' if precision == 0 else '>id')
+        cast = int if precision == 0 else float
+
+        def encode(value):
+            if value is None:
+                return null
+            return fmt.pack(fmt.size - 4, cast(value))
+    elif _type == 'D':
+        def encode(value):
+            if not isinstance(value, date):
+                return null
+            return struct.pack('>ii', 4, value.toordinal() - PG_EPOCH)
+    elif _type == 'L':
+        def encode(value):
+            if value is None:
+                return null
+            return struct.pack('>i?', 1, value)
+    else:
+        def encode(value):
+            if value is None:
+                return null
+            if type(value) is not bytes:
+                value = str(value).encode('utf-8')
+            elif encoding.lower().replace('-', '') != 'utf8':
+                value = value.decode(encoding).encode('utf-8')
+            return struct.pack('>i', len(value)) + value
+    return encode
+
+
 def multiply(geometry):
     """Force a GeoJSON geometry to its Multi* counterpart.
 
@@ -122,7 +207,63 @@ def multiply(geometry):
     return geometry
 
 
-class PGShapeReader:
+class _BatchReader:
+    """Base class for file-like objects that encode records for COPY.
+
+    Subclasses implement ``_encode_batch``, which returns the encoding of
+    up to ``batch_size`` records, or an empty value once there are none
+    left. Reads are served from the current batch by advancing an offset,
+    so each read only copies what it returns and the unread remainder is
+    copied once per batch instead of once per read.
+    """
+    empty = u''
+    newline = u'\n'
+
+    def __init__(self, batch_size=COPY_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._buffer = self.empty
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxsize
+        self._fill(size)
+        buf = self._buffer[self._pos:self._pos + size]
+        self._pos += len(buf)
+        return buf
+
+    def readline(self):
+        while True:
+            end = self._buffer.find(self.newline, self._pos)
+            if end >= 0:
+                return self.read(end + 1 - self._pos)
+            available = len(self._buffer) - self._pos
+            if self._eof:
+                return self.read(available)
+            self._fill(available + 1)
+
+    def _fill(self, size):
+        """Encode batches until at least ``size`` bytes are available."""
+        available = len(self._buffer) - self._pos
+        if available >= size or self._eof:
+            return
+        parts = [self._buffer[self._pos:]]
+        while available < size:
+            batch = self._encode_batch(self.batch_size)
+            if not batch:
+                self._eof = True
+                break
+            parts.append(batch)
+            available += len(batch)
+        self._buffer = self.empty.join(parts)
+        self._pos = 0
+
+    def _encode_batch(self, n):
+        raise NotImplementedError
+
+
+class PGShapeReader(_BatchReader):
     """Implements file-like interface to shapefile for PG COPY command.
 
     A ``PGShapeReader`` provides a streaming interface to a Shapefile for
@@ -130,40 +271,17 @@ class PGShapeReader:
     requires a ``shapefile.Reader`` object from
     `pyshp <https://github.com/GeospatialPython/pyshp>`_.
     """
-    def __init__(self, shapefile, srid, encoding='utf-8'):
+    def __init__(self, shapefile, srid, encoding='utf-8',
+                 batch_size=COPY_BATCH_SIZE):
+        super().__init__(batch_size)
         self.shapefile = shapefile
         self.srid = srid
         self.encoding = encoding
         self._f_types = [f[1] for f in self.shapefile.fields[1:]]
         self._g = self.shapefile.iterShapeRecords()
-        self._buffer = u''
-
-    def read(self, size=-1):
-        if size <= 0:
-            while True:
-                try:
-                    self._read_into_buffer()
-                except StopIteration:
-                    return self._buffer
-        while len(self._buffer) < size:
-            try:
-                self._read_into_buffer()
-            except StopIteration:
-                break
-        buf = self._buffer[:size]
-        self._buffer = self._buffer[size:]
-        return buf
-
-    def readline(self):
-        try:
-            record = next(self._g)
-        except StopIteration:
-            return u''
-        return self._record_to_str(record)
 
-    def _read_into_buffer(self):
-        record = next(self._g)
-        self._buffer += self._record_to_str(record)
+    def _encode_batch(self, n):
+        return u''.join(self._record_to_str(r) for r in islice(self._g, n))
 
     def _record_to_str(self, record):
         geom = u'SRID={};{}'.format(
@@ -173,26 +291,537 @@ class PGShapeReader:
         return u'\t'.join(fields) + u'\n'
 
 
-def load_layer(layer):
-    """Load the layer into PostGIS."""
+class PGBinaryShapeReader(_BatchReader):
+    """Implements file-like interface to shapefile for binary PG COPY.
+
+    This is the binary format counterpart to :class:`PGShapeReader`, for
+    passing to a ``psycopg2`` cursor's ``copy_expert`` method with a
+    ``COPY ... FROM STDIN WITH (FORMAT binary)`` statement. Geometries are
+    written as EWKB straight from the shape's coordinates. Text is sent as
+    UTF-8, so the connection's client encoding should be UTF8.
+
+    When the shapefile was opened with its ``.shx`` index, geometries are
+    decoded in batches by :class:`slingshot.shp.ShpReader` instead of one
+    pyshp ``Shape`` at a time.
+    """
+    empty = b''
+    newline = b'\n'
+
+    def __init__(self, shapefile, srid, encoding='utf-8',
+                 batch_size=COPY_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.shapefile = shapefile
+        self.srid = srid
+        self.encoding = encoding
+        fields = self.shapefile.fields[1:]
+        self._encoders = [binary_field(f[1], f[3], encoding) for f in fields]
+        self._count = struct.pack('>h', len(fields) + 1)
+        if shapefile.shp is not None and shapefile.shx is not None:
+            shp = ShpReader(shapefile.shp, shapefile.shx)
+            geoms = chain.from_iterable(ewkb_batch(b, srid) for b in
+                                        shp.batches(batch_size))
+        else:
+            geoms = (ewkb(s, srid) for s in shapefile.iterShapes())
+        self._g = _live_records(shapefile, geoms)
+        self._buffer = PGCOPY_HEADER
+
+    def _encode_batch(self, n):
+        if self._g is None:
+            return self.empty
+        parts = []
+        for record, geom in islice(self._g, n):
+            parts.append(self._count)
+            parts.extend(encode(f) for encode, f in
+                         zip(self._encoders, record))
+            if geom is None:
+                parts.append(PGCOPY_NULL)
+            else:
+                parts.append(struct.pack('>i', len(geom)))
+                parts.append(geom)
+        if not parts:
+            self._g = None
+            parts.append(PGCOPY_TRAILER)
+        return self.empty.join(parts)
+
+    def readline(self):
+        raise io.UnsupportedOperation('Binary COPY data has no lines')
+
+
+def _live_records(shapefile, geoms):
+    """Pair each record that is not deleted with the geometry of its index.
+
+    Records marked as deleted in the DBF still have their shapes in the
+    SHP. ``iterRecords`` skips them, and older pyshp releases do not set
+    the ``oid`` of the records it returns, so each record is read by its
+    index instead. ``record`` returns ``None`` for a deleted record.
+    """
+    for i, geom in enumerate(geoms):
+        record = shapefile.record(i)
+        if record is not None:
+            yield record, geom
+
+
+class PGColumnarShapeReader(_BatchReader):
+    """Implements file-like interface to shapefile for PG COPY, by column.
+
+    This produces the same rows as :class:`PGShapeReader` or
+    :class:`PGBinaryShapeReader`, depending on ``copy_format``, but never
+    creates a Python object for a DBF value. Each batch of DBF records is
+    read by :class:`slingshot.dbf.DbfReader` into a byte matrix and
+    encoded one column at a time, and geometries are decoded by
+    :class:`slingshot.shp.ShpReader`. The shapefile must have been opened
+    with its ``.shx`` index.
+
+    Geometries are written as EWKB, in hex for the text format, and text
+    is always written as UTF-8, so the COPY should say ``ENCODING 'UTF8'``
+    for the text format. Records marked as deleted in the DBF are skipped,
+    along with their shapes. Only the records from ``start`` up to
+    ``stop`` are read, so that a shapefile can be copied in parts.
+
+    With ``hilbert`` the rows are written in the order of the Hilbert
+    curve index of their bounding box centres, read from the record
+    headers, so that rows near each other in space are stored near each
+    other in the table. The encoded rows are sorted by
+    :func:`slingshot.hilbert.sort_rows`, which spills to temporary files
+    beyond ``sort_memory`` bytes.
+    """
+    empty = b''
+    newline = b'\n'
+
+    def __init__(self, shapefile, srid, encoding='utf-8', copy_format='text',
+                 batch_size=COPY_BATCH_SIZE, start=0, stop=None,
+                 hilbert=False, sort_memory=HILBERT_SORT_MEMORY):
+        super().__init__(batch_size)
+        self.srid = srid
+        self.encoding = encoding
+        self.binary = copy_format == 'binary'
+        self.dbf = DbfReader(shapefile.dbf)
+        self.shp = ShpReader(shapefile.shp, shapefile.shx)
+        if len(self.shp) != len(self.dbf):
+            raise ValueError('Shapefile has {} shapes but {} records'
+                             .format(len(self.shp), len(self.dbf)))
+        self.hilbert = hilbert
+        rows = self._rows(start, stop)
+        if hilbert:
+            self._g = sort_rows(rows, sort_memory, batch_size)
+        else:
+            self._g = (r.tobytes() for r, _ in rows)
+        if self.binary:
+            self._buffer = PGCOPY_HEADER
+
+    def _encode_batch(self, n):
+        if self._g is None:
+            return self.empty
+        for rows in self._g:
+            if rows:
+                return rows
+        self._g = None
+        return PGCOPY_TRAILER if self.binary else self.empty
+
+    def _rows(self, start, stop):
+        """Yield the encoded rows of each batch and, if they are to be
+        sorted, their Hilbert keys."""
+        for records, shapes in zip(
+                self.dbf.batches(self.batch_size, start, stop),
+                self.shp.batches(self.batch_size, start, stop)):
+            geoms = ewkb_batch(shapes, self.srid)
+            bboxes = shapes.bboxes
+            keep = ~deleted(records)
+            if not keep.all():
+                records = records[keep]
+                bboxes = bboxes[keep]
+                geoms = [g for g, k in zip(geoms, keep.tolist()) if k]
+            if len(records):
+                keys = hilbert_keys(bboxes, self.shp.bbox) \
+                    if self.hilbert else None
+                yield self._encode_rows(records, geoms), keys
+
+    def _encode_rows(self, records, geoms):
+        encode = binary_cells if self.binary else text_cells
+        columns = [encode(self.dbf.column(records, i), field, self.encoding)
+                   for i, field in enumerate(self.dbf.fields)]
+        if self.binary:
+            null = PGCOPY_NULL
+            geoms = [null if g is None else struct.pack('>i', len(g)) + g
+                     for g in geoms]
+            return binary_rows(columns + [Cells.from_list(geoms)])
+        geoms = [br'\N' if g is None else g.hex().encode('ascii')
+                 for g in geoms]
+        return text_rows(columns + [Cells.from_list(geoms)])
+
+    def readline(self):
+        if self.binary:
+            raise io.UnsupportedOperation('Binary COPY data has no lines')
+        return super().readline()
+
+
+def partition(offsets, workers=COPY_WORKERS,
+              min_records=COPY_PARTITION_MIN):
+    """Split a shapefile's records into ranges to be copied concurrently.
+
+    ``offsets`` are the byte offsets of the records in the ``.shp``, from
+    the ``.shx`` index. The records are split into at most ``workers``
+    ``(start, stop)`` ranges covering roughly equal parts of the ``.shp``,
+    with at least ``min_records`` records in each.
+    """
+    count = len(offsets)
+    n = max(1, min(workers, count // max(min_records, 1)))
+    targets = np.linspace(offsets[0], offsets[-1], n + 1)[1:-1] \
+        if count else []
+    bounds = [0] + np.searchsorted(offsets, targets).tolist() + [count]
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a] or [(0, 0)]
+
+
+def load_layer(layer, copy_size=COPY_BUFFER_SIZE, copy_format='text',
+               workers=COPY_WORKERS, bulk=False, unlogged=False, sync=False,
+               generalize_at=(), hilbert=False):
+    """Load the layer into PostGIS.
+
+    ``copy_size`` is the size of each block read from the shapefile reader
+    and sent to Postgres by the COPY. ``copy_format`` selects between a
+    text and a binary COPY.
+
+    When the layer has a ``.shx`` index its records are split by
+    :func:`partition` and each range is encoded by a
+    :class:`PGColumnarShapeReader` and copied on its own connection, with
+    up to ``workers`` COPYs running at once. The COPYs are committed
+    together once all of them have finished. Otherwise the layer is copied
+    over one connection by :class:`PGShapeReader` or
+    :class:`PGBinaryShapeReader`. If anything fails the table is dropped.
+
+    With ``bulk`` the layer is instead loaded by :func:`_bulk_load`, in a
+    single transaction. With ``unlogged`` the table is created
+    ``UNLOGGED`` and switched to ``LOGGED`` once it has been loaded and
+    indexed.
+
+    ``generalize_at`` is a list of tolerances at which to make simplified
+    copies of a line or polygon layer's table with :func:`generalize`. The
+    tables made are recorded in ``layer.generalized``.
+
+    With ``hilbert`` the rows are loaded in Hilbert curve order, so the
+    table is clustered spatially without needing a ``CLUSTER``. This needs
+    the ``.shx`` index, and the rows are sorted as one stream so they are
+    copied over a single connection.
+
+    If the layer's table already exists an exception is raised, unless
+    ``sync`` is set. The layer is then loaded into a staging table which
+    :func:`sync_table` uses to bring the existing table up to date.
+
+    Returns the number of seconds spent in each phase of the load.
+    """
     srid = layer.srid
-    with Reader(shp=io.BufferedReader(layer.shp, buffer_size=S3_BUFFER_SIZE),
-                dbf=io.BufferedReader(layer.dbf, buffer_size=S3_BUFFER_SIZE),
-                encoding=layer.encoding) as sf:
+    timings = {}
+    with _open_shapefile(layer) as sf:
         geom_type = GEOM_TYPES[sf.shapeType]
         fields = sf.fields[1:]
-        t = table(layer.name, geom_type, srid, fields)
-        if t.exists():
+        t = table(layer.name, geom_type, srid, fields, unlogged=unlogged)
+        if not t.exists():
+            _load_table(layer, sf, t, copy_size, copy_format, workers, bulk,
+                        unlogged, hilbert, timings)
+        elif sync:
+            staging = table(layer.name + STAGING_SUFFIX, geom_type, srid,
+                            fields, unlogged=unlogged)
+            # Clear out anything left by a sync that did not finish.
+            staging.drop(checkfirst=True)
+            try:
+                # The staging table is only indexed if it replaces t.
+                _load_table(layer, sf, staging, copy_size, copy_format,
+                            workers, bulk, unlogged, hilbert, timings,
+                            index=False)
+                with _timed(timings, 'sync'):
+                    sync_table(t, staging)
+            finally:
+                staging.drop(checkfirst=True)
+                metadata().remove(staging)
+        else:
             raise Exception('Table {} already exists'.format(layer.name))
+        if generalize_at and geom_type in ('LINESTRING', 'POLYGON'):
+            with _timed(timings, 'generalize'):
+                layer.generalized = generalize(t, generalize_at)
+    logger.info('Loaded {} ({})'.format(layer.name, ', '.join(
+        '{} {:.2f}s'.format(k, v) for k, v in timings.items())))
+    return timings
+
+
+def generalize(t, tolerances):
+    """Make simplified copies of table ``t`` for rendering at small scales.
+
+    A table is made for each tolerance, in the units of the table's
+    coordinate system, with every geometry simplified by
+    ``ST_SimplifyPreserveTopology`` and with its own GIST index. The
+    tables are named after ``t`` and numbered from the smallest
+    tolerance, and any existing tables of the same name are replaced.
+
+    Returns a list of the ``(table name, tolerance)`` of each table.
+    """
+    geom = t.c.geom.type
+    columns = ', '.join('"{}"'.format(c.name) for c in t.columns
+                        if c.name != 'geom')
+    generalized = []
+    for i, tolerance in enumerate(sorted(tolerances), start=1):
+        gen = Table('{}_gen{}'.format(t.name, i), MetaData(schema=t.schema))
+        geom_sql = ('ST_Multi(ST_SimplifyPreserveTopology(geom, {!r}))'
+                    '::geometry({}, {})'.format(float(tolerance),
+                                                geom.geometry_type,
+                                                geom.srid))
+        with engine().begin() as conn:
+            conn.execute('DROP TABLE IF EXISTS {}'.format(table_name(gen)))
+            conn.execute('CREATE TABLE {} AS SELECT {}{}{} AS geom FROM {}'
+                         .format(table_name(gen), columns,
+                                 ', ' if columns else '', geom_sql,
+                                 table_name(t)))
+            conn.execute(_index_sql(gen))
+            conn.execute('ANALYZE {}'.format(table_name(gen)))
+        generalized.append((gen.name, tolerance))
+    return generalized
+
+
+def _load_table(layer, sf, t, copy_size, copy_format, workers, bulk,
+                unlogged, hilbert, timings, index=True):
+    if bulk:
+        _bulk_load(layer, sf, t, copy_size, copy_format, unlogged, hilbert,
+                   timings, index)
+        return
+    with _timed(timings, 'create'):
         t.create()
-        try:
-            with engine().begin() as conn:
-                reader = PGShapeReader(sf, srid, layer.encoding)
-                cursor = conn.connection.cursor()
-                cursor.copy_from(reader, table_name(t))
-            with engine().connect() as conn:
-                conn.execute('CREATE INDEX "idx_{}_geom" ON {} USING GIST '
-                             '(geom)'.format(layer.name, table_name(t)))
-        except Exception:
-            t.drop()
-            raise
+    try:
+        with _timed(timings, 'copy'):
+            if sf.shx is not None:
+                if hilbert:
+                    ranges = [(0, None)]
+                else:
+                    ranges = partition(ShpReader(sf.shp, sf.shx).offsets,
+                                       workers)
+                _copy_ranges(layer, t, ranges, copy_size, copy_format,
+                             hilbert)
+            else:
+                with engine().begin() as conn:
+                    _copy(conn, layer, sf, t, copy_size, copy_format)
+        if index:
+            with engine().connect() as conn, _timed(timings, 'index'):
+                conn.execute(_index_sql(t))
+        if unlogged:
+            with engine().connect() as conn, _timed(timings, 'logged'):
+                conn.execute(_logged_sql(t))
+    except Exception:
+        t.drop()
+        raise
+
+
+def sync_table(t, staging, max_changes=SYNC_MAX_CHANGES):
+    """Bring table ``t`` up to date with the rows of ``staging``.
+
+    Rows are matched by a hash of their contents, with repeated rows
+    matched by how many times they occur, so this works for tables without
+    a key. If the rows to delete from and insert into ``t`` are no more
+    than ``max_changes`` of the rows in ``t``, only those changes are
+    made. Otherwise, or if the tables' columns differ, ``staging`` is
+    indexed and replaces ``t`` by being renamed. Either way the change is
+    made in a single transaction, so readers of ``t`` only ever see the
+    old or the new rows.
+
+    Returns ``(deleted, inserted)``, or ``None`` if the table was replaced.
+    """
+    live, stage = table_name(t), table_name(staging)
+    with engine().begin() as conn:
+        # Block writes, but not reads, until the sync is committed so the
+        # row locations hashed below stay valid.
+        conn.execute('LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'.format(live))
+        if _columns(conn, live) != _columns(conn, stage):
+            _swap(conn, t, staging)
+            return None
+        for name, source in (('_sync_live', live), ('_sync_staging', stage)):
+            conn.execute('CREATE TEMPORARY TABLE {} ON COMMIT DROP AS '
+                         'SELECT ctid AS id, md5(r::text) AS h, row_number() '
+                         'OVER (PARTITION BY md5(r::text)) AS n '
+                         'FROM {} AS r'.format(name, source))
+        unmatched = ('SELECT id FROM {} AS a WHERE NOT EXISTS (SELECT 1 FROM '
+                     '{} AS b WHERE a.h = b.h AND a.n = b.n)')
+        deletes = unmatched.format('_sync_live', '_sync_staging')
+        inserts = unmatched.format('_sync_staging', '_sync_live')
+        total = conn.execute('SELECT count(*) FROM _sync_live').scalar()
+        changes = conn.execute('SELECT (SELECT count(*) FROM ({}) AS d), '
+                               '(SELECT count(*) FROM ({}) AS i)'
+                               .format(deletes, inserts)).first()
+        if sum(changes) > max_changes * total:
+            _swap(conn, t, staging)
+            return None
+        conn.execute('DELETE FROM {} WHERE ctid IN ({})'
+                     .format(live, deletes))
+        conn.execute('INSERT INTO {} SELECT * FROM {} WHERE ctid IN ({})'
+                     .format(live, stage, inserts))
+    logger.info('Synced {}: {} deleted, {} inserted'.format(
+        t.name, *changes))
+    return tuple(changes)
+
+
+def _columns(conn, name):
+    return conn.execute(text('SELECT attname, format_type(atttypid, '
+                             'atttypmod) FROM pg_attribute WHERE attrelid = '
+                             'CAST(:name AS regclass) AND attnum > 0 AND NOT '
+                             'attisdropped ORDER BY attnum'),
+                        name=name).fetchall()
+
+
+def _swap(conn, t, staging):
+    # The index is built before the live table is dropped, so that reads
+    # are only blocked for the drop and renames.
+    conn.execute(_index_sql(staging))
+    conn.execute('DROP TABLE {}'.format(table_name(t)))
+    conn.execute('ALTER TABLE {} RENAME TO "{}"'
+                 .format(table_name(staging), t.name))
+    index = '"{}"'.format(_index_name(staging))
+    if t.schema:
+        index = '"{}".{}'.format(t.schema, index)
+    conn.execute('ALTER INDEX {} RENAME TO "{}"'.format(index,
+                                                        _index_name(t)))
+    logger.info('Replaced {}'.format(t.name))
+
+
+def _bulk_load(layer, sf, t, copy_size, copy_format, unlogged, hilbert,
+               timings, index=True):
+    """Create, load and index a table in one transaction.
+
+    Because the table is created in the same transaction as the COPY, the
+    rows are written already frozen with ``COPY ... FREEZE``, and with
+    ``wal_level = minimal`` the COPY skips the write-ahead log. The index
+    is built with :data:`slingshot.BULK_MAINTENANCE_WORK_MEM`, and the
+    table is analyzed once it is complete. PostgreSQL only builds B-tree
+    indexes in parallel, so :data:`slingshot.BULK_INDEX_WORKERS` has no
+    effect on the GiST index. The index is skipped if ``index`` is false.
+    Nothing is left behind if the load fails.
+    """
+    with engine().begin() as conn:
+        with _timed(timings, 'create'):
+            t.create(bind=conn)
+        with _timed(timings, 'copy'):
+            _copy(conn, layer, sf, t, copy_size, copy_format, freeze=True,
+                  hilbert=hilbert)
+        if index:
+            with _timed(timings, 'index'):
+                # These only last until the end of the transaction.
+                conn.execute(text("SELECT set_config('maintenance_work_mem', "
+                                  ":mem, true), set_config("
+                                  "'max_parallel_maintenance_workers', "
+                                  ":workers, true)"),
+                             mem=BULK_MAINTENANCE_WORK_MEM,
+                             workers=str(BULK_INDEX_WORKERS))
+                conn.execute(_index_sql(t))
+        if unlogged:
+            with _timed(timings, 'logged'):
+                conn.execute(_logged_sql(t))
+        with _timed(timings, 'analyze'):
+            conn.execute('ANALYZE {}'.format(table_name(t)))
+
+
+@contextmanager
+def _timed(timings, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0) + time.perf_counter() - start
+
+
+def _index_name(t):
+    return 'idx_{}_geom'.format(t.name)
+
+
+def _index_sql(t):
+    return 'CREATE INDEX "{}" ON {} USING GIST (geom)'.format(
+        _index_name(t), table_name(t))
+
+
+def _logged_sql(t):
+    return 'ALTER TABLE {} SET LOGGED'.format(table_name(t))
+
+
+def _open_shapefile(layer):
+    try:
+        shx = io.BufferedReader(layer.shx, buffer_size=S3_BUFFER_SIZE)
+    except PackageError:
+        shx = None
+    return Reader(shp=io.BufferedReader(layer.shp, buffer_size=S3_BUFFER_SIZE),
+                  shx=shx,
+                  dbf=io.BufferedReader(layer.dbf, buffer_size=S3_BUFFER_SIZE),
+                  encoding=layer.encoding)
+
+
+def _copy_sql(t, copy_format, encoding=None, freeze=False):
+    options = ['FORMAT {}'.format(copy_format)]
+    if encoding:
+        options.append("ENCODING '{}'".format(encoding))
+    if freeze:
+        options.append('FREEZE')
+    return 'COPY {} FROM STDIN WITH ({})'.format(table_name(t),
+                                                 ', '.join(options))
+
+
+def _copy(conn, layer, sf, t, copy_size, copy_format, freeze=False, start=0,
+          stop=None, hilbert=False):
+    """COPY a layer's records on ``conn``.
+
+    The records are encoded by :class:`PGColumnarShapeReader` if the
+    shapefile has its ``.shx`` index, and otherwise by
+    :class:`PGShapeReader` or :class:`PGBinaryShapeReader`.
+    """
+    encoding = None
+    if sf.shx is not None:
+        reader = PGColumnarShapeReader(sf, layer.srid, layer.encoding,
+                                       copy_format, start=start, stop=stop,
+                                       hilbert=hilbert)
+        if copy_format != 'binary':
+            encoding = 'UTF8'
+    elif copy_format == 'binary':
+        reader = PGBinaryShapeReader(sf, layer.srid, layer.encoding)
+    else:
+        reader = PGShapeReader(sf, layer.srid, layer.encoding)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(_copy_sql(t, copy_format, encoding, freeze), reader,
+                       size=copy_size)
+
+
+def _copy_ranges(layer, t, ranges, copy_size, copy_format, hilbert=False):
+    """Copy ranges of a layer's records concurrently.
+
+    Each range is read through its own shapefile handles and copied in its
+    own transaction on its own pooled connection. The transactions are
+    only committed once every COPY has succeeded. If a COPY fails, those
+    still running are cancelled and all of the transactions are rolled
+    back.
+    """
+    conns, transactions, shapefiles = [], [], []
+    try:
+        for _ in ranges:
+            shapefiles.append(_open_shapefile(layer))
+            conns.append(engine().connect())
+            transactions.append(conns[-1].begin())
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(_copy, conn, layer, sf, t, copy_size,
+                                       copy_format, start=start, stop=stop,
+                                       hilbert=hilbert)
+                       for conn, sf, (start, stop) in
+                       zip(conns, shapefiles, ranges)]
+            done, running = wait(futures, return_when=FIRST_EXCEPTION)
+            if running:
+                for conn, future in zip(conns, futures):
+                    if future in running:
+                        conn.connection.cancel()
+            # Raise the error that stopped the load, rather than one caused
+            # by cancelling the others.
+            for future in done:
+                future.result()
+        for future in futures:
+            future.result()
+        for transaction in transactions:
+            transaction.commit()
+    except Exception:
+        for transaction in transactions:
+            if transaction.is_active:
+                transaction.rollback()
+        raise
+    finally:
+        for conn in conns:
+            conn.close()
+        for sf in shapefiles:
+            sf.close()
@@ -0,0 +1,379 @@
+import codecs
+from functools import lru_cache
+import importlib
+import struct
+
+import attr
+import numpy as np
+
+from slingshot import COPY_BATCH_SIZE
+
+
+HEADER = struct.Struct('<4xIHH20x')
+FIELD = struct.Struct('<11sc4xBB14x')
+HEADER_END = 0x0D
+
+#: Bytes escaped with a backslash in COPY's text format.
+TEXT_ESCAPES = {9: b'\\\t', 10: b'\\\n', 13: b'\\\r', 92: b'\\\\'}
+
+#: Days from 1970-01-01, numpy's epoch, to 2000-01-01, PostgreSQL's.
+PG_EPOCH_DAYS = 10957
+
+TEXT_NULL = b'\\N'
+BINARY_NULL = struct.pack('>i', -1)
+
+
+@attr.s(frozen=True)
+class Cells:
+    """The encoded cells of one column of a batch.
+
+    ``data`` is the bytes of every cell concatenated as a ``uint8`` array
+    and ``lengths`` is the length of each cell.
+    """
+    lengths = attr.ib()
+    data = attr.ib()
+
+    @classmethod
+    def from_list(cls, values):
+        lengths = np.fromiter(map(len, values), np.int64, len(values))
+        return cls(lengths, np.frombuffer(b''.join(values), np.uint8))
+
+    def take(self, indices):
+        """Return the cells at ``indices``, in that order."""
+        starts = np.cumsum(self.lengths) - self.lengths
+        lengths = self.lengths[indices]
+        return Cells(lengths, self.data[_runs(starts[indices], lengths)])
+
+    def tobytes(self):
+        return self.data.tobytes()
+
+    @classmethod
+    def from_matrix(cls, matrix, lengths):
+        """Take the first ``lengths[i]`` bytes of each row of ``matrix``."""
+        mask = np.arange(matrix.shape[1]) < lengths[:, None]
+        return cls(lengths.astype(np.int64), matrix[mask])
+
+
+class DbfReader:
+    """Read the records of a DBF file as NumPy byte matrices.
+
+    Each batch of records is read with a single read and viewed as an
+    ``(n, record length)`` array without copying. :func:`text_cells` and
+    :func:`binary_cells` then encode a whole column of the batch at a time
+    rather than creating a Python object for every value.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        fp.seek(0)
+        self.count, self.header_length, self.record_length = \
+            HEADER.unpack(_read_exact(fp, HEADER.size))
+        self.fields = []
+        self.offsets = []
+        # Every record starts with its one byte deletion flag.
+        offset = 1
+        while True:
+            desc = fp.read(1)
+            if not desc or desc[0] == HEADER_END:
+                break
+            name, _type, length, decimals = FIELD.unpack(
+                desc + _read_exact(fp, FIELD.size - 1))
+            name = name.split(b'\x00')[0].decode('ascii', 'replace')
+            self.fields.append((name, _type.decode('ascii'), length,
+                                decimals))
+            self.offsets.append(offset)
+            offset += length
+        if offset > self.record_length:
+            raise ValueError('DBF fields are longer than the record length')
+
+    def __len__(self):
+        return self.count
+
+    def batches(self, size=COPY_BATCH_SIZE, start=0, stop=None):
+        """Yield the records ``size`` at a time as ``(n, width)`` arrays.
+
+        Only the records from ``start`` up to ``stop`` are read.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        self.fp.seek(self.header_length + start * self.record_length)
+        for i in range(start, stop, size):
+            n = min(size, stop - i)
+            data = _read_exact(self.fp, n * self.record_length)
+            yield np.frombuffer(data, np.uint8).reshape(n, self.record_length)
+
+    def column(self, batch, i):
+        """Return the bytes of field ``i`` for every record of a batch."""
+        offset = self.offsets[i]
+        return batch[:, offset:offset + self.fields[i][2]]
+
+
+def deleted(batch):
+    """Return a mask of the records of a batch marked as deleted."""
+    return batch[:, 0] != ord(' ')
+
+
+def text_cells(column, field, encoding):
+    """Encode a DBF column for a text COPY.
+
+    Values are read as pyshp reads them and written as
+    :func:`slingshot.db.prep_field` writes them, except that text is always
+    written as UTF-8 and values pyshp cannot convert are NULL.
+    """
+    _type, decimals = field[1], field[3]
+    if _type in ('N', 'F'):
+        values, null = _numbers(column, decimals)
+        if decimals == 0:
+            values = values.astype(np.int64)
+        return _with_nulls(_strings(values.astype(np.bytes_)), null,
+                           TEXT_NULL)
+    if _type == 'D':
+        days, null = _dates(column)
+        text = np.datetime_as_string(days.astype('datetime64[D]'))
+        return _with_nulls(_strings(text.astype(np.bytes_)), null, TEXT_NULL)
+    if _type == 'L':
+        value, null = _logicals(column)
+        flags = np.where(value, ord('t'), ord('f')).astype(np.uint8)
+        return _with_nulls(Cells(np.ones(len(value), np.int64), flags), null,
+                           TEXT_NULL)
+    return _characters(column, encoding, True)
+
+
+def binary_cells(column, field, encoding):
+    """Encode a DBF column for a binary COPY.
+
+    Each cell is the value's length followed by the value in PostgreSQL's
+    binary format for the column made by :func:`slingshot.db._make_column`.
+    """
+    _type, decimals = field[1], field[3]
+    n = len(column)
+    if _type in ('N', 'F'):
+        values, null = _numbers(column, decimals)
+        if decimals == 0:
+            if np.any(np.abs(values[~null]) >= 2 ** 31):
+                raise ValueError('Value out of range for integer field {}'
+                                 .format(field[0]))
+            packed = values.astype('>i4')
+        else:
+            packed = values.astype('>f8')
+    elif _type == 'D':
+        days, null = _dates(column)
+        packed = (days - PG_EPOCH_DAYS).astype('>i4')
+    elif _type == 'L':
+        packed, null = _logicals(column)
+        packed = packed.astype(np.uint8)
+    else:
+        cells = _characters(column, encoding, False)
+        prefix = cells.lengths.astype('>i4').view(np.uint8)
+        return _concat([Cells(np.full(n, 4, np.int64), prefix), cells])
+    size = packed.dtype.itemsize
+    matrix = np.empty((n, 4 + size), np.uint8)
+    matrix[:, :4] = np.frombuffer(struct.pack('>i', size), np.uint8)
+    matrix[:, 4:] = packed.view(np.uint8).reshape(n, size)
+    matrix[null, :4] = np.frombuffer(BINARY_NULL, np.uint8)
+    return Cells.from_matrix(matrix, np.where(null, 4, 4 + size))
+
+
+def text_rows(columns):
+    """Join columns of cells into tab separated lines for a text COPY.
+
+    Returns :class:`Cells` with a cell for each line.
+    """
+    n = len(columns[0].lengths)
+    tab = Cells(np.ones(n, np.int64), np.full(n, ord('\t'), np.uint8))
+    newline = Cells(np.ones(n, np.int64), np.full(n, ord('\n'), np.uint8))
+    cells = [tab] * (2 * len(columns))
+    cells[::2] = columns
+    cells[-1] = newline
+    return _concat(cells)
+
+
+def binary_rows(columns):
+    """Join columns of cells into tuples for a binary COPY.
+
+    Returns :class:`Cells` with a cell for each tuple.
+    """
+    n = len(columns[0].lengths)
+    count = np.tile(np.frombuffer(struct.pack('>h', len(columns)), np.uint8),
+                    n)
+    return _concat([Cells(np.full(n, 2, np.int64), count)] + columns)
+
+
+def _concat(columns):
+    """Concatenate cells row by row across columns.
+
+    The cells of each column are copied into place with a single indexing
+    operation.
+    """
+    lengths = np.stack([c.lengths for c in columns], axis=1)
+    ends = np.cumsum(lengths.reshape(-1)).reshape(lengths.shape)
+    out = np.empty(int(ends[-1, -1]) if lengths.size else 0, np.uint8)
+    for j, col in enumerate(columns):
+        out[_runs(ends[:, j] - lengths[:, j], lengths[:, j])] = col.data
+    return Cells(lengths.sum(axis=1), out)
+
+
+def _runs(starts, lengths):
+    """Return the indices of runs of ``lengths`` starting at ``starts``."""
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - (ends - lengths), lengths) + \
+        np.arange(int(ends[-1]) if len(ends) else 0)
+
+
+def _strings(array):
+    """Return the cells of a NumPy bytes array."""
+    width = max(array.dtype.itemsize, 1)
+    matrix = np.frombuffer(array.astype('S{}'.format(width)).tobytes(),
+                           np.uint8).reshape(len(array), width)
+    return Cells.from_matrix(matrix, np.char.str_len(array))
+
+
+def _with_nulls(cells, null, marker):
+    """Replace the cells where ``null`` is set with ``marker``."""
+    if not np.any(null):
+        return cells
+    values = Cells(np.where(null, 0, cells.lengths),
+                   cells.data[np.repeat(~null, cells.lengths)])
+    markers = Cells(np.where(null, len(marker), 0),
+                    np.tile(np.frombuffer(marker, np.uint8), int(null.sum())))
+    return _concat([markers, values])
+
+
+def _trimmed(column, pad=(0x20, 0x00)):
+    """Return the length of each value less any trailing pad bytes."""
+    if not column.shape[1]:
+        return np.zeros(len(column), np.int64)
+    keep = ~np.isin(column, pad)
+    last = column.shape[1] - np.argmax(keep[:, ::-1], axis=1)
+    return np.where(keep.any(axis=1), last, 0).astype(np.int64)
+
+
+def _numbers(column, decimals):
+    """Parse a numeric column, returning the values and a NULL mask.
+
+    As in pyshp, values which are blank or only ``*`` are NULL and a field
+    with no decimals is an integer. Values which are not numbers are NULL.
+    """
+    strings = np.char.strip(_as_strings(column))
+    null = np.char.str_len(np.char.strip(strings, b'*')) == 0
+    values = np.zeros(len(column), np.float64)
+    try:
+        values[~null] = strings[~null].astype(np.float64)
+    except ValueError:
+        for i in np.flatnonzero(~null):
+            try:
+                values[i] = float(strings[i])
+            except ValueError:
+                null[i] = True
+    if decimals == 0:
+        null |= ~np.isfinite(values)
+        values = np.trunc(np.where(null, 0, values))
+    return values, null
+
+
+def _dates(column):
+    """Parse ``YYYYMMDD`` dates into days since 1970-01-01.
+
+    Returns the days and a NULL mask. Blank dates, and anything which is
+    not a valid date, are NULL.
+    """
+    if column.shape[1] != 8:
+        return np.zeros(len(column), np.int64), np.ones(len(column), bool)
+    digits = column.astype(np.int64) - ord('0')
+    null = ~np.all((digits >= 0) & (digits <= 9), axis=1)
+    digits[null] = 0
+    year = digits[:, :4] @ np.array([1000, 100, 10, 1])
+    month = digits[:, 4:6] @ np.array([10, 1])
+    day = digits[:, 6:] @ np.array([10, 1])
+    null |= (year < 1) | (month < 1) | (month > 12) | (day < 1)
+    first = ((year - 1970) * 12 + np.clip(month, 1, 12) - 1) \
+        .astype('datetime64[M]')
+    days = first.astype('datetime64[D]') + (day - 1)
+    # A day past the end of its month runs over into the next month.
+    null |= days.astype('datetime64[M]') != first
+    return np.where(null, 0, days.astype(np.int64)), null
+
+
+def _logicals(column):
+    """Parse a logical column, returning the values and a NULL mask."""
+    flag = column[:, 0]
+    true = np.isin(flag, np.frombuffer(b'YyTt1', np.uint8))
+    false = np.isin(flag, np.frombuffer(b'NnFf0', np.uint8))
+    return true, ~(true | false)
+
+
+def _as_strings(column):
+    width = column.shape[1]
+    return np.ascontiguousarray(column).view('S{}'.format(width))[:, 0]
+
+
+def _characters(column, encoding, text):
+    """Convert a character column to UTF-8.
+
+    Trailing spaces and NULs are trimmed, as pyshp does, and for the text
+    format special characters are escaped with a backslash. Single byte
+    encodings are converted with a lookup table for the whole column; any
+    other encoding is decoded one value at a time.
+    """
+    try:
+        lengths, table = _lookup(codecs.lookup(encoding).name, text)
+    except LookupError:
+        return Cells.from_list([_escape(bytes(v).rstrip(b' \x00').decode(
+            encoding, 'replace').encode('utf-8'), text) for v in column])
+    trimmed = _trimmed(column)
+    raw = column[np.arange(column.shape[1]) < trimmed[:, None]]
+    out = lengths[raw]
+    rows = np.repeat(np.arange(len(column)), trimmed)
+    return Cells(np.bincount(rows, out, len(column)).astype(np.int64),
+                 table[raw][np.arange(4) < out[:, None]])
+
+
+def _escape(value, text):
+    if not text:
+        return value
+    return b''.join(TEXT_ESCAPES.get(b, bytes((b,))) for b in value)
+
+
+@lru_cache()
+def _lookup(name, text):
+    """Build the table of what each byte becomes for :func:`_characters`.
+
+    Returns the length of each byte's UTF-8 encoding and a ``(256, 4)``
+    array holding it. UTF-8 and ASCII text are passed through unchanged.
+    Raises ``LookupError`` for any other encoding which is not a single
+    byte encoding.
+    """
+    if name in ('utf-8', 'ascii'):
+        chars = [bytes((b,)) for b in range(256)]
+    else:
+        chars = [c.encode('utf-8') for c in _decoding_table(name)]
+    if text:
+        for b, escaped in TEXT_ESCAPES.items():
+            chars[b] = escaped
+    lengths = np.array([len(c) for c in chars], np.int64)
+    table = np.zeros((256, 4), np.uint8)
+    for b, c in enumerate(chars):
+        table[b, :len(c)] = np.frombuffer(c, np.uint8)
+    return lengths, table
+
+
+def _decoding_table(name):
+    if name == 'iso8859-1':
+        return bytes(range(256)).decode('latin-1')
+    try:
+        module = importlib.import_module('encodings.' +
+                                         name.replace('-', '_'))
+        table = module.decoding_table
+    except (ImportError, AttributeError):
+        raise LookupError('{} is not a single byte encoding'.format(name))
+    # Bytes with no character in the encoding are decoded as U+FFFE.
+    return table.replace('￾', '�')
+
+
+def _read_exact(fp, size):
+    chunks = []
+    while size:
+        chunk = fp.read(size)
+        if not chunk:
+            raise ValueError('Unexpected end of DBF file')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
@@ -0,0 +1,184 @@
+from itertools import chain
+import struct
+
+import numpy as np
+from shapefile import Shape
+
+
+#: WKB geometry type codes.
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+
+#: Flag set on the type code of an EWKB geometry that includes an SRID.
+SRID_FLAG = 0x20000000
+
+#: Shapefile shape types.
+SHP_NULL = 0
+SHP_POINT = 1
+SHP_POLYLINE = 3
+SHP_POLYGON = 5
+SHP_MULTIPOINT = 8
+
+
+def ewkb(shape, srid):
+    """Encode a ``shapefile.Shape`` as little endian EWKB with an SRID.
+
+    Polylines and polygons are always written as multilinestrings and
+    multipolygons, matching the table created by
+    :func:`slingshot.db.table`. Returns ``None`` for a null shape.
+    """
+    stype = shape.shapeType
+    if stype == SHP_NULL or not shape.points:
+        return None
+    if stype == SHP_POINT:
+        x, y = shape.points[0][:2]
+        return _header(WKB_POINT, srid) + struct.pack('<2d', x, y)
+    if stype == SHP_MULTIPOINT:
+        points = [_header(WKB_POINT) + struct.pack('<2d', *p[:2])
+                  for p in shape.points]
+        return _collection(WKB_MULTIPOINT, srid, points)
+    rings = _parts(shape)
+    if stype == SHP_POLYLINE:
+        lines = [_header(WKB_LINESTRING) + _points(r) for r in rings]
+        return _collection(WKB_MULTILINESTRING, srid, lines)
+    if stype == SHP_POLYGON:
+        return _collection(WKB_MULTIPOLYGON, srid,
+                           [_polygon(p) for p in _polygons(shape, rings)])
+    raise ValueError('Unsupported shape type {}'.format(stype))
+
+
+def _header(wkb_type, srid=None):
+    if srid is None:
+        return struct.pack('<BI', 1, wkb_type)
+    return struct.pack('<BIi', 1, wkb_type | SRID_FLAG, srid)
+
+
+def _collection(wkb_type, srid, members):
+    return b''.join([_header(wkb_type, srid), struct.pack('<I', len(members))]
+                    + members)
+
+
+def _points(points):
+    return struct.pack('<I{}d'.format(2 * len(points)), len(points),
+                       *chain.from_iterable(p[:2] for p in points))
+
+
+def _polygon(rings):
+    return b''.join([_header(WKB_POLYGON), struct.pack('<I', len(rings))] +
+                    [_points(r) for r in rings])
+
+
+def _parts(shape):
+    bounds = list(shape.parts) + [len(shape.points)]
+    return [shape.points[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def _polygons(shape, rings):
+    """Group the rings of a polygon shape into polygons.
+
+    Shapefile exterior rings are clockwise and holes are counterclockwise.
+    When there is a single exterior ring and it comes first, every other
+    ring is one of its holes. Anything else is left to pyshp, which works
+    out which exterior contains each hole.
+    """
+    clockwise = [_signed_area(r) < 0 for r in rings]
+    if clockwise[0] and not any(clockwise[1:]):
+        return [rings]
+    geom = shape.__geo_interface__
+    if geom['type'] == 'Polygon':
+        return [geom['coordinates']]
+    return geom['coordinates']
+
+
+def _signed_area(ring):
+    """Twice the signed area of a ring, positive if counterclockwise."""
+    return sum(x0 * y1 - x1 * y0 for (x0, y0, *_), (x1, y1, *_) in
+               zip(ring, ring[1:]))
+
+
+def ewkb_batch(batch, srid):
+    """Encode a :class:`slingshot.shp.ShapeBatch` as a list of EWKB.
+
+    This produces the same bytes as :func:`ewkb` for each record, but
+    works from the batch's arrays. Coordinates are copied to the output
+    from the batch's contiguous buffer, one slice per part, and polygon
+    ring orientation is found for the whole batch at once.
+    """
+    data = memoryview(batch.coords.astype('<f8', copy=False).tobytes())
+    n_parts = np.diff(batch.part_offsets)
+    # Start and end of every part as an index into the batch's points.
+    starts = batch.parts + np.repeat(batch.point_offsets[:-1], n_parts)
+    ends = np.append(starts[1:], 0)
+    last = batch.part_offsets[1:][n_parts > 0] - 1
+    ends[last] = batch.point_offsets[1:][n_parts > 0]
+    simple = _simple_polygons(batch, starts, ends, n_parts)
+    point = _header(WKB_POINT)
+    geoms = []
+    for i, stype in enumerate(batch.shape_types.tolist()):
+        a, b = batch.point_offsets[i], batch.point_offsets[i + 1]
+        if stype == SHP_NULL or a == b:
+            geoms.append(None)
+        elif stype == SHP_POINT:
+            geoms.append(_header(WKB_POINT, srid) + data[16 * a:16 * b])
+        elif stype == SHP_MULTIPOINT:
+            geoms.append(b''.join(
+                [_header(WKB_MULTIPOINT, srid), struct.pack('<I', b - a)] +
+                [point + data[16 * j:16 * j + 16] for j in range(a, b)]))
+        elif stype == SHP_POLYLINE:
+            p, q = batch.part_offsets[i], batch.part_offsets[i + 1]
+            lines = [_header(WKB_LINESTRING) + _slice(data, s, e) for s, e in
+                     zip(starts[p:q].tolist(), ends[p:q].tolist())]
+            geoms.append(_collection(WKB_MULTILINESTRING, srid, lines))
+        elif stype == SHP_POLYGON and simple[i]:
+            p, q = batch.part_offsets[i], batch.part_offsets[i + 1]
+            geoms.append(b''.join(
+                [_header(WKB_MULTIPOLYGON, srid), struct.pack('<I', 1),
+                 _header(WKB_POLYGON), struct.pack('<I', q - p)] +
+                [_slice(data, s, e) for s, e in
+                 zip(starts[p:q].tolist(), ends[p:q].tolist())]))
+        elif stype == SHP_POLYGON:
+            p, q = batch.part_offsets[i], batch.part_offsets[i + 1]
+            shape = Shape(shapeType=SHP_POLYGON,
+                          points=batch.coords[a:b].tolist(),
+                          parts=batch.parts[p:q].tolist())
+            geoms.append(ewkb(shape, srid))
+        else:
+            raise ValueError('Unsupported shape type {}'.format(stype))
+    return geoms
+
+
+def _slice(data, start, end):
+    return struct.pack('<I', end - start) + data[16 * start:16 * end]
+
+
+def _simple_polygons(batch, starts, ends, n_parts):
+    """Find the polygon records whose rings need no grouping.
+
+    A record is simple if its first ring is clockwise, so an exterior, and
+    every other ring is counterclockwise, so one of its holes.
+    """
+    simple = np.zeros(len(n_parts), bool)
+    lengths = ends - starts
+    if not len(starts) or np.any(lengths < 0) or \
+            lengths.sum() != len(batch.coords):
+        # The parts do not cover the points in order, so leave the whole
+        # batch to the general case.
+        return simple
+    rings = lengths > 0
+    # Shift each ring to its first point before taking cross products so
+    # the area of a small ring far from the origin keeps its precision.
+    xy = batch.coords - np.repeat(batch.coords[starts[rings]],
+                                  lengths[rings], axis=0)
+    cross = np.append(xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1], 0)
+    cross[ends[rings] - 1] = 0
+    area = np.zeros(len(starts))
+    area[rings] = np.add.reduceat(cross, starts[rings])
+    clockwise = area < 0
+    first = batch.part_offsets[:-1][n_parts > 0]
+    exteriors = np.add.reduceat(clockwise.astype(np.int64), first)
+    simple[n_parts > 0] = clockwise[first] & (exteriors == 1)
+    return simple
@@ -0,0 +1,142 @@
+import heapq
+from itertools import islice
+import struct
+import tempfile
+
+import numpy as np
+
+from slingshot import COPY_BATCH_SIZE, HILBERT_ORDER, HILBERT_SORT_MEMORY
+from slingshot.dbf import Cells
+
+
+RUN_CHUNK = struct.Struct('<q')
+
+
+def hilbert_keys(bboxes, bounds, order=HILBERT_ORDER):
+    """Return the Hilbert curve index of the centre of each bounding box.
+
+    ``bboxes`` is an ``(n, 4)`` array of ``xmin, ymin, xmax, ymax`` and
+    ``bounds`` is the extent of the layer. The extent is divided into a
+    ``2 ** order`` square grid, and each centre is mapped to the distance
+    along the curve of its cell. Boxes which are NaN, like those of null
+    shapes, are given the first key.
+    """
+    n = 1 << order
+    xmin, ymin, xmax, ymax = bounds
+    cx = (bboxes[:, 0] + bboxes[:, 2]) / 2
+    cy = (bboxes[:, 1] + bboxes[:, 3]) / 2
+    x = _grid(cx, xmin, xmax, n)
+    y = _grid(cy, ymin, ymax, n)
+    d = np.zeros(len(bboxes), np.uint64)
+    s = n >> 1
+    while s:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += np.uint64(s * s) * ((3 * rx.astype(np.uint64)) ^
+                                 ry.astype(np.uint64))
+        # Rotate the quadrant so the curve's sub-squares line up.
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return d
+
+
+def _grid(v, lo, hi, n):
+    span = hi - lo
+    scaled = (v - lo) / span * n if span > 0 else np.zeros_like(v)
+    scaled = np.nan_to_num(scaled, nan=0.0)
+    return np.clip(scaled, 0, n - 1).astype(np.int64)
+
+
+def sort_rows(batches, memory=HILBERT_SORT_MEMORY,
+              batch_size=COPY_BATCH_SIZE):
+    """Sort encoded rows by key, spilling to disk when they don't fit.
+
+    ``batches`` yields ``(rows, keys)``, where ``rows`` is
+    :class:`slingshot.dbf.Cells` with a cell for each row. Rows are
+    gathered until they take up ``memory`` bytes, then sorted and written
+    to a temporary file as a sorted run. The runs are then merged. Rows
+    with equal keys keep their order. Yields the bytes of ``batch_size``
+    rows at a time.
+    """
+    runs = []
+    pending = []
+    size = 0
+    try:
+        for rows, keys in batches:
+            pending.append((rows, keys))
+            size += len(rows.data)
+            if size >= memory:
+                runs.append(_spill(*_sort(pending), batch_size))
+                pending = []
+                size = 0
+        if not runs:
+            rows, keys = _sort(pending)
+            ends = np.cumsum(rows.lengths)
+            for i in range(0, len(keys), batch_size):
+                j = min(i + batch_size, len(keys))
+                start = int(ends[i - 1]) if i else 0
+                yield rows.data[start:int(ends[j - 1])].tobytes()
+            return
+        if pending:
+            runs.append(_spill(*_sort(pending), batch_size))
+        merged = heapq.merge(*(_read_run(fp, i) for i, fp in
+                               enumerate(runs)))
+        while True:
+            rows = [row for _, _, _, row in islice(merged, batch_size)]
+            if not rows:
+                break
+            yield b''.join(rows)
+    finally:
+        for fp in runs:
+            fp.close()
+
+
+def _sort(pending):
+    if not pending:
+        return Cells(np.zeros(0, np.int64), np.zeros(0, np.uint8)), \
+            np.zeros(0, np.uint64)
+    rows = Cells(np.concatenate([r.lengths for r, _ in pending]),
+                 np.concatenate([r.data for r, _ in pending]))
+    keys = np.concatenate([k for _, k in pending])
+    order = np.argsort(keys, kind='stable')
+    return rows.take(order), keys[order]
+
+
+def _spill(rows, keys, chunk_size):
+    """Write a sorted run to a temporary file.
+
+    The run is written in chunks of ``chunk_size`` rows, each being the
+    number of rows, their keys, their lengths and their bytes, so it can
+    be read back a chunk at a time.
+    """
+    fp = tempfile.TemporaryFile()
+    ends = np.cumsum(rows.lengths)
+    for i in range(0, len(keys), chunk_size):
+        j = min(i + chunk_size, len(keys))
+        start = int(ends[i - 1]) if i else 0
+        fp.write(RUN_CHUNK.pack(j - i))
+        fp.write(keys[i:j].astype('<u8').tobytes())
+        fp.write(rows.lengths[i:j].astype('<i8').tobytes())
+        fp.write(rows.data[start:int(ends[j - 1])].tobytes())
+    fp.seek(0)
+    return fp
+
+
+def _read_run(fp, run):
+    """Yield ``(key, run, position, row)`` for every row of a run."""
+    position = 0
+    while True:
+        header = fp.read(RUN_CHUNK.size)
+        if not header:
+            return
+        n, = RUN_CHUNK.unpack(header)
+        keys = np.frombuffer(fp.read(8 * n), '<u8').tolist()
+        lengths = np.frombuffer(fp.read(8 * n), '<i8')
+        data = memoryview(fp.read(int(lengths.sum())))
+        ends = np.cumsum(lengths).tolist()
+        for key, a, b in zip(keys, [0] + ends, ends):
+            yield key, run, position, data[a:b]
+            position += 1
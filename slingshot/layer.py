@@ -1,17 +1,63 @@
-from functools import lru_cache
+from collections import OrderedDict
 import json
 import os
+
+import attr
 try:
-    from lxml.etree import iterparse
+    from lxml.etree import XMLPullParser, XMLSyntaxError as ParseError
 except ImportError:
-    from xml.etree.ElementTree import iterparse
+    from xml.etree.ElementTree import XMLPullParser, ParseError
 
-from slingshot.proj import parser
+from slingshot.proj import srid
 from slingshot.record import Record
-from slingshot.s3 import S3IO, session
+from slingshot import METADATA_FETCH_SIZE, METADATA_SNIFF_SIZE
+from slingshot.s3 import BlockCache, clients, S3BytesIO, S3IO, upload
+from slingshot.tiff import read_tiff, TiffError
+
+
+@attr.s(frozen=True)
+class ManifestEntry:
+    key = attr.ib()
+    size = attr.ib()
+    etag = attr.ib()
+
+
+class Manifest:
+    """The objects that make up a layer package.
+
+    A manifest records the key, size and ETag of each object under a key
+    prefix. Iterating over a manifest yields the keys. The manifest
+    returned by :func:`slingshot.app.unpack_zip` can be passed along to
+    :func:`create_layer` so the prefix never needs to be listed.
+    """
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._entries = OrderedDict()
 
+    @classmethod
+    def from_bucket(cls, s3, bucket, prefix):
+        """Create a manifest by listing the prefix in the bucket."""
+        manifest = cls(bucket, prefix)
+        for obj in s3.Bucket(bucket).objects.filter(Prefix=prefix):
+            if not obj.key.endswith('/'):
+                manifest.add(obj.key, obj.size, obj.e_tag)
+        return manifest
 
-_LRU_CACHE_SIZE = 32
+    def add(self, key, size, etag):
+        self._entries[key] = ManifestEntry(key, size, etag)
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
 
 
 class S3Layer:
@@ -21,29 +67,31 @@ class S3Layer:
     in the bucket. At minimum, a layer should have an FGDC XML file and the
     necessary data files.
     """
-    def __init__(self, bucket, key, endpoint=None):
-        self.s3 = session().resource('s3', endpoint_url=endpoint)
+    def __init__(self, bucket, key, endpoint=None, manifest=None):
+        self.s3 = clients.resource('s3', endpoint_url=endpoint)
         self.bucket = bucket
         self.key = key
         self.endpoint = endpoint
+        self._manifest = manifest
         self._record = None
+        self._metadata = {}
 
     @property
-    @lru_cache(maxsize=_LRU_CACHE_SIZE)
     def manifest(self):
-        """List of S3 keys for the objects in this layer.
+        """The :class:`Manifest` for the objects in this layer.
 
-        The list is cached after the first access.
+        If the layer was not created with a manifest the prefix is listed
+        on first access and the result is kept for the life of the layer.
         """
-        bucket = self.s3.Bucket(self.bucket)
-        return [i.key for i in bucket.objects.filter(Prefix=self.key)
-                if not i.key.endswith('/')]
+        if self._manifest is None:
+            self._manifest = Manifest.from_bucket(self.s3, self.bucket,
+                                                  self.key)
+        return self._manifest
 
     @property
     def gbl_record(self):
         """A file-like object representing the GeoBlacklight record."""
-        return S3IO(self.s3.Object(self.bucket,
-                                   self._file_by_ext('geoblacklight.json')))
+        return self._metadata_file(self._file_by_ext('geoblacklight.json'))
 
     @property
     def fgdc(self):
@@ -51,19 +99,21 @@ class S3Layer:
 
         There can sometimes be multiple XML files in a package. This will
         try to find which one is FGDC by reading the start of the XML file
-        and looking for a ``metadata`` element.
+        and looking for a ``metadata`` element. Small files are fetched
+        whole while larger ones only have their first few KB read.
         """
         files = self._files_by_ext('.xml')
         if len(files) > 1:
             for f in files:
-                obj = S3IO(self.s3.Object(self.bucket, f))
-                for _, elem in iterparse(obj, events=('start',)):
-                    if elem.tag.lower() == 'metadata':
-                        obj.seek(0)
-                        return obj
-                    break
+                if self._is_small(f):
+                    head = self._metadata_file(f).read(METADATA_SNIFF_SIZE)
+                else:
+                    obj = S3IO(self.s3.Object(self.bucket, f))
+                    head = obj.read(METADATA_SNIFF_SIZE)
+                if _root_tag(head) == 'metadata':
+                    return self._metadata_file(f)
         else:
-            return S3IO(self.s3.Object(self.bucket, files[0]))
+            return self._metadata_file(files[0])
 
     @property
     def record(self):
@@ -77,11 +127,32 @@ class S3Layer:
         self._record = record
         key = os.path.join(self.key, "geoblacklight.json")
         rec = json.dumps(record.as_dict()).encode("utf-8")
-        self.s3.Bucket(self.bucket).put_object(Key=key, Body=rec)
+        obj = self.s3.Bucket(self.bucket).put_object(Key=key, Body=rec)
+        self.manifest.add(key, len(rec), obj.e_tag)
+        self._metadata[key] = rec
 
     def is_public(self):
         return self.record.dc_rights_s.lower() == 'public'
 
+    def _metadata_file(self, key):
+        """Return a file-like object for a metadata file in the layer.
+
+        Files no larger than ``METADATA_FETCH_SIZE`` are fetched whole on
+        first access and kept for the life of the layer, so that small
+        reads by parsers do not each become a request.
+        """
+        obj = self.s3.Object(self.bucket, key)
+        if not self._is_small(key):
+            return S3IO(obj, use_disk_cache=True)
+        if key not in self._metadata:
+            self._metadata[key] = obj.get()['Body'].read()
+        return S3BytesIO(obj, self._metadata[key])
+
+    def _is_small(self, key):
+        return key in self._metadata or (
+            key in self.manifest and
+            self.manifest[key].size <= METADATA_FETCH_SIZE)
+
     def _files_by_ext(self, ext):
         keys = [k for k in self.manifest if k.endswith(ext)]
         if not keys:
@@ -99,6 +170,10 @@ class S3Layer:
 class GeoTiff(S3Layer):
     format = "GeoTiff"
 
+    def __init__(self, bucket, key, endpoint=None, manifest=None):
+        super().__init__(bucket, key, endpoint, manifest)
+        self._tiff = None
+
     @property
     def name(self):
         return os.path.splitext(os.path.basename(self.tif))[0]
@@ -110,10 +185,45 @@ class GeoTiff(S3Layer):
         except PackageError:
             return self._file_by_ext('.tiff')
 
+    @property
+    def tiff(self):
+        """The :class:`slingshot.tiff.TiffInfo` describing the raster layout.
+
+        Only the TIFF header and IFDs are read, which for a Cloud Optimized
+        GeoTIFF is usually a single request. The disk cache is not used,
+        since it would download the whole file.
+        """
+        if self._tiff is None:
+            obj = S3IO(self.s3.Object(self.bucket, self.tif),
+                       cache=BlockCache())
+            try:
+                self._tiff = read_tiff(obj)
+            except TiffError as e:
+                raise PackageError('Cannot read TIFF s3://{}/{}: {}'
+                                   .format(self.bucket, self.tif, e))
+        return self._tiff
+
+    def replace_tif(self, fp):
+        """Replace the layer's TIFF in S3 with the contents of ``fp``."""
+        size = fp.seek(0, os.SEEK_END)
+        fp.seek(0)
+        client = clients.client('s3', endpoint_url=self.endpoint)
+        res = upload(fp, self.bucket, self.tif, client)
+        self.manifest.add(self.tif, size, res['ETag'])
+        self._tiff = None
+
 
 class Shapefile(S3Layer):
     format = "Shapefile"
 
+    def __init__(self, bucket, key, endpoint=None, manifest=None):
+        super().__init__(bucket, key, endpoint, manifest)
+        self._encoding = None
+        self._srid = None
+        #: ``(table, tolerance)`` of each simplified copy of the layer's
+        #: table made by :func:`slingshot.db.generalize`.
+        self.generalized = []
+
     @property
     def name(self):
         shp = self._file_by_ext('.shp')
@@ -121,60 +231,82 @@ class Shapefile(S3Layer):
 
     @property
     def shp(self):
-        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.shp')))
+        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.shp')),
+                    use_disk_cache=True)
 
     @property
     def shx(self):
-        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.shx')))
+        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.shx')),
+                    use_disk_cache=True)
 
     @property
     def dbf(self):
-        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.dbf')))
+        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.dbf')),
+                    use_disk_cache=True)
 
     @property
     def prj(self):
-        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.prj')))
+        return self._metadata_file(self._file_by_ext('.prj'))
 
     @property
     def cst(self):
-        return S3IO(self.s3.Object(self.bucket, self._file_by_ext('.cst')))
+        return self._metadata_file(self._file_by_ext('.cst'))
 
     @property
-    @lru_cache(maxsize=_LRU_CACHE_SIZE)
     def encoding(self):
-        try:
-            return self.cst.read().decode().strip()
-        except PackageError:
-            return "UTF-8"
+        if self._encoding is None:
+            try:
+                self._encoding = self.cst.read().decode().strip()
+            except PackageError:
+                self._encoding = "UTF-8"
+        return self._encoding
 
     @property
-    @lru_cache(maxsize=_LRU_CACHE_SIZE)
     def srid(self):
+        if self._srid is None:
+            self._srid = self._read_srid()
+        return self._srid
+
+    def _read_srid(self):
         wkt = self.prj.read().decode("utf-8")
-        res = parser.parse(wkt)
-        if wkt.startswith('PROJCS'):
-            srid = res.select('projcs > authority > code *')[0]
-        elif wkt.startswith('GEOGCS'):
-            srid = res.select('geogcs > authority > code *')[0]
-        else:
+        try:
+            return srid(wkt)
+        except ValueError:
             raise PackageError('Cannot retrieve SRID for layer s3://{}/{}'
                                .format(self.bucket, self.key))
-        return int(srid.strip('"'))
 
 
-def create_layer(bucket, key, endpoint=None):
+def _root_tag(data):
+    """Return the lowercased tag of the root element of an XML fragment.
+
+    Returns ``None`` if the fragment does not get as far as a root element
+    or is not XML.
+    """
+    parser = XMLPullParser(events=('start',))
+    try:
+        parser.feed(data)
+        for _, elem in parser.read_events():
+            return elem.tag.lower()
+    except ParseError:
+        pass
+    return None
+
+
+def create_layer(bucket, key, endpoint=None, manifest=None):
     """Create a new S3Layer object.
 
     Factory function that creates a new :class:`slingshot.s3.S3Layer` based
-    on the given bucket and key.
+    on the given bucket and key. If no :class:`Manifest` is given the
+    prefix will be listed to create one.
     """
-    s3 = session().resource('s3', endpoint_url=endpoint)
-    bkt = s3.Bucket(bucket)
-    for item in bkt.objects.filter(Prefix=key):
-        if item.key.endswith('.shp'):
-            return Shapefile(bucket, key, endpoint)
-        elif item.key.endswith('.tif') or item.key.endswith('.tiff'):
-            return GeoTiff(bucket, key, endpoint)
+    if manifest is None:
+        s3 = clients.resource('s3', endpoint_url=endpoint)
+        manifest = Manifest.from_bucket(s3, bucket, key)
+    for k in manifest:
+        if k.endswith('.shp'):
+            return Shapefile(bucket, key, endpoint, manifest)
+        elif k.endswith('.tif') or k.endswith('.tiff'):
+            return GeoTiff(bucket, key, endpoint, manifest)
     raise PackageError("Unknown layer type for object s3://{}/{}".format(
                        bucket, key))
 
@@ -5,7 +5,7 @@ import re
 from pymarc import Record
 from pymarc.exceptions import RecordDirectoryInvalid
 
-from slingshot.app import make_slug
+from slingshot.record import make_slug
 
 
 COORD_REGEX = re.compile(
@@ -1,7 +1,71 @@
+import csv
+from functools import lru_cache
+import io
+import pkgutil
+import re
+import threading
+
 from plyplus import Grammar
 
 
-parser = Grammar(r"""
+#: Matches the EPSG authority of the outermost coordinate system, which is
+#: always the last element before the final closing bracket.
+AUTHORITY_RE = re.compile(
+    r'AUTHORITY\[\s*"EPSG"\s*,\s*"?(\d+)"?\s*\]\s*\]\s*$', re.IGNORECASE)
+CS_NAME_RE = re.compile(r'^\s*(PROJCS|GEOGCS)\[\s*"([^"]+)"', re.IGNORECASE)
+
+
+def normalize_name(name):
+    """Normalize an ESRI or OGC coordinate system name for lookup.
+
+    ``NAD83 / UTM zone 19N`` becomes ``NAD83_UTM_ZONE_19N`` and
+    ``GCS_WGS_1984`` becomes ``GCS_WGS_1984``.
+    """
+    return re.sub(r'[^A-Z0-9]+', '_', name.upper()).strip('_')
+
+
+@lru_cache(maxsize=None)
+def epsg_table():
+    """The bundled table of normalized coordinate system names to EPSG codes.
+
+    The table covers common ESRI and OGC names and is read on first use.
+    """
+    data = pkgutil.get_data('slingshot', 'data/epsg.csv').decode('utf-8')
+    return {row['name']: int(row['code'])
+            for row in csv.DictReader(io.StringIO(data))}
+
+
+@lru_cache(maxsize=256)
+def srid(wkt):
+    """Return the EPSG code for the coordinate system in ``wkt``.
+
+    The authority code of the outermost coordinate system is used if there
+    is one. Otherwise, the coordinate system name is looked up in the
+    bundled :func:`epsg_table`, which handles ESRI-written ``.prj`` files.
+    The full WKT grammar is only run as a last resort. Results are cached,
+    so layers sharing a projection only resolve it once. Raises a
+    ``ValueError`` if no code can be found.
+    """
+    m = AUTHORITY_RE.search(wkt)
+    if m:
+        return int(m.group(1))
+    m = CS_NAME_RE.match(wkt)
+    if m:
+        code = epsg_table().get(normalize_name(m.group(2)))
+        if code:
+            return code
+    try:
+        res = parser.parse(wkt)
+        if wkt.lstrip().upper().startswith('PROJCS'):
+            code = res.select('projcs > authority > code *')[0]
+        else:
+            code = res.select('geogcs > authority > code *')[0]
+    except Exception:
+        raise ValueError('Cannot determine SRID from WKT')
+    return int(code.strip('"'))
+
+
+GRAMMAR = r"""
     start: horiz_cs ;
 
     horiz_cs: geogcs | projcs ;
@@ -39,4 +103,25 @@ parser = Grammar(r"""
     ppm : number ;
 
     WS: '[\s\n]+' (%ignore) ;
-""")
+"""
+
+
+class _LazyGrammar:
+    """A plyplus ``Grammar`` that is compiled the first time it is used.
+
+    Compiling the WKT grammar is slow relative to everything else done at
+    import time, and with :func:`srid` it is rarely needed at all.
+    """
+    def __init__(self, grammar):
+        self._source = grammar
+        self._grammar = None
+        self._lock = threading.Lock()
+
+    def parse(self, text):
+        with self._lock:
+            if self._grammar is None:
+                self._grammar = Grammar(self._source)
+        return self._grammar.parse(text)
+
+
+parser = _LazyGrammar(GRAMMAR)
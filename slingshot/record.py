@@ -1,8 +1,10 @@
+import base64
 from datetime import datetime
 from decimal import Decimal
 from functools import partial
 import json
 import re
+import uuid
 
 import attr
 from attr import converters, validators
@@ -164,3 +166,14 @@ class Record:
         if 'dct_references_s' in record:
             record['dct_references_s'] = json.dumps(record['dct_references_s'])
         return record
+
+
+def make_uuid(value, namespace='mit.edu'):
+    ns = uuid.uuid5(uuid.NAMESPACE_DNS, namespace)
+    return uuid.uuid5(ns, value)
+
+
+def make_slug(name):
+    uid = make_uuid(name)
+    b32 = base64.b32encode(uid.bytes[:8])
+    return 'mit-' + b32.decode('ascii').rstrip('=').lower()
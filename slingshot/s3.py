@@ -1,8 +1,15 @@
-import boto3
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import io
+import mmap
 import threading
 
-from slingshot import S3_BUFFER_SIZE
+import boto3
+from botocore.config import Config
+
+from slingshot import (S3_BLOCK_SIZE, S3_BUFFER_SIZE, S3_CACHE_BLOCKS,
+                       S3_UPLOAD_WORKERS)
+from slingshot.cache import disk_cache
 
 
 class _Session:
@@ -25,6 +32,125 @@ class _Session:
 session = _Session()
 
 
+class _Clients:
+    """A process-wide registry of boto3 clients and resources.
+
+    Creating a client loads the botocore service model and sets up a new
+    connection pool, so clients are created once for each service,
+    endpoint and region and then shared. boto3 clients are threadsafe.
+    Resources are not, so they are cached for each thread, but they share
+    the same connection pool size.
+
+    Use the global module-level ``clients`` instance of this class.
+    """
+    def __init__(self):
+        self.max_pool_connections = 10
+        self._clients = {}
+        self._resources = threading.local()
+        self._lock = threading.Lock()
+
+    def configure(self, max_pool_connections):
+        """Set the connection pool size used for new clients.
+
+        This should be called before any clients are created. Existing
+        clients are discarded.
+        """
+        with self._lock:
+            self.max_pool_connections = max_pool_connections
+            self._clients = {}
+            self._resources = threading.local()
+
+    def client(self, service, endpoint_url=None, region_name=None):
+        key = (service, endpoint_url, region_name)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = session().client(
+                    service, endpoint_url=endpoint_url,
+                    region_name=region_name, config=self._config())
+            return self._clients[key]
+
+    def resource(self, service, endpoint_url=None, region_name=None):
+        key = (service, endpoint_url, region_name)
+        try:
+            cache = self._resources.cache
+        except AttributeError:
+            cache = self._resources.cache = {}
+        if key not in cache:
+            cache[key] = session().resource(
+                service, endpoint_url=endpoint_url, region_name=region_name,
+                config=self._config())
+        return cache[key]
+
+    def _config(self):
+        return Config(max_pool_connections=self.max_pool_connections)
+
+
+clients = _Clients()
+
+
+class BlockCache:
+    """A bounded LRU cache of fixed-size, aligned blocks of an S3 object.
+
+    Blocks are keyed by their index in the object, so a cache should only
+    be used by a single :class:`S3IO`. The ``hits`` and ``misses`` counters
+    record how many block lookups were served from memory and how many had
+    to be fetched from S3.
+    """
+    def __init__(self, block_size=S3_BLOCK_SIZE, capacity=S3_CACHE_BLOCKS):
+        self.block_size = block_size
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, idx):
+        try:
+            block = self._blocks[idx]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._blocks.move_to_end(idx)
+        self.hits += 1
+        return block
+
+    def put(self, idx, block):
+        self._blocks[idx] = block
+        self._blocks.move_to_end(idx)
+        while len(self._blocks) > self.capacity:
+            self._blocks.popitem(last=False)
+
+
+class ClientObject:
+    """An S3 object read through a shared client.
+
+    This stands in for a boto3 ``S3.Object`` where an :class:`S3IO` is
+    read from several threads. Resources are not threadsafe, so each
+    thread would need its own, while a client from :data:`clients` can be
+    shared. Only ``get()`` and ``content_length`` are supported. Passing
+    ``content_length`` saves a ``HEAD`` request.
+    """
+    def __init__(self, client, bucket, key, content_length=None):
+        self.client = client
+        self.bucket_name = bucket
+        self.key = key
+        self._content_length = content_length
+
+    @property
+    def content_length(self):
+        if self._content_length is None:
+            res = self.client.head_object(Bucket=self.bucket_name,
+                                          Key=self.key)
+            self._content_length = res['ContentLength']
+        return self._content_length
+
+    def get(self, **kwargs):
+        return self.client.get_object(Bucket=self.bucket_name, Key=self.key,
+                                      **kwargs)
+
+
 class S3IO(io.RawIOBase):
     """Wrapper for an S3 object to function as a raw I/O binary stream.
 
@@ -32,11 +158,26 @@ class S3IO(io.RawIOBase):
     which is required for working with Zipfiles. The ``read()`` method
     will use an HTTP range request to prevent loading the entire object
     into memory.
+
+    Passing a :class:`BlockCache` will read the object in aligned blocks
+    and keep recently used blocks in memory. This is useful when the
+    consumer makes many small reads and seeks, as ``ZipFile`` does. Runs
+    of adjacent missing blocks are fetched with a single range request.
+
+    With ``use_disk_cache`` set, and the global
+    :data:`slingshot.cache.disk_cache` configured, the object is instead
+    read from the local disk cache, downloading it on first use. This is
+    meant for layer files that are read again on later runs, not for
+    objects like uploaded zipfiles that are only read once.
     """
-    def __init__(self, s3_obj):
-        """The ``s3_obj`` should be a boto3 ``S3.Object``."""
+    def __init__(self, s3_obj, cache=None, use_disk_cache=False):
+        """The ``s3_obj`` should be a boto3 ``S3.Object`` or a
+        :class:`ClientObject`."""
         self.obj = s3_obj
+        self.cache = cache
+        self.use_disk_cache = use_disk_cache
         self._position = io.SEEK_SET
+        self._local = None
 
     def tell(self):
         return self._position
@@ -59,6 +200,11 @@ class S3IO(io.RawIOBase):
     def seekable(self):
         return True
 
+    def close(self):
+        if isinstance(self._local, mmap.mmap):
+            self._local.close()
+        super().close()
+
     def readall(self):
         return self.read()
 
@@ -71,6 +217,16 @@ class S3IO(io.RawIOBase):
     def read(self, size=-1):
         if size == 0 or self.tell() >= self.obj.content_length:
             return b''
+        if self._local is None and self.use_disk_cache and \
+                disk_cache.enabled:
+            self._local = disk_cache.get(self.obj)
+        if self._local is not None:
+            end = None if size is None or size < 0 else self.tell() + size
+            data = self._local[self.tell():end]
+            self.seek(len(data), io.SEEK_CUR)
+            return data
+        if self.cache is not None:
+            return self._read_cached(size)
         if size is None or size < 0:
             rng = "bytes={:d}-".format(self.tell())
         else:
@@ -80,25 +236,145 @@ class S3IO(io.RawIOBase):
         self.seek(len(data), io.SEEK_CUR)
         return data
 
+    def _read_cached(self, size):
+        start = self.tell()
+        end = self.obj.content_length
+        if size is not None and size >= 0:
+            end = min(end, start + size)
+        bsize = self.cache.block_size
+        first, last = start // bsize, (end - 1) // bsize
+        blocks = {}
+        missing = []
+        for idx in range(first, last + 1):
+            block = self.cache.get(idx)
+            if block is None:
+                missing.append(idx)
+            else:
+                blocks[idx] = block
+        for lo, hi in _runs(missing):
+            rng = "bytes={:d}-{:d}".format(
+                lo * bsize, min((hi + 1) * bsize, self.obj.content_length) - 1)
+            data = self.obj.get(Range=rng)['Body'].read()
+            for idx in range(lo, hi + 1):
+                offset = (idx - lo) * bsize
+                block = data[offset:offset + bsize]
+                blocks[idx] = block
+                self.cache.put(idx, block)
+        data = b''.join(blocks[idx] for idx in range(first, last + 1))
+        offset = start - first * bsize
+        data = data[offset:offset + end - start]
+        self.seek(len(data), io.SEEK_CUR)
+        return data
+
+
+class S3BytesIO(io.BytesIO):
+    """An in-memory copy of an S3 object.
+
+    This can be used in place of an :class:`S3IO` for small objects that
+    have been fetched whole. The ``obj`` attribute is the boto3
+    ``S3.Object`` the data came from.
+    """
+    def __init__(self, s3_obj, data):
+        super().__init__(data)
+        self.obj = s3_obj
+
+
+def _runs(indices):
+    """Group sorted integers into ``(first, last)`` runs of adjacent values."""
+    run = None
+    for idx in indices:
+        if run and idx == run[1] + 1:
+            run[1] = idx
+        else:
+            if run:
+                yield tuple(run)
+            run = [idx, idx]
+    if run:
+        yield tuple(run)
+
 
-def upload(fp, bucket, key, client, chunksize=S3_BUFFER_SIZE):
+def upload(fp, bucket, key, client, chunksize=S3_BUFFER_SIZE,
+           workers=S3_UPLOAD_WORKERS, window=None):
+    """Upload the file-like object ``fp`` to S3 as a multipart upload.
+
+    Parts are read from ``fp`` in order and uploaded concurrently by a pool
+    of ``workers`` threads. No more than ``window`` parts (defaulting to the
+    number of workers) are read ahead of the parts that have finished
+    uploading, which caps memory use at ``window * chunksize``. If any part
+    fails the multipart upload is aborted and the error is raised.
+
+    Returns the response from completing the upload, which includes the
+    ``ETag`` of the new object.
+    """
+    window = window or workers
     mp = client.create_multipart_upload(Bucket=bucket, Key=key)
     mp_id = mp["UploadId"]
     parts = []
-    i = 1
+    pending = set()
     try:
-        while True:
-            chunk = fp.read(chunksize)
-            if not chunk:
-                break
-            res = client.upload_part(Body=chunk, Bucket=bucket, Key=key,
-                                     PartNumber=i, UploadId=mp_id)
-            parts.append({"PartNumber": i, "ETag": res["ETag"]})
-            i += 1
-        client.complete_multipart_upload(Bucket=bucket, Key=key,
-                                         MultipartUpload={"Parts": parts},
-                                         UploadId=mp_id)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                i = 1
+                while True:
+                    if len(pending) >= window:
+                        done, pending = wait(pending,
+                                             return_when=FIRST_COMPLETED)
+                        parts.extend(f.result() for f in done)
+                    chunk = fp.read(chunksize)
+                    if not chunk:
+                        break
+                    pending.add(executor.submit(_upload_part, client, chunk,
+                                                bucket, key, i, mp_id))
+                    i += 1
+                done, pending = wait(pending)
+                parts.extend(f.result() for f in done)
+            except Exception:
+                for f in pending:
+                    f.cancel()
+                raise
+        parts.sort(key=lambda p: p["PartNumber"])
+        return client.complete_multipart_upload(
+            Bucket=bucket, Key=key, MultipartUpload={"Parts": parts},
+            UploadId=mp_id)
     except Exception:
         client.abort_multipart_upload(Bucket=bucket, Key=key,
                                       UploadId=mp["UploadId"])
         raise
+
+
+def copy(src_bucket, src_key, start, length, bucket, key, client,
+         chunksize=S3_BUFFER_SIZE):
+    """Copy a byte range of one S3 object into a new object.
+
+    The range starting at ``start`` and ``length`` bytes long is copied
+    server-side with ``UploadPartCopy``, so the data never passes through
+    this process. Returns the response from creating the new object.
+    """
+    if not length:
+        return client.put_object(Bucket=bucket, Key=key, Body=b'')
+    source = {"Bucket": src_bucket, "Key": src_key}
+    mp = client.create_multipart_upload(Bucket=bucket, Key=key)
+    mp_id = mp["UploadId"]
+    parts = []
+    try:
+        for i, offset in enumerate(range(start, start + length, chunksize),
+                                   start=1):
+            last = min(offset + chunksize, start + length) - 1
+            res = client.upload_part_copy(
+                Bucket=bucket, Key=key, CopySource=source,
+                CopySourceRange="bytes={:d}-{:d}".format(offset, last),
+                PartNumber=i, UploadId=mp_id)
+            parts.append({"PartNumber": i,
+                          "ETag": res["CopyPartResult"]["ETag"]})
+        return client.complete_multipart_upload(
+            Bucket=bucket, Key=key, MultipartUpload={"Parts": parts},
+            UploadId=mp_id)
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=mp_id)
+        raise
+
+
+def _upload_part(client, chunk, bucket, key, part_number, upload_id):
+    res = client.upload_part(Body=chunk, Bucket=bucket, Key=key,
+                             PartNumber=part_number, UploadId=upload_id)
+    return {"PartNumber": part_number, "ETag": res["ETag"]}
@@ -0,0 +1,381 @@
+from concurrent.futures import Future
+import json
+import threading
+import time
+
+import requests
+
+from slingshot import (PUBLIC_WORKSPACE, RESTRICTED_WORKSPACE, DATASTORE,
+                       GEOTIFF_TILE_SIZE, SOLR_BATCH_BYTES, SOLR_BATCH_DOCS,
+                       SOLR_BATCH_WAIT, SOLR_COMMIT_WITHIN)
+
+
+class HttpSession:
+    """Threadsafe requests.Session.
+
+    This can be used more or less like the usual requests.Session. The only
+    method it supports is ``request``. For example::
+
+        session = HttpSession()
+        def run():
+            session.request("GET", "https://httpbin.org")
+
+        t = threading.Thread(target=run)
+        t.start()
+
+    """
+    def __init__(self):
+        self._session = threading.local()
+
+    @property
+    def session(self):
+        try:
+            return self._session.s
+        except AttributeError:
+            self._session.s = requests.Session()
+        return self._session.s
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+
+class HttpMethodMixin:
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+class GeoServer(HttpMethodMixin):
+    """Register layers with a GeoServer instance.
+
+    The stores, coverages and feature types already in the public and
+    restricted workspaces are read from the REST API the first time a
+    layer is added and kept for the life of this object. Registering an
+    object that is in this catalog replaces it with a PUT, while a new
+    object is created with a POST and then added to the catalog, so that
+    a layer can be republished without first being removed.
+    """
+    def __init__(self, url, client, auth=None, s3_alias="s3"):
+        self.url = url.rstrip("/")
+        self.client = client
+        self.auth = auth
+        self.s3_alias = s3_alias
+        self._catalog = None
+        self._lock = threading.Lock()
+
+    def request(self, method, path, **kwargs):
+        """Make a request.
+
+        Note the use of ``stream=False`` here. This ensures the session pool
+        still gets used even if the response is not fully read. This
+        shouldn't be a problem as none of the responses received here will be
+        very large.
+        """
+        kwargs = {"stream": False, "auth": self.auth, **kwargs}
+        url = "{}/rest/{}".format(self.url, path.lstrip("/"))
+        r = self.client.request(method, url, **kwargs)
+        r.raise_for_status()
+        return r
+
+    @property
+    def catalog(self):
+        """The set of ``(collection, workspace, name)`` objects in GeoServer.
+
+        ``collection`` is one of ``coveragestores``, ``coverages`` or
+        ``featuretypes``. Only feature types in the PostGIS datastore are
+        included.
+        """
+        with self._lock:
+            if self._catalog is None:
+                self._catalog = self._load_catalog()
+            return self._catalog
+
+    def _load_catalog(self):
+        catalog = set()
+        workspaces = self._names("/workspaces.json", "workspaces",
+                                 "workspace")
+        for workspace in (PUBLIC_WORKSPACE, RESTRICTED_WORKSPACE):
+            if workspace not in workspaces:
+                continue
+            url = "/workspaces/{}".format(workspace)
+            lists = [
+                ("coveragestores", "coverageStores", "coverageStore"),
+                ("coverages", "coverages", "coverage"),
+            ]
+            datastores = self._names(url + "/datastores.json", "dataStores",
+                                     "dataStore")
+            if DATASTORE in datastores:
+                lists.append(("datastores/{}/featuretypes".format(DATASTORE),
+                              "featureTypes", "featureType"))
+            for path, key, item in lists:
+                collection = path.split("/")[-1]
+                names = self._names("{}/{}.json".format(url, path), key,
+                                    item)
+                catalog.update((collection, workspace, n) for n in names)
+        return catalog
+
+    def _names(self, path, key, item):
+        # GeoServer lists an empty collection as an empty string.
+        body = self.get(path).json()[key]
+        return {i["name"] for i in body[item]} if body else set()
+
+    def _register(self, url, collection, workspace, name, data):
+        """PUT an object that is in the catalog, otherwise POST it.
+
+        ``url`` is the collection the object is created in. Replacing an
+        object has GeoServer recalculate its bounds, which may have
+        changed since it was last published.
+        """
+        key = (collection, workspace, name)
+        if key in self.catalog:
+            params = None if collection == "coveragestores" else \
+                {"recalculate": "nativebbox,latlonbbox"}
+            self.put("{}/{}".format(url, name), params=params, json=data)
+        else:
+            self.post(url, json=data)
+            with self._lock:
+                self._catalog.add(key)
+
+    def add(self, layer):
+        """Add the layer to GeoServer.
+
+        In the case of of a Shapefile, the layer should already exist in the
+        PostGIS database. In the case of a GeoTiff, the file should already
+        exist in S3.
+        """
+        if layer.format == 'Shapefile':
+            self._add_feature(layer)
+        elif layer.format == 'GeoTiff':
+            self._add_coverage(layer)
+        else:
+            raise Exception("Unknown format")
+
+    def _add_coverage(self, layer):
+        tile_size = "{},{}".format(*layer.tiff.tile_size or
+                                   (GEOTIFF_TILE_SIZE, GEOTIFF_TILE_SIZE))
+        workspace = PUBLIC_WORKSPACE if layer.is_public() else \
+            RESTRICTED_WORKSPACE
+        data = {
+            "coverageStore": {
+                "name": layer.name,
+                "type": "S3GeoTiff",
+                "enabled": True,
+                "url": "{}://{}/{}".format(self.s3_alias, layer.bucket,
+                                           layer.tif),
+                "workspace": {"name": workspace},
+            }
+        }
+        url = "/workspaces/{}/coveragestores".format(workspace)
+        self._register(url, "coveragestores", workspace, layer.name, data)
+        data = {
+            "coverage": {
+                "enabled": True,
+                "name": layer.name,
+                "nativeName": layer.name,
+                "nativeFormat": "S3GeoTiff",
+                "defaultInterpolationMethod": "nearest neighbor",
+                "parameters": {
+                    "entry": [
+                        {"string": ["SUGGESTED_TILE_SIZE", tile_size]},
+                        {"string": ["AwsRegion", "US_EAST_1"]},
+                    ]
+                }
+            }
+        }
+        url = "/workspaces/{}/coveragestores/{}/coverages".format(workspace,
+                                                                  layer.name)
+        self._register(url, "coverages", workspace, layer.name, data)
+
+    def _add_feature(self, layer):
+        """Add a feature type for a layer's table.
+
+        Each of the layer's generalized tables is added as a feature type
+        of its own, recording the tolerance it was simplified at and the
+        layer it generalizes, so that styles can switch to them at small
+        scales.
+        """
+        workspace = PUBLIC_WORKSPACE if layer.is_public() else \
+            RESTRICTED_WORKSPACE
+        data = {"featureType": {"name": layer.name}}
+        url = "/workspaces/{}/datastores/{}/featuretypes".format(workspace,
+                                                                 DATASTORE)
+        self._register(url, "featuretypes", workspace, layer.name, data)
+        for name, tolerance in layer.generalized:
+            data = {
+                "featureType": {
+                    "name": name,
+                    "nativeName": name,
+                    "title": "{} (generalized at {})".format(layer.name,
+                                                             tolerance),
+                    "metadata": {
+                        "entry": [
+                            {"@key": "generalizes", "$": layer.name},
+                            {"@key": "tolerance", "$": str(tolerance)},
+                        ]
+                    }
+                }
+            }
+            self._register(url, "featuretypes", workspace, name, data)
+
+
+class Solr(HttpMethodMixin):
+    def __init__(self, url, client, auth=None):
+        self.url = url.rstrip("/")
+        self.client = client
+        self.auth = auth
+
+    def request(self, method, path, **kwargs):
+        kwargs = {"stream": False, "auth": self.auth, **kwargs}
+        url = "{}/{}".format(self.url, path.lstrip("/"))
+        r = self.client.request(method, url, **kwargs)
+        r.raise_for_status()
+        return r
+
+    def add(self, record, soft_commit=True):
+        params = {"softCommit": "true"} if soft_commit else None
+        self.post('update/json/docs', params=params, json=record)
+
+    def delete(self, query='dct_provenance_s:MIT'):
+        self.post('update', json={'delete': {'query': query}})
+
+    def commit(self):
+        self.post('update', json={'commit': {}})
+
+    def batcher(self, **kwargs):
+        """Return a :class:`SolrBatcher` adding documents to this Solr.
+
+        Keyword arguments are passed to :class:`SolrBatcher`.
+        """
+        return SolrBatcher(self, **kwargs)
+
+
+class SolrBatcher:
+    """Threadsafe writer adding documents to Solr in batches.
+
+    Documents added from any number of threads are collected and sent in
+    a single update once there are ``max_docs`` of them, they take up
+    ``max_bytes``, or the oldest has waited ``max_wait`` seconds. Updates
+    are sent with ``commitWithin`` rather than a commit of their own, so
+    Solr makes them visible within ``commit_within`` milliseconds while
+    committing as few times as it can.
+
+    :meth:`add` returns a ``concurrent.futures.Future`` for the document.
+    If a batch fails, its documents are sent one at a time so that each
+    future reports whether its own document was added. Callers should not
+    block on the future while they have more documents to add, or batches
+    will never fill. :meth:`flush` sends whatever is queued without
+    waiting. The batcher should be closed, or used as a context manager,
+    to send the last batch::
+
+        with solr.batcher() as batcher:
+            indexed = batcher.add({'layer_slug_s': 'foo'})
+        indexed.result()
+
+    """
+    def __init__(self, solr, max_docs=SOLR_BATCH_DOCS,
+                 max_bytes=SOLR_BATCH_BYTES, max_wait=SOLR_BATCH_WAIT,
+                 commit_within=SOLR_COMMIT_WITHIN):
+        self.solr = solr
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+        self.commit_within = commit_within
+        self._cond = threading.Condition()
+        self._docs = []
+        self._size = 0
+        self._flushing = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, record):
+        """Queue a document, returning a future for its addition."""
+        doc = json.dumps(record).encode('utf-8')
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Cannot add to a closed SolrBatcher')
+            if not self._docs:
+                # Wake the sender so it starts timing the new batch.
+                self._cond.notify()
+            self._docs.append((doc, future, time.monotonic()))
+            self._size += len(doc)
+            if len(self._docs) >= self.max_docs or \
+                    self._size >= self.max_bytes:
+                self._cond.notify()
+        return future
+
+    def flush(self):
+        """Send the documents queued so far without waiting for more."""
+        with self._cond:
+            if self._docs:
+                self._flushing = True
+                self._cond.notify()
+
+    def close(self):
+        """Send any queued documents and stop the batcher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._full():
+                    if self._closed and not self._docs:
+                        return
+                    timeout = None
+                    if self._docs:
+                        # Documents left over from a partial batch keep the
+                        # time they were added.
+                        timeout = self._docs[0][2] + self.max_wait - \
+                            time.monotonic()
+                    self._cond.wait(timeout)
+                batch = [(doc, future) for doc, future, _ in
+                         self._docs[:self.max_docs]]
+                self._docs = self._docs[self.max_docs:]
+                self._size -= sum(len(doc) for doc, _ in batch)
+                self._flushing = self._flushing and bool(self._docs)
+            self._send(batch)
+
+    def _full(self):
+        if not self._docs:
+            return False
+        return self._closed or self._flushing or \
+            len(self._docs) >= self.max_docs or \
+            self._size >= self.max_bytes or \
+            time.monotonic() - self._docs[0][2] >= self.max_wait
+
+    def _send(self, batch):
+        try:
+            self._post([doc for doc, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            for item in batch:
+                self._send([item])
+        else:
+            for _, future in batch:
+                future.set_result(None)
+
+    def _post(self, docs):
+        self.solr.post('update/json/docs',
+                       params={'commitWithin': self.commit_within},
+                       data=b'[' + b','.join(docs) + b']',
+                       headers={'Content-Type': 'application/json'})
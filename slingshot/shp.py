@@ -0,0 +1,193 @@
+import struct
+
+import attr
+import numpy as np
+
+from slingshot import COPY_BATCH_SIZE
+
+
+HEADER_SIZE = 100
+FILE_CODE = 9994
+
+NULL = 0
+POINT = 1
+POLYLINE = 3
+POLYGON = 5
+MULTIPOINT = 8
+
+#: Offset within a record's content of the point count and of the part
+#: or point data for shapes with a bounding box.
+POLY_COUNTS = 36
+MULTIPOINT_COUNT = 36
+
+
+@attr.s(frozen=True)
+class ShapeBatch:
+    """The geometries of a run of consecutive shapefile records.
+
+    ``shape_types`` holds the shape type of each record, which is either
+    the type of the file or 0 for a null shape. The parts of record ``i``
+    are ``parts[part_offsets[i]:part_offsets[i + 1]]``, each giving the
+    index of the part's first point relative to the record. The points of
+    record ``i`` are ``coords[point_offsets[i]:point_offsets[i + 1]]``, a
+    contiguous ``(n, 2)`` array of little endian doubles. ``bboxes`` is an
+    ``(n, 4)`` array of each record's ``xmin, ymin, xmax, ymax``, which is
+    NaN for a null shape.
+    """
+    shape_types = attr.ib()
+    part_offsets = attr.ib()
+    parts = attr.ib()
+    point_offsets = attr.ib()
+    coords = attr.ib()
+    bboxes = attr.ib()
+
+    def __len__(self):
+        return len(self.shape_types)
+
+
+class ShpReader:
+    """Read the geometries of a shapefile into NumPy arrays.
+
+    The ``.shx`` index gives the offset and length of every record, so a
+    batch of records is read from the ``.shp`` with a single read and
+    decoded with array operations rather than a Python object per point.
+    Points, polylines, polygons and multipoints are supported.
+    """
+    def __init__(self, shp, shx):
+        self.shp = shp
+        shp.seek(0)
+        header = _read_exact(shp, HEADER_SIZE)
+        if struct.unpack('>i', header[:4])[0] != FILE_CODE:
+            raise ValueError('Not a shapefile')
+        self.shape_type, = struct.unpack('<i', header[32:36])
+        self.bbox = struct.unpack('<4d', header[36:68])
+        if self.shape_type not in (NULL, POINT, POLYLINE, POLYGON,
+                                   MULTIPOINT):
+            raise ValueError('Unsupported shape type {}'
+                             .format(self.shape_type))
+        shx.seek(HEADER_SIZE)
+        index = np.frombuffer(shx.read(), '>i4').reshape(-1, 2)
+        self.offsets = index[:, 0].astype(np.int64) * 2
+        self.lengths = index[:, 1].astype(np.int64) * 2
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def batches(self, size=COPY_BATCH_SIZE, start=0, stop=None):
+        """Yield a :class:`ShapeBatch` for every ``size`` records.
+
+        Only the records from ``start`` up to ``stop`` are read.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop, size):
+            yield self.read(i, min(size, stop - i))
+
+    def read(self, start, count):
+        """Read ``count`` records starting at record ``start``."""
+        offsets = self.offsets[start:start + count]
+        lengths = self.lengths[start:start + count]
+        begin = int(offsets[0])
+        end = int(offsets[-1] + 8 + lengths[-1])
+        self.shp.seek(begin)
+        buf = np.frombuffer(_read_exact(self.shp, end - begin), np.uint8)
+        # Skip the 8 byte record header to reach each record's content.
+        content = offsets - begin + 8
+        types = _gather(buf, content, 4).view('<i4')[:, 0].astype(np.int32)
+        if np.any((types != NULL) & (types != self.shape_type)):
+            raise ValueError('Shapefile records have mixed shape types')
+        present = types != NULL
+        if self.shape_type == POINT:
+            return _points(buf, content, present, types)
+        # Multipoints, polylines and polygons start with their bounding
+        # box, so there is no need to look at their points.
+        bboxes = np.full((len(types), 4), np.nan)
+        bboxes[present] = _gather(buf, content[present] + 4, 32).view('<f8')
+        if self.shape_type == MULTIPOINT:
+            n_parts = np.zeros(len(types), np.int64)
+            n_points = _counts(buf, content + MULTIPOINT_COUNT, present)
+            point_start = content + MULTIPOINT_COUNT + 4
+        else:
+            n_parts = _counts(buf, content + POLY_COUNTS, present)
+            n_points = _counts(buf, content + POLY_COUNTS + 4, present)
+            point_start = content + POLY_COUNTS + 8 + 4 * n_parts
+        parts = _gather_runs(buf, content + POLY_COUNTS + 8, n_parts, 4)
+        coords = _gather_runs(buf, point_start, n_points, 16)
+        return ShapeBatch(shape_types=np.where(present, types, NULL),
+                          part_offsets=_offsets(n_parts),
+                          parts=parts.view('<i4')[:, 0],
+                          point_offsets=_offsets(n_points),
+                          coords=coords.view('<f8'),
+                          bboxes=bboxes)
+
+
+def _points(buf, content, present, types):
+    coords = _gather(buf, content[present] + 4, 16).view('<f8')
+    bboxes = np.full((len(types), 4), np.nan)
+    bboxes[present] = np.tile(coords, 2)
+    return ShapeBatch(shape_types=np.where(present, types, NULL),
+                      part_offsets=np.zeros(len(types) + 1, np.int64),
+                      parts=np.zeros(0, '<i4'),
+                      point_offsets=_offsets(present.astype(np.int64)),
+                      coords=coords,
+                      bboxes=bboxes)
+
+
+def _counts(buf, starts, present):
+    counts = np.zeros(len(starts), np.int64)
+    counts[present] = _gather(buf, starts[present], 4).view('<i4')[:, 0]
+    if np.any(counts < 0):
+        raise ValueError('Shapefile record has a negative count')
+    return counts
+
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def _windows(buf, width):
+    """View ``buf`` as the overlapping ``width`` byte windows at each byte.
+
+    Indexing the view with an array of offsets copies the fields at those
+    offsets into a ``(n, width)`` array, which can then be viewed as the
+    field's type. Fields in a shapefile are not aligned, so they cannot be
+    viewed in place.
+    """
+    return np.lib.stride_tricks.as_strided(
+        buf, (max(len(buf) - width + 1, 0), width), (1, 1), writeable=False)
+
+
+def _gather(buf, starts, width):
+    """Return the ``width`` bytes at each of ``starts``."""
+    return _windows(buf, width)[starts]
+
+
+def _gather_runs(buf, starts, counts, width):
+    """Concatenate runs of ``counts`` fields of ``width`` bytes.
+
+    Run ``i`` starts at byte ``starts[i]`` of ``buf``. The result has a row
+    for every field in every run.
+    """
+    total = int(counts.sum())
+    if not total:
+        return np.zeros((0, width), np.uint8)
+    # A field's offset is its run's start plus its position in the run,
+    # which is its position in the output less the run's output offset.
+    ends = np.cumsum(counts)
+    idx = np.repeat(starts - width * (ends - counts), counts) + \
+        width * np.arange(total)
+    if idx.min() < 0:
+        raise ValueError('Shapefile record has an invalid offset')
+    return _windows(buf, width)[idx]
+
+
+def _read_exact(fp, size):
+    chunks = []
+    while size:
+        chunk = fp.read(size)
+        if not chunk:
+            raise ValueError('Unexpected end of shapefile')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
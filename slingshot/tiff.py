@@ -0,0 +1,296 @@
+import struct
+
+import attr
+
+
+#: TIFF tags used when inspecting a file.
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIG = 284
+PREDICTOR = 317
+COLORMAP = 320
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+EXTRA_SAMPLES = 338
+SAMPLE_FORMAT = 339
+
+#: Names for the common values of the Compression tag.
+COMPRESSION_NAMES = {
+    1: 'none',
+    5: 'lzw',
+    6: 'ojpeg',
+    7: 'jpeg',
+    8: 'deflate',
+    32773: 'packbits',
+    32946: 'deflate',
+    34887: 'lerc',
+    50000: 'zstd',
+    50001: 'webp',
+}
+
+#: ``(struct format, size)`` of each TIFF field type.
+FIELD_TYPES = {
+    1: ('B', 1),    # BYTE
+    2: ('c', 1),    # ASCII
+    3: ('H', 2),    # SHORT
+    4: ('L', 4),    # LONG
+    5: ('2L', 8),   # RATIONAL
+    6: ('b', 1),    # SBYTE
+    7: ('c', 1),    # UNDEFINED
+    8: ('h', 2),    # SSHORT
+    9: ('l', 4),    # SLONG
+    10: ('2l', 8),  # SRATIONAL
+    11: ('f', 4),   # FLOAT
+    12: ('d', 8),   # DOUBLE
+    16: ('Q', 8),   # LONG8
+    17: ('q', 8),   # SLONG8
+    18: ('Q', 8),   # IFD8
+}
+
+#: Tags whose values are read when an IFD is parsed. Anything else,
+#: including GeoTIFF keys and the tile and strip offset arrays, is skipped
+#: so that inspecting a file only needs to read the IFDs themselves.
+READ_TAGS = frozenset((NEW_SUBFILE_TYPE, IMAGE_WIDTH, IMAGE_LENGTH,
+                       BITS_PER_SAMPLE, COMPRESSION, PHOTOMETRIC,
+                       SAMPLES_PER_PIXEL, ROWS_PER_STRIP, PLANAR_CONFIG,
+                       PREDICTOR, TILE_WIDTH, TILE_LENGTH, SAMPLE_FORMAT))
+
+#: Refuse to follow more IFDs than this, in case of a loop in the chain.
+MAX_IFDS = 1024
+
+
+@attr.s(frozen=True)
+class Ifd:
+    """A single image file directory.
+
+    For a striped image, ``block_width`` and ``block_height`` are the size
+    of a strip. ``blocks`` is the number of tiles or strips. ``entries``
+    holds the raw ``(type, count, value)`` of every tag so that tags which
+    were not read up front can be read with :meth:`TiffInfo.read_tag`.
+    """
+    offset = attr.ib()
+    width = attr.ib()
+    height = attr.ib()
+    tiled = attr.ib()
+    block_width = attr.ib()
+    block_height = attr.ib()
+    compression = attr.ib()
+    subfile_type = attr.ib(default=0)
+    bits_per_sample = attr.ib(default=(1,))
+    samples_per_pixel = attr.ib(default=1)
+    planar_config = attr.ib(default=1)
+    predictor = attr.ib(default=1)
+    sample_format = attr.ib(default=(1,))
+    photometric = attr.ib(default=None)
+    blocks = attr.ib(default=None)
+    entries = attr.ib(default=attr.Factory(dict), repr=False, eq=False)
+
+    @property
+    def is_overview(self):
+        """Whether this is a reduced resolution version of another image."""
+        return bool(self.subfile_type & 0x1)
+
+    @property
+    def is_mask(self):
+        return bool(self.subfile_type & 0x4)
+
+
+@attr.s(frozen=True)
+class TiffInfo:
+    """The layout of a TIFF or BigTIFF file.
+
+    Only the first image in the file and its overviews are described.
+    Internal masks are ignored.
+    """
+    bigtiff = attr.ib()
+    byteorder = attr.ib()
+    ifds = attr.ib()
+
+    @property
+    def image(self):
+        return self.ifds[0]
+
+    @property
+    def overviews(self):
+        return [i for i in self.ifds[1:] if i.is_overview and not i.is_mask]
+
+    @property
+    def tiled(self):
+        return self.image.tiled
+
+    @property
+    def tile_size(self):
+        """The ``(width, height)`` of a tile, or ``None`` if striped."""
+        if self.tiled:
+            return self.image.block_width, self.image.block_height
+
+    @property
+    def compression(self):
+        code = self.image.compression
+        return COMPRESSION_NAMES.get(code, str(code))
+
+    @property
+    def is_cog(self):
+        """Whether the file is laid out as a Cloud Optimized GeoTIFF.
+
+        The image and all of its overviews must be tiled, and an image
+        larger than a single tile must have at least one overview.
+        """
+        if not all(i.tiled for i in [self.image] + self.overviews):
+            return False
+        tw, th = self.tile_size
+        if self.image.width > tw or self.image.height > th:
+            return bool(self.overviews)
+        return True
+
+    def read_tag(self, fp, ifd, tag, default=None):
+        """Read the values of a tag in ``ifd`` from ``fp``."""
+        if tag not in ifd.entries:
+            return default
+        typ, count, value = ifd.entries[tag]
+        return _read_value(fp, self.byteorder, typ, count, value,
+                           self.bigtiff)
+
+    def read_raw(self, fp, ifd, tag):
+        """Read a tag in ``ifd`` as ``(type, count, bytes)``.
+
+        The bytes are in the byte order of the file. Returns ``None`` if the
+        tag is not present.
+        """
+        if tag not in ifd.entries:
+            return None
+        typ, count, value = ifd.entries[tag]
+        return typ, count, _read_raw(fp, self.byteorder, typ, count, value,
+                                     self.bigtiff)
+
+
+class TiffError(Exception):
+    """Errors reading the structure of a TIFF file."""
+    pass
+
+
+def read_tiff(fp):
+    """Read the image file directories of a TIFF or BigTIFF file.
+
+    ``fp`` should be a seekable file-like object. Only the header and the
+    IFDs are read, with each IFD being read in one or two small reads, so
+    this works well over a :class:`slingshot.s3.S3IO` with a block cache.
+    Returns a :class:`TiffInfo`.
+    """
+    fp.seek(0)
+    header = fp.read(16)
+    if len(header) < 8:
+        raise TiffError('File is too short to be a TIFF')
+    if header[:2] == b'II':
+        bo = '<'
+    elif header[:2] == b'MM':
+        bo = '>'
+    else:
+        raise TiffError('Not a TIFF file')
+    version, = struct.unpack(bo + 'H', header[2:4])
+    if version == 42:
+        bigtiff = False
+        offset, = struct.unpack(bo + 'L', header[4:8])
+    elif version == 43:
+        bigtiff = True
+        size, _, offset = struct.unpack(bo + 'HHQ', header[4:16])
+        if size != 8:
+            raise TiffError('Unsupported BigTIFF offset size {}'.format(size))
+    else:
+        raise TiffError('Unknown TIFF version {}'.format(version))
+    ifds = []
+    seen = set()
+    while offset:
+        if offset in seen or len(ifds) >= MAX_IFDS:
+            raise TiffError('Invalid IFD chain')
+        seen.add(offset)
+        ifd, offset = _read_ifd(fp, offset, bo, bigtiff)
+        ifds.append(ifd)
+    if not ifds:
+        raise TiffError('TIFF file has no images')
+    return TiffInfo(bigtiff=bigtiff, byteorder=bo, ifds=ifds)
+
+
+def _read_ifd(fp, offset, bo, bigtiff):
+    if bigtiff:
+        count_fmt, entry_fmt, next_fmt = 'Q', 'HHQ8s', 'Q'
+    else:
+        count_fmt, entry_fmt, next_fmt = 'H', 'HHL4s', 'L'
+    count_size = struct.calcsize(bo + count_fmt)
+    entry = struct.Struct(bo + entry_fmt)
+    fp.seek(offset)
+    count, = struct.unpack(bo + count_fmt, _read_exact(fp, count_size))
+    data = _read_exact(fp, count * entry.size + struct.calcsize(bo + next_fmt))
+    tags = {}
+    entries = {}
+    for i in range(count):
+        tag, typ, n, value = entry.unpack_from(data, i * entry.size)
+        if typ not in FIELD_TYPES:
+            continue
+        entries[tag] = (typ, n, value)
+        if tag in READ_TAGS:
+            tags[tag] = _read_value(fp, bo, typ, n, value, bigtiff)
+        elif tag in (TILE_OFFSETS, STRIP_OFFSETS):
+            tags[tag] = n
+    next_offset, = struct.unpack_from(bo + next_fmt, data,
+                                      count * entry.size)
+    tiled = TILE_WIDTH in tags
+    try:
+        width = tags[IMAGE_WIDTH][0]
+        height = tags[IMAGE_LENGTH][0]
+    except KeyError:
+        raise TiffError('IFD at offset {} has no image size'.format(offset))
+    if tiled:
+        block_width = tags[TILE_WIDTH][0]
+        block_height = tags.get(TILE_LENGTH, (block_width,))[0]
+        blocks = tags.get(TILE_OFFSETS)
+    else:
+        block_width = width
+        block_height = min(tags.get(ROWS_PER_STRIP, (height,))[0], height)
+        blocks = tags.get(STRIP_OFFSETS)
+    ifd = Ifd(offset=offset, width=width, height=height, tiled=tiled,
+              block_width=block_width, block_height=block_height,
+              compression=tags.get(COMPRESSION, (1,))[0],
+              subfile_type=tags.get(NEW_SUBFILE_TYPE, (0,))[0],
+              bits_per_sample=tags.get(BITS_PER_SAMPLE, (1,)),
+              samples_per_pixel=tags.get(SAMPLES_PER_PIXEL, (1,))[0],
+              planar_config=tags.get(PLANAR_CONFIG, (1,))[0],
+              predictor=tags.get(PREDICTOR, (1,))[0],
+              sample_format=tags.get(SAMPLE_FORMAT, (1,)),
+              photometric=tags.get(PHOTOMETRIC, (None,))[0],
+              blocks=blocks, entries=entries)
+    return ifd, next_offset
+
+
+def _read_value(fp, bo, typ, count, value, bigtiff):
+    fmt, _ = FIELD_TYPES[typ]
+    return struct.unpack(bo + fmt * count,
+                         _read_raw(fp, bo, typ, count, value, bigtiff))
+
+
+def _read_raw(fp, bo, typ, count, value, bigtiff):
+    total = FIELD_TYPES[typ][1] * count
+    if total > len(value):
+        pos = struct.unpack(bo + ('Q' if bigtiff else 'L'), value)[0]
+        current = fp.tell()
+        fp.seek(pos)
+        value = _read_exact(fp, total)
+        fp.seek(current)
+    return value[:total]
+
+
+def _read_exact(fp, size):
+    data = fp.read(size)
+    if len(data) < size:
+        raise TiffError('Unexpected end of TIFF file')
+    return data
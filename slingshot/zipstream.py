@@ -0,0 +1,251 @@
+import io
+import struct
+import zlib
+from zipfile import BadZipFile, ZIP_DEFLATED, ZIP_STORED, ZipInfo
+
+from slingshot import S3_BUFFER_SIZE
+
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+DESCRIPTOR = struct.Struct('<3L')
+DESCRIPTOR64 = struct.Struct('<L2Q')
+
+LOCAL_SIG = b'PK\x03\x04'
+CENTRAL_SIG = b'PK\x01\x02'
+DESCRIPTOR_SIG = b'PK\x07\x08'
+END_SIGS = (b'PK\x05\x06', b'PK\x06\x06')
+
+ZIP64_LIMIT = 0xFFFFFFFF
+
+
+class ZipStream:
+    """Read the members of a zipfile from a forward-only stream.
+
+    Iterating over a ``ZipStream`` yields a ``(ZipInfo, fp)`` tuple for
+    each member, where ``fp`` is a file-like object of the uncompressed
+    member data. Members are found by walking the local file headers, so
+    the stream is read from start to finish exactly once. A member that is
+    not fully read is skipped over when the next member is requested.
+
+    Once every member has been read, the central directory at the end of
+    the archive is checked against what was found in the local headers and
+    a ``BadZipFile`` is raised if they disagree. Only stored and deflated
+    members are supported, and stored members must not use a data
+    descriptor since their size cannot otherwise be known.
+    """
+    def __init__(self, fp):
+        self._fp = _Stream(fp)
+        self._members = []
+
+    def __iter__(self):
+        member = None
+        while True:
+            if member is not None:
+                member.drain()
+                self._check(member)
+            sig = self._fp.peek(4)
+            if sig != LOCAL_SIG:
+                break
+            info, zip64 = self._local_header()
+            member = _Member(self._fp, info, zip64)
+            yield info, member
+        self._verify_central_directory(sig)
+
+    def _local_header(self):
+        (_, _, flags, method, time, date, crc, csize, usize, nlen,
+         elen) = LOCAL_HEADER.unpack(self._fp.read_exact(LOCAL_HEADER.size))
+        name = self._fp.read_exact(nlen)
+        extra = self._fp.read_exact(elen)
+        info = ZipInfo(_decode_name(name, flags))
+        info.flag_bits = flags
+        info.compress_type = method
+        info.date_time = ((date >> 9) + 1980, (date >> 5) & 0xF, date & 0x1F,
+                          time >> 11, (time >> 5) & 0x3F, (time & 0x1F) * 2)
+        info.CRC = crc
+        info.compress_size = csize
+        info.file_size = usize
+        info.extra = extra
+        zip64 = _apply_zip64(info, extra)
+        if method not in (ZIP_STORED, ZIP_DEFLATED):
+            raise BadZipFile('Unsupported compression method {} for {}'
+                             .format(method, info.filename))
+        if method == ZIP_STORED and flags & 0x8:
+            raise BadZipFile('Cannot stream stored member {} with a data '
+                             'descriptor'.format(info.filename))
+        if flags & 0x1:
+            raise BadZipFile('Cannot stream encrypted member {}'
+                             .format(info.filename))
+        return info, zip64
+
+    def _check(self, member):
+        info = member.info
+        if info.flag_bits & 0x8:
+            if self._fp.peek(4) == DESCRIPTOR_SIG:
+                self._fp.read_exact(4)
+            desc = DESCRIPTOR64 if member.zip64 else DESCRIPTOR
+            info.CRC, info.compress_size, info.file_size = \
+                desc.unpack(self._fp.read_exact(desc.size))
+        if member.crc != info.CRC:
+            raise BadZipFile('Bad CRC-32 for file {}'.format(info.filename))
+        if member.size != info.file_size or \
+                member.compressed != info.compress_size:
+            raise BadZipFile('Bad size for file {}'.format(info.filename))
+        self._members.append(info)
+
+    def _verify_central_directory(self, sig):
+        entries = []
+        while sig == CENTRAL_SIG:
+            fields = CENTRAL_HEADER.unpack(
+                self._fp.read_exact(CENTRAL_HEADER.size))
+            flags, crc, csize, usize = fields[3], fields[7], fields[8], \
+                fields[9]
+            nlen, elen, clen = fields[10], fields[11], fields[12]
+            info = ZipInfo(_decode_name(self._fp.read_exact(nlen), flags))
+            info.CRC, info.compress_size, info.file_size = crc, csize, usize
+            _apply_zip64(info, self._fp.read_exact(elen))
+            self._fp.read_exact(clen)
+            entries.append(info)
+            sig = self._fp.peek(4)
+        if sig not in END_SIGS:
+            raise BadZipFile('Unexpected data before end of central '
+                             'directory')
+        found = [(i.filename, i.CRC, i.compress_size, i.file_size)
+                 for i in self._members]
+        expected = [(i.filename, i.CRC, i.compress_size, i.file_size)
+                    for i in entries]
+        if found != expected:
+            raise BadZipFile('Local file headers do not match the central '
+                             'directory')
+
+
+class _Member(io.RawIOBase):
+    """The uncompressed data of a single member of a ``ZipStream``."""
+    def __init__(self, stream, info, zip64):
+        self.info = info
+        self.zip64 = zip64
+        self.crc = 0
+        self.size = 0
+        self.compressed = 0
+        self._stream = stream
+        self._sized = not info.flag_bits & 0x8
+        self._eof = False
+        self._buffer = bytearray()
+        if info.compress_type == ZIP_DEFLATED:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        else:
+            self._decompressor = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def read(self, size=-1):
+        """Read ``size`` bytes, or fewer only at the end of the member.
+
+        Like ``ZipExtFile``, a read is only short at the end of the data,
+        so that each part of a multipart upload is a full ``chunksize``.
+        Decompressed data beyond ``size`` is kept for the next read.
+        """
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(S3_BUFFER_SIZE), b''))
+        if size == 0:
+            return b''
+        while len(self._buffer) < size and not self._eof:
+            self._buffer += self._read(size - len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        return data
+
+    def drain(self):
+        while self.read(S3_BUFFER_SIZE):
+            pass
+
+    def _read(self, size):
+        if self._sized:
+            n = min(size, self.info.compress_size - self.compressed)
+        else:
+            n = size
+        chunk = self._stream.read(n) if n else b''
+        self.compressed += len(chunk)
+        if self._decompressor is None:
+            if not chunk:
+                self._eof = True
+            return chunk
+        data = self._decompressor.decompress(chunk)
+        if self._decompressor.eof:
+            unused = self._decompressor.unused_data
+            self.compressed -= len(unused)
+            self._stream.unread(unused)
+            self._eof = True
+        elif not chunk:
+            raise BadZipFile('Unexpected end of data for file {}'
+                             .format(self.info.filename))
+        return data
+
+
+class _Stream:
+    """A forward-only stream with support for peeking and pushing back."""
+    def __init__(self, fp):
+        self._fp = fp
+        self._buffer = b''
+
+    def read(self, size):
+        if not self._buffer:
+            return self._fp.read(size)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        if len(data) < size:
+            data += self._fp.read(size - len(data))
+        return data
+
+    def read_exact(self, size):
+        data = self.read(size)
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                raise BadZipFile('Unexpected end of zipfile')
+            data += chunk
+        return data
+
+    def peek(self, size):
+        while len(self._buffer) < size:
+            chunk = self._fp.read(size - len(self._buffer))
+            if not chunk:
+                break
+            self._buffer += chunk
+        return self._buffer[:size]
+
+    def unread(self, data):
+        self._buffer = data + self._buffer
+
+
+def _decode_name(name, flags):
+    if flags & 0x800:
+        return name.decode('utf-8')
+    return name.decode('cp437')
+
+
+def _apply_zip64(info, extra):
+    """Update the sizes of ``info`` from a zip64 extra field.
+
+    Returns ``True`` if the extra data contained a zip64 field.
+    """
+    while len(extra) >= 4:
+        tag, size = struct.unpack('<2H', extra[:4])
+        if tag == 0x0001:
+            data = extra[4:4 + size]
+            if info.file_size == ZIP64_LIMIT and len(data) >= 8:
+                info.file_size, = struct.unpack('<Q', data[:8])
+                data = data[8:]
+            if info.compress_size == ZIP64_LIMIT and len(data) >= 8:
+                info.compress_size, = struct.unpack('<Q', data[:8])
+            return True
+        extra = extra[4 + size:]
+    return False
@@ -0,0 +1,166 @@
+import asyncio
+import io
+import os
+import socket
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import boto3
+import pytest
+
+aio = pytest.importorskip('slingshot.aio')
+pytest.importorskip('aiobotocore')
+server = pytest.importorskip('moto.server')
+
+
+@pytest.fixture
+def moto_server():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    srv = server.ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    srv.start()
+    endpoint = 'http://127.0.0.1:{}'.format(port)
+    s3 = boto3.resource('s3', endpoint_url=endpoint)
+    s3.create_bucket(Bucket='upload')
+    s3.create_bucket(Bucket='store')
+    yield endpoint, s3
+    srv.stop()
+
+
+def run(coro_fn, endpoint):
+    async def main():
+        async with aio.client(endpoint_url=endpoint) as client:
+            return await coro_fn(client)
+    return asyncio.run(main())
+
+
+def test_async_s3io_reads_range(moto_server):
+    endpoint, s3 = moto_server
+    s3.Object('store', 'foo').put(Body=b'0123456789')
+
+    async def read(client):
+        fp = aio.AsyncS3IO(client, 'store', 'foo')
+        await fp.seek(-4, io.SEEK_END)
+        return await fp.read(2), await fp.read()
+
+    assert run(read, endpoint) == (b'67', b'89')
+
+
+def test_async_upload_uploads_parts(moto_server):
+    endpoint, s3 = moto_server
+    data = os.urandom(11 * 1024 * 1024)
+
+    class Reader:
+        def __init__(self):
+            self.fp = io.BytesIO(data)
+
+        async def read(self, size):
+            return self.fp.read(size)
+
+    async def up(client):
+        await aio.upload(Reader(), 'store', 'foo', client,
+                         chunksize=5 * 1024 * 1024, window=2)
+
+    run(up, endpoint)
+    assert s3.Object('store', 'foo').get()['Body'].read() == data
+
+
+def test_async_unpack_zip_extracts_to_bucket(moto_server, shapefile):
+    endpoint, s3 = moto_server
+    s3.Bucket('upload').upload_file(shapefile, 'bermuda.zip')
+
+    async def unpack(client):
+        return await aio.unpack_zip('upload', 'bermuda.zip', 'store', client)
+
+    manifest = run(unpack, endpoint)
+    assert manifest['bermuda/bermuda.shp'].size == 20064
+    with ZipFile(shapefile) as zf:
+        for info in zf.infolist():
+            if not info.is_dir():
+                obj = s3.Object('store', info.filename)
+                assert obj.get()['Body'].read() == zf.read(info)
+
+
+def test_async_member_reads_full_parts(moto_server):
+    endpoint, s3 = moto_server
+    chunksize = 5 * 1024 * 1024
+    data = os.urandom(2 * chunksize + 1000)
+    buf = io.BytesIO()
+    with ZipFile(buf, 'w') as zf:
+        zf.writestr('foo/big.bin', data, compress_type=ZIP_DEFLATED)
+    s3.Object('upload', 'foo.zip').put(Body=buf.getvalue())
+    with ZipFile(buf) as zf:
+        info = zf.getinfo('foo/big.bin')
+
+    async def read(client):
+        fp = aio._AsyncMember(client, 'upload', 'foo.zip', info)
+        sizes = []
+        while True:
+            chunk = await fp.read(chunksize)
+            if not chunk:
+                break
+            sizes.append(len(chunk))
+        await fp.close()
+        fp = aio._AsyncMember(client, 'upload', 'foo.zip', info)
+        try:
+            await aio.upload(fp, 'store', 'big.bin', client,
+                             chunksize=chunksize)
+        finally:
+            await fp.close()
+        return sizes
+
+    assert run(read, endpoint) == [chunksize, chunksize, 1000]
+    assert s3.Object('store', 'big.bin').get()['Body'].read() == data
+
+
+def test_async_unpack_zip_copies_stored_members(moto_server):
+    endpoint, s3 = moto_server
+    buf = io.BytesIO()
+    with ZipFile(buf, 'w') as zf:
+        zf.writestr('foo/stored.tif', b'tiff' * 100, compress_type=ZIP_STORED)
+    s3.Object('upload', 'foo.zip').put(Body=buf.getvalue())
+
+    async def unpack(client):
+        return await aio.unpack_zip('upload', 'foo.zip', 'store', client)
+
+    run(unpack, endpoint)
+    assert s3.Object('store', 'foo/stored.tif').get()['Body'].read() == \
+        b'tiff' * 100
+
+
+def test_async_layer_opens_files(moto_server, shapefile_layer):
+    endpoint, s3 = moto_server
+    for f in os.listdir(shapefile_layer):
+        s3.Bucket('store').upload_file(os.path.join(shapefile_layer, f),
+                                       os.path.join('bermuda', f))
+
+    async def prj(client):
+        layer = aio.AsyncS3Layer('store', 'bermuda', client)
+        return await (await layer.prj()).read(6)
+
+    assert run(prj, endpoint) == b'GEOGCS'
+
+
+def test_async_copy_limits_concurrent_parts():
+    class Client:
+        inflight = 0
+        most = 0
+
+        async def create_multipart_upload(self, **kwargs):
+            return {'UploadId': 'upload'}
+
+        async def upload_part_copy(self, PartNumber, **kwargs):
+            self.inflight += 1
+            self.most = max(self.most, self.inflight)
+            await asyncio.sleep(0.001)
+            self.inflight -= 1
+            return {'CopyPartResult': {'ETag': str(PartNumber)}}
+
+        async def complete_multipart_upload(self, MultipartUpload, **kwargs):
+            return MultipartUpload
+
+    client = Client()
+    res = asyncio.run(aio.copy('upload', 'foo.zip', 0, 100, 'store', 'foo',
+                               client, chunksize=10, workers=3))
+    assert [p['PartNumber'] for p in res['Parts']] == list(range(1, 11))
+    assert client.most == 3
@@ -1,20 +1,22 @@
+from concurrent.futures import Future
 from datetime import datetime
-import uuid
+import io
+import os
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 import pytest
 import requests_mock
 
 from slingshot.app import (
+    _then,
+    check_geotiff,
     create_record,
-    GeoServer,
-    HttpSession,
-    make_slug,
-    make_uuid,
     publish_layer,
     publishable_layers,
-    Solr,
     unpack_zip,
 )
+from slingshot.layer import GeoTiff, PackageError
+from slingshot.services import GeoServer, HttpSession, Solr
 
 
 def test_unpack_zip_extracts_to_bucket(s3, shapefile):
@@ -25,6 +27,67 @@ def test_unpack_zip_extracts_to_bucket(s3, shapefile):
     assert 'bermuda/bermuda.shp' in objs
 
 
+def test_unpack_zip_returns_manifest(s3, shapefile):
+    with open(shapefile, 'rb') as fp:
+        s3.Bucket("upload").put_object(Key="bermuda.zip", Body=fp)
+    manifest = unpack_zip("upload", "bermuda.zip", "store")
+    assert (manifest.bucket, manifest.prefix) == ("store", "bermuda")
+    assert len(manifest) == 6
+    entry = manifest['bermuda/bermuda.shp']
+    assert entry.size == 20064
+    assert entry.etag == s3.Object("store", "bermuda/bermuda.shp").e_tag
+
+
+def test_unpack_zip_extracts_members_concurrently(s3, shapefile):
+    with open(shapefile, 'rb') as fp:
+        s3.Bucket("upload").put_object(Key="bermuda.zip", Body=fp)
+    unpack_zip("upload", "bermuda.zip", "store", workers=3, max_inflight=1)
+    with ZipFile(shapefile) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            obj = s3.Object("store", info.filename)
+            assert obj.get()['Body'].read() == zf.read(info)
+
+
+def test_unpack_zip_uses_shared_client(s3, shapefile, monkeypatch):
+    with open(shapefile, 'rb') as fp:
+        s3.Bucket("upload").put_object(Key="bermuda.zip", Body=fp)
+
+    def fail(*args, **kwargs):
+        raise Exception("Created a boto3 resource")
+
+    monkeypatch.setattr('slingshot.app.clients.resource', fail)
+    manifest = unpack_zip("upload", "bermuda.zip", "store", workers=3)
+    assert len(manifest) == 6
+
+
+def test_unpack_zip_copies_stored_members(s3):
+    data = os.urandom(1024)
+    buf = io.BytesIO()
+    with ZipFile(buf, 'w') as zf:
+        zf.writestr('foo/stored.tif', data, compress_type=ZIP_STORED)
+        zf.writestr('foo/empty.txt', b'', compress_type=ZIP_STORED)
+        zf.writestr('foo/deflated.xml', b'<xml/>' * 100,
+                    compress_type=ZIP_DEFLATED)
+    s3.Bucket("upload").put_object(Key="foo.zip", Body=buf.getvalue())
+    unpack_zip("upload", "foo.zip", "store")
+    assert s3.Object("store", "foo/stored.tif").get()['Body'].read() == data
+    assert s3.Object("store", "foo/empty.txt").get()['Body'].read() == b''
+    assert s3.Object("store", "foo/deflated.xml").get()['Body'].read() == \
+        b'<xml/>' * 100
+
+
+def test_unpack_zip_streams_zipfile(s3, shapefile):
+    with open(shapefile, 'rb') as fp:
+        s3.Bucket("upload").put_object(Key="bermuda.zip", Body=fp)
+    manifest = unpack_zip("upload", "bermuda.zip", "store", streaming=True)
+    assert manifest['bermuda/bermuda.dbf'].size == 3165840
+    with ZipFile(shapefile) as zf:
+        obj = s3.Object("store", "bermuda/bermuda.dbf")
+        assert obj.get()['Body'].read() == zf.read('bermuda/bermuda.dbf')
+
+
 def test_create_record_creates_record(shapefile_object):
     record = create_record(shapefile_object, "http://example.com",
                            "http://example.com/download")
@@ -45,54 +108,22 @@ def test_create_record_adds_fgdc_url(shapefile_object):
         "https://store.s3.amazonaws.com/bermuda/bermuda.xml"
 
 
-def test_geoserver_adds_shapefile(shapefile_object):
-    geoserver = GeoServer("mock://example.com/geoserver/", HttpSession())
-    with requests_mock.Mocker() as m:
-        m.post("mock://example.com/geoserver/rest/workspaces/public/"
-               "datastores/pg/featuretypes")
-        geoserver.add(shapefile_object)
-        assert m.request_history[0].text == \
-            '{"featureType": {"name": "bermuda"}}'
-
-
-def test_solr_adds_layer_to_solr():
-    with requests_mock.Mocker() as m:
-        m.post('mock://example.com/update/json/docs')
-        s = Solr('mock://example.com/', HttpSession())
-        s.add({'foo': 'bar'})
-        assert m.request_history[0].json() == {'foo': 'bar'}
-
-
-def test_solr_deletes_by_query():
-    with requests_mock.Mocker() as m:
-        m.post('mock://example.com/update')
-        s = Solr('mock://example.com/', HttpSession())
-        s.delete()
-        assert m.request_history[0].json() == \
-            {'delete': {'query': 'dct_provenance_s:MIT'}}
-
-
-def test_solr_commits_changes():
-    with requests_mock.Mocker() as m:
-        m.post('mock://example.com/update')
-        s = Solr('mock://example.com/', HttpSession())
-        s.commit()
-        assert m.request_history[0].json() == {'commit': {}}
-
-
-def test_make_uuid_creates_uuid_string():
-    assert make_uuid('bermuda', 'mit.edu') == \
-        uuid.UUID('df04b29c-0e51-58a8-8a37-557e4f4917df')
-
-
-def test_make_slug_creates_slug():
-    assert make_slug('bermuda') == 'mit-34clfhaokfmkq'
+def test_check_geotiff_rejects_non_cog(s3, geotiff):
+    with ZipFile(geotiff) as zf:
+        s3.Object('store', 'france/france.tiff').put(
+            Body=zf.read('france.tiff'))
+    layer = GeoTiff('store', 'france')
+    check_geotiff(layer)
+    with pytest.raises(PackageError):
+        check_geotiff(layer, require_cog=True)
 
 
 @pytest.mark.integration
 def test_publish_layer_makes_fgdc_public(s3, shapefile, db):
     s3.Bucket("upload").upload_file(shapefile, "bermuda.zip")
     with requests_mock.Mocker() as m:
+        m.get("mock://example.com/geoserver/rest/workspaces.json",
+              json={"workspaces": ""})
         m.post("mock://example.com/geoserver/rest/workspaces/public/"
                "datastores/pg/featuretypes")
         m.post("mock://example.com/solr/update/json/docs")
@@ -111,6 +142,8 @@ def test_publish_layer_makes_fgdc_public(s3, shapefile, db):
 def test_publish_layer_uses_ogc_proxy_url(s3, shapefile, db):
     s3.Bucket("upload").upload_file(shapefile, "bermuda.zip")
     with requests_mock.Mocker() as m:
+        m.get("mock://example.com/geoserver/rest/workspaces.json",
+              json={"workspaces": ""})
         m.post("mock://example.com/geoserver/rest/workspaces/public/"
                "datastores/pg/featuretypes")
         m.post("mock://example.com/solr/update/json/docs")
@@ -150,3 +183,19 @@ def test_publishable_layers_skips_old_layer(s3, dynamo_table):
     upload.put_object(Key="foo.zip", Body="Some data")
     layers = list(publishable_layers(upload, dynamo_table))
     assert not layers
+
+
+def test_then_resolves_to_value():
+    future = Future()
+    chained = _then(future, 'bermuda')
+    assert not chained.done()
+    future.set_result(None)
+    assert chained.result() == 'bermuda'
+
+
+def test_then_passes_on_exception():
+    future = Future()
+    chained = _then(future, 'bermuda')
+    future.set_exception(ValueError('Bad record'))
+    with pytest.raises(ValueError):
+        chained.result()
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from slingshot.cache import disk_cache
+from slingshot.s3 import S3IO
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    disk_cache.configure(str(tmp_path), 1024)
+    yield tmp_path
+    disk_cache.directory = None
+
+
+def test_s3io_reads_through_disk_cache(s3, cache_dir):
+    obj = s3.Object("store", "foo.prj")
+    obj.put(Body=b"GEOGCS[]")
+    fp = S3IO(obj, use_disk_cache=True)
+    assert fp.read(6) == b"GEOGCS"
+    assert fp.read() == b"[]"
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_disk_cache_serves_cached_object(s3, cache_dir):
+    obj = s3.Object("store", "foo.prj")
+    obj.put(Body=b"GEOGCS[]")
+    S3IO(obj, use_disk_cache=True).read()
+
+    def fail(**kwargs):
+        raise Exception("Object was not cached")
+
+    obj = s3.Object("store", "foo.prj")
+    obj.get = fail
+    assert S3IO(obj, use_disk_cache=True).read() == b"GEOGCS[]"
+
+
+def test_disk_cache_uses_etag(s3, cache_dir):
+    obj = s3.Object("store", "foo.prj")
+    obj.put(Body=b"GEOGCS[]")
+    S3IO(obj, use_disk_cache=True).read()
+    obj.put(Body=b"PROJCS[]")
+    assert S3IO(s3.Object("store", "foo.prj"),
+                use_disk_cache=True).read() == b"PROJCS[]"
+
+
+def test_disk_cache_evicts_least_recently_used(s3, cache_dir):
+    for key in ("a", "b", "c"):
+        obj = s3.Object("store", key)
+        obj.put(Body=key.encode() * 400)
+        S3IO(obj, use_disk_cache=True).read()
+    assert len(os.listdir(cache_dir)) == 2
+    assert disk_cache.get(s3.Object("store", "c"))[:1] == b"c"
+
+
+def test_disk_cache_makes_room_before_download(s3, cache_dir):
+    obj = s3.Object("store", "a")
+    obj.put(Body=b"a" * 400)
+    S3IO(obj, use_disk_cache=True).read()
+    obj = s3.Object("store", "b")
+    obj.put(Body=b"b" * 800)
+    get = obj.get
+
+    def check(**kwargs):
+        assert [f for f in os.listdir(cache_dir)
+                if not f.endswith(".tmp")] == []
+        return get(**kwargs)
+
+    obj.get = check
+    assert S3IO(obj, use_disk_cache=True).read() == b"b" * 800
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_disk_cache_map_survives_eviction(s3, cache_dir):
+    obj = s3.Object("store", "a")
+    obj.put(Body=b"a" * 400)
+    local = disk_cache.get(obj)
+    obj = s3.Object("store", "b")
+    obj.put(Body=b"b" * 800)
+    disk_cache.get(obj)
+    assert len(os.listdir(cache_dir)) == 1
+    assert local[:] == b"a" * 400
+
+
+def test_disk_cache_skips_large_objects(s3, cache_dir):
+    obj = s3.Object("store", "big")
+    obj.put(Body=b"x" * 2048)
+    assert S3IO(obj, use_disk_cache=True).read() == b"x" * 2048
+    assert not os.listdir(cache_dir)
+
+
+def test_s3io_skips_disk_cache_by_default(s3, cache_dir):
+    obj = s3.Object("store", "upload.zip")
+    obj.put(Body=b"PK")
+    assert S3IO(obj).read() == b"PK"
+    assert not os.listdir(cache_dir)
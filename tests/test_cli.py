@@ -1,4 +1,6 @@
 import os
+import subprocess
+import sys
 
 from click.testing import CliRunner
 import pytest
@@ -23,6 +25,8 @@ def test_publishes_shapefile(db, runner, shapefile, s3, dynamo_table):
     uri = db().url
     schema = metadata().schema
     with requests_mock.Mocker() as m:
+        m.get("mock://example.com/geoserver/rest/workspaces.json",
+              json={"workspaces": ""})
         m.post("mock://example.com/geoserver/rest/workspaces/public/"
                "datastores/pg/featuretypes")
         m.post("mock://example.com/solr/update/json/docs")
@@ -57,6 +61,8 @@ def test_publishes_geotiff(runner, geotiff, s3, dynamo_table):
     bucket = s3.Bucket("upload")
     bucket.upload_file(geotiff, "france.zip")
     with requests_mock.Mocker() as m:
+        m.get('mock://example.com/geoserver/rest/workspaces.json',
+              json={'workspaces': ''})
         m.post('mock://example.com/geoserver/rest/workspaces/secure'
                '/coveragestores')
         m.post('mock://example.com/geoserver/rest/workspaces/secure'
@@ -102,3 +108,14 @@ def test_publishes_marc_records(runner, marc_records):
         assert 'mock://example.com/solr/update/json/docs' in \
                 [call.url for call in m.request_history]
         assert res.exit_code == 0
+
+
+def test_cli_import_does_not_load_dependencies():
+    heavy = ('boto3', 'sqlalchemy', 'geoalchemy2', 'pymarc', 'requests',
+             'plyplus')
+    code = ("import sys, slingshot.cli; "
+            "print(' '.join(m for m in {!r} if m in sys.modules))"
+            .format(heavy))
+    res = subprocess.run([sys.executable, '-c', code],
+                         stdout=subprocess.PIPE, check=True)
+    assert res.stdout.decode().strip() == ''
@@ -0,0 +1,166 @@
+import io
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from slingshot.cog import to_cog
+from slingshot.tiff import read_tiff, TILE_BYTE_COUNTS, TILE_OFFSETS, TiffError
+
+
+def _striped(arr, rows=16, compression=1, predictor=1, geokeys=True,
+             photometric=None):
+    """Write a chunky, striped TIFF of a (height, width, samples) array."""
+    height, width, spp = arr.shape
+    if photometric is None:
+        photometric = 1 if spp == 1 else 2
+    strips = []
+    for r in range(0, height, rows):
+        strip = arr[r:r + rows]
+        if predictor == 2:
+            strip = np.diff(strip, axis=1, prepend=0).astype(arr.dtype)
+        data = strip.tobytes()
+        if compression == 8:
+            data = zlib.compress(data)
+        strips.append(data)
+    fmt = {'u': 1, 'i': 2, 'f': 3}[arr.dtype.kind]
+    bits = arr.dtype.itemsize * 8
+    tags = [(256, 4, [width]), (257, 4, [height]), (258, 3, [bits] * spp),
+            (259, 3, [compression]), (262, 3, [photometric]),
+            (273, 4, [0] * len(strips)), (277, 3, [spp]), (278, 4, [rows]),
+            (279, 4, [len(s) for s in strips]), (284, 3, [1]),
+            (317, 3, [predictor]), (339, 3, [fmt] * spp)]
+    if geokeys:
+        tags.append((33550, 12, [1.0, 1.0, 0.0]))
+    ifd_size = 2 + 12 * len(tags) + 4
+    extra_at = 8 + ifd_size
+    extra = bytearray()
+    data_at = extra_at + sum(4 * len(v) if t == 4 else 2 * len(v) if t == 3
+                             else 8 * len(v) for _, t, v in tags)
+    offsets, pos = [], data_at
+    for s in strips:
+        offsets.append(pos)
+        pos += len(s)
+    ifd = struct.pack('<H', len(tags))
+    for tag, typ, values in tags:
+        if tag == 273:
+            values = offsets
+        data = struct.pack('<' + {3: 'H', 4: 'L', 12: 'd'}[typ] * len(values),
+                           *values)
+        ifd += struct.pack('<HHL', tag, typ, len(values))
+        if len(data) <= 4:
+            ifd += data.ljust(4, b'\x00')
+        else:
+            ifd += struct.pack('<L', extra_at + len(extra))
+            extra += data
+    ifd += struct.pack('<L', 0)
+    out = b'II*\x00' + struct.pack('<L', 8) + ifd + bytes(extra)
+    out = out.ljust(data_at, b'\x00')
+    return io.BytesIO(out + b''.join(strips))
+
+
+def _decode(fp, info, ifd, dtype, spp):
+    """Decode a deflated, tiled image into an array."""
+    offsets = info.read_tag(fp, ifd, TILE_OFFSETS)
+    counts = info.read_tag(fp, ifd, TILE_BYTE_COUNTS)
+    ts = ifd.block_width
+    across = -(-ifd.width // ts)
+    down = -(-ifd.height // ts)
+    out = np.zeros((down * ts, across * ts, spp), dtype)
+    for i, (offset, count) in enumerate(zip(offsets, counts)):
+        fp.seek(offset)
+        tile = np.frombuffer(zlib.decompress(fp.read(count)), dtype)
+        r, c = divmod(i, across)
+        out[r * ts:(r + 1) * ts, c * ts:(c + 1) * ts] = \
+            tile.reshape(ts, ts, spp)
+    return out[:ifd.height, :ifd.width]
+
+
+@pytest.fixture
+def raster():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 1 << 16, (150, 230, 3), dtype='<u2')
+
+
+def test_to_cog_tiles_image_with_overviews(raster):
+    out = io.BytesIO()
+    to_cog(_striped(raster), out, tile_size=64)
+    info = read_tiff(out)
+    assert info.is_cog
+    assert info.tile_size == (64, 64)
+    assert [(i.width, i.height) for i in info.ifds] == \
+        [(230, 150), (115, 75), (58, 38)]
+    assert np.array_equal(_decode(out, info, info.image, '<u2', 3), raster)
+    assert np.array_equal(_decode(out, info, info.ifds[1], '<u2', 3),
+                          raster[::2, ::2])
+    assert np.array_equal(_decode(out, info, info.ifds[2], '<u2', 3),
+                          raster[::4, ::4])
+
+
+def test_to_cog_reads_deflated_input_with_predictor(raster):
+    out = io.BytesIO()
+    to_cog(_striped(raster, rows=7, compression=8, predictor=2), out,
+           tile_size=64)
+    info = read_tiff(out)
+    assert np.array_equal(_decode(out, info, info.image, '<u2', 3), raster)
+
+
+@pytest.mark.parametrize('compression', [1, 8])
+def test_to_cog_streams_large_strips(raster, monkeypatch, compression):
+    class Recording(io.BytesIO):
+        largest = 0
+
+        def read(self, size=-1):
+            data = super().read(size)
+            self.largest = max(self.largest, len(data))
+            return data
+
+    src = Recording(_striped(raster, rows=150, compression=compression)
+                    .getvalue())
+    monkeypatch.setattr('slingshot.cog.S3_BUFFER_SIZE', 4096)
+    out = io.BytesIO()
+    to_cog(src, out, tile_size=64)
+    info = read_tiff(out)
+    assert np.array_equal(_decode(out, info, info.image, '<u2', 3), raster)
+    assert src.largest <= 4096
+
+
+def test_to_cog_reads_float_input():
+    arr = np.linspace(0, 1, 100 * 80, dtype='<f4').reshape(100, 80, 1)
+    out = io.BytesIO()
+    to_cog(_striped(arr, compression=8), out, tile_size=32)
+    info = read_tiff(out)
+    assert info.image.sample_format == (3,)
+    assert np.array_equal(_decode(out, info, info.image, '<f4', 1), arr)
+
+
+def test_to_cog_copies_georeferencing_to_full_image(raster):
+    out = io.BytesIO()
+    to_cog(_striped(raster), out, tile_size=64)
+    info = read_tiff(out)
+    assert info.read_tag(out, info.image, 33550) == (1.0, 1.0, 0.0)
+    assert info.read_tag(out, info.ifds[1], 33550) is None
+
+
+def test_to_cog_puts_overview_data_first(raster):
+    out = io.BytesIO()
+    to_cog(_striped(raster), out, tile_size=64)
+    info = read_tiff(out)
+    full = info.read_tag(out, info.image, TILE_OFFSETS)
+    smallest = info.read_tag(out, info.ifds[-1], TILE_OFFSETS)
+    assert max(smallest) < min(full)
+    assert max(i.offset for i in info.ifds) < min(smallest)
+
+
+def test_to_cog_keeps_white_is_zero():
+    arr = np.arange(40 * 30, dtype='<u1').reshape(40, 30, 1)
+    out = io.BytesIO()
+    to_cog(_striped(arr, photometric=0), out, tile_size=16)
+    info = read_tiff(out)
+    assert [i.photometric for i in info.ifds] == [0] * len(info.ifds)
+
+
+def test_to_cog_rejects_unsupported_compression(raster):
+    with pytest.raises(TiffError):
+        to_cog(_striped(raster, compression=5), io.BytesIO())
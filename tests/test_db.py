@@ -1,17 +1,35 @@
+from datetime import date
+import io
 import re
+import struct
 
+from geomet import wkb
 from shapefile import Reader
+import numpy as np
 import pytest
 from sqlalchemy import Boolean, Date, Float, Integer, Text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
 
 from slingshot.db import (
+    binary_field,
+    engine,
+    generalize,
+    load_layer,
     metadata,
     multiply,
+    partition,
     prep_field,
+    sync_table,
     table,
     _make_column,
+    PGBinaryShapeReader,
+    PGColumnarShapeReader,
     PGShapeReader,
+    _copy_sql,
 )
+from slingshot.dbf import DbfReader
+from slingshot.hilbert import hilbert_keys
 
 
 @pytest.fixture(autouse=True)
@@ -35,6 +53,22 @@ def test_table_adds_all_fields():
     assert t.c.f_2.name == 'f_2'
 
 
+def test_table_can_be_unlogged():
+    t = table('FOOBAR', 'POINT', 4326, [('f_1', 'C', 254, 0)],
+              unlogged=True)
+    sql = str(CreateTable(t).compile(dialect=postgresql.dialect()))
+    assert sql.strip().startswith('CREATE UNLOGGED TABLE')
+
+
+def test_copy_sql_includes_options():
+    t = table('FOOBAR', 'POINT', 4326, [('f_1', 'C', 254, 0)])
+    assert _copy_sql(t, 'text', 'UTF8', freeze=True) == \
+        'COPY "public"."FOOBAR" FROM STDIN WITH (FORMAT text, ' \
+        "ENCODING 'UTF8', FREEZE)"
+    assert _copy_sql(t, 'binary') == \
+        'COPY "public"."FOOBAR" FROM STDIN WITH (FORMAT binary)'
+
+
 def test_make_column_creates_text_field():
     c = _make_column(('f', 'C', 254, 0))
     assert isinstance(c.type, Text)
@@ -138,3 +172,268 @@ def test_pg_reader_readline_reads_to_end(shapefile_layer):
             buf += line
         assert re.search(r'Zeta Island\t1995-08-16\tSRID=4326;POINT '
                          r'\(-64\.[0-9]+ 32\.[0-9]+\)\n$', buf)
+
+
+def test_pg_reader_reads_across_batches(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        expected = PGShapeReader(shp, 4326).read()
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        pg = PGShapeReader(shp, 4326, batch_size=2)
+        chunks = iter(lambda: pg.read(100), '')
+        assert ''.join(chunks) == expected
+
+
+def test_pg_reader_reads_line_after_partial_read(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        pg = PGShapeReader(shp, 4326)
+        lines = [pg.readline(), pg.readline()]
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        pg = PGShapeReader(shp, 4326, batch_size=1)
+        assert pg.read(5) + pg.readline() == lines[0]
+        assert pg.readline() == lines[1]
+
+
+def test_binary_field_encodes_values():
+    assert binary_field('N', 0, 'utf-8')(23) == struct.pack('>ii', 4, 23)
+    assert binary_field('N', 5, 'utf-8')(1.5) == struct.pack('>id', 8, 1.5)
+    assert binary_field('D', 0, 'utf-8')(date(2000, 1, 2)) == \
+        struct.pack('>ii', 4, 1)
+    assert binary_field('L', 0, 'utf-8')(True) == b'\x00\x00\x00\x01\x01'
+    assert binary_field('C', 0, 'utf-8')('\u0192') == \
+        b'\x00\x00\x00\x02\xc6\x92'
+    assert binary_field('C', 0, 'cp1252')(b'\x83') == \
+        b'\x00\x00\x00\x02\xc6\x92'
+
+
+def test_binary_field_encodes_null():
+    for _type in 'NDLC':
+        assert binary_field(_type, 0, 'utf-8')(None) == b'\xff\xff\xff\xff'
+    assert binary_field('D', 0, 'utf-8')('2019xx01') == b'\xff\xff\xff\xff'
+
+
+def test_pg_binary_reader_writes_copy_file(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        n_fields = len(shp.fields) - 1
+        records = list(shp.iterShapeRecords())
+        pg = PGBinaryShapeReader(shp, 4326, batch_size=3)
+        data = b''.join(iter(lambda: pg.read(1000), b''))
+    fp = io.BytesIO(data)
+    assert fp.read(11) == b'PGCOPY\n\xff\r\n\x00'
+    assert struct.unpack('>ii', fp.read(8)) == (0, 0)
+    rows = []
+    while True:
+        count, = struct.unpack('>h', fp.read(2))
+        if count == -1:
+            break
+        assert count == n_fields + 1
+        row = []
+        for _ in range(count):
+            size, = struct.unpack('>i', fp.read(4))
+            row.append(fp.read(size) if size >= 0 else None)
+        rows.append(row)
+    assert fp.read() == b''
+    assert len(rows) == len(records)
+    geom = wkb.loads(rows[-1][-1])
+    assert geom['meta']['srid'] == 4326
+    assert geom['coordinates'] == \
+        list(records[-1].shape.__geo_interface__['coordinates'])
+    assert rows[-1][-3].decode('utf-8') == records[-1].record[-3]
+
+
+def test_pg_columnar_reader_matches_binary_reader(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        expected = PGBinaryShapeReader(shp, 4326).read()
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        pg = PGColumnarShapeReader(shp, 4326, copy_format='binary',
+                                   batch_size=3)
+        assert b''.join(iter(lambda: pg.read(1000), b'')) == expected
+
+
+def test_pg_columnar_reader_writes_text_rows(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        expected = [line.split('\t') for line in
+                    PGShapeReader(shp, 4326).read().splitlines()]
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        pg = PGColumnarShapeReader(shp, 4326, batch_size=3)
+        rows = [line.decode('utf-8').split('\t') for line in
+                iter(pg.readline, b'')]
+    assert [r[:-1] for r in rows] == [r[:-1] for r in expected]
+    geom = wkb.loads(bytes.fromhex(rows[-1][-1]))
+    assert geom['meta']['srid'] == 4326
+    assert geom['type'] == 'Point'
+
+
+def test_pg_columnar_reader_skips_deleted_records(shapefile_layer, tmpdir):
+    for ext in ('shp', 'shx', 'dbf'):
+        with open('{}/bermuda.{}'.format(shapefile_layer, ext), 'rb') as fp:
+            tmpdir.join('bermuda.' + ext).write_binary(fp.read())
+    path = str(tmpdir.join('bermuda'))
+    with Reader(path) as shp:
+        first = PGColumnarShapeReader(shp, 4326).readline()
+        lines = PGColumnarShapeReader(shp, 4326).read().splitlines()
+    with open(path + '.dbf', 'r+b') as fp:
+        fp.seek(DbfReader(fp).header_length)
+        fp.write(b'*')
+    with Reader(path) as shp:
+        pg = PGColumnarShapeReader(shp, 4326, batch_size=2)
+        remaining = pg.read().splitlines()
+    assert first not in remaining
+    assert remaining == lines[1:]
+
+
+def test_pg_binary_reader_skips_deleted_records(shapefile_layer, tmpdir):
+    for ext in ('shp', 'shx', 'dbf'):
+        with open('{}/bermuda.{}'.format(shapefile_layer, ext), 'rb') as fp:
+            tmpdir.join('bermuda.' + ext).write_binary(fp.read())
+    path = str(tmpdir.join('bermuda'))
+    with open(path + '.dbf', 'r+b') as fp:
+        reader = DbfReader(fp)
+        fp.seek(reader.header_length + reader.record_length)
+        fp.write(b'*')
+    with Reader(path) as shp:
+        expected = PGColumnarShapeReader(shp, 4326,
+                                         copy_format='binary').read()
+    with Reader(path) as shp:
+        assert PGBinaryShapeReader(shp, 4326, batch_size=3).read() == \
+            expected
+
+
+def test_pg_columnar_reader_reads_ranges(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        expected = PGColumnarShapeReader(shp, 4326).read()
+    parts = []
+    for start, stop in [(0, 4), (4, 9), (9, None)]:
+        with Reader(shapefile_layer + '/bermuda.shp') as shp:
+            pg = PGColumnarShapeReader(shp, 4326, batch_size=3, start=start,
+                                       stop=stop)
+            parts.append(pg.read())
+    assert all(parts)
+    assert b''.join(parts) == expected
+
+
+def test_partition_splits_by_offset():
+    offsets = np.array([0, 10, 20, 30, 1000, 1010, 1020, 1030])
+    assert partition(offsets, 2, 1) == [(0, 4), (4, 8)]
+
+
+def test_partition_keeps_minimum_records():
+    offsets = np.arange(0, 1000, 10)
+    assert partition(offsets, 4, 40) == [(0, 50), (50, 100)]
+    assert partition(offsets, 4, 1000) == [(0, 100)]
+
+
+def test_partition_handles_empty_shapefile():
+    assert partition(np.array([], np.int64), 4, 1) == [(0, 0)]
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize('copy_format', ['text', 'binary'])
+def test_load_layer_copies_ranges_concurrently(shapefile_layer,
+                                               shapefile_object, db,
+                                               copy_format, monkeypatch):
+    monkeypatch.setattr('slingshot.db.partition', lambda offsets, workers:
+                        [(0, 3), (3, 6), (6, len(offsets))])
+    load_layer(shapefile_object, copy_format=copy_format)
+    with engine().connect() as conn:
+        count = conn.execute('SELECT count(*) FROM bermuda').scalar()
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        assert count == len(shp)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize('unlogged', [False, True])
+def test_load_layer_bulk_loads_table(shapefile_layer, shapefile_object, db,
+                                     unlogged):
+    timings = load_layer(shapefile_object, bulk=True, unlogged=unlogged)
+    assert {'create', 'copy', 'index', 'analyze'} <= set(timings)
+    with engine().connect() as conn:
+        count = conn.execute('SELECT count(*) FROM bermuda').scalar()
+        persistence = conn.execute("SELECT relpersistence FROM pg_class "
+                                   "WHERE relname = 'bermuda'").scalar()
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        assert count == len(shp)
+    assert persistence == 'p'
+
+
+@pytest.mark.integration
+def test_load_layer_sync_keeps_unchanged_table(shapefile_layer,
+                                               shapefile_object, db):
+    load_layer(shapefile_object)
+    timings = load_layer(shapefile_object, sync=True)
+    assert 'sync' in timings
+    assert not engine().has_table('bermuda__staging', schema='public')
+    with engine().connect() as conn:
+        count = conn.execute('SELECT count(*) FROM bermuda').scalar()
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        assert count == len(shp)
+
+
+@pytest.mark.integration
+def test_sync_table_applies_changes(shapefile_object, db):
+    load_layer(shapefile_object)
+    t = metadata().tables['public.bermuda']
+    with engine().connect() as conn:
+        conn.execute('CREATE TABLE bermuda_copy AS SELECT * FROM bermuda')
+        conn.execute('DELETE FROM bermuda WHERE ctid IN '
+                     '(SELECT ctid FROM bermuda LIMIT 1)')
+    staging = table('bermuda_copy', 'POINT', 4326, [])
+    try:
+        assert sync_table(t, staging, max_changes=1) == (0, 1)
+        with engine().connect() as conn:
+            assert conn.execute('SELECT count(*) FROM bermuda').scalar() == \
+                conn.execute('SELECT count(*) FROM bermuda_copy').scalar()
+    finally:
+        staging.drop(checkfirst=True)
+
+
+@pytest.mark.integration
+def test_sync_table_indexes_replacement_table(shapefile_object, db):
+    load_layer(shapefile_object)
+    t = metadata().tables['public.bermuda']
+    with engine().connect() as conn:
+        conn.execute('CREATE TABLE bermuda_copy AS SELECT * FROM bermuda')
+        conn.execute('DELETE FROM bermuda WHERE ctid IN '
+                     '(SELECT ctid FROM bermuda LIMIT 1)')
+    staging = table('bermuda_copy', 'POINT', 4326, [])
+    try:
+        assert sync_table(t, staging, max_changes=0) is None
+        with engine().connect() as conn:
+            indexes = conn.execute("SELECT indexname FROM pg_indexes WHERE "
+                                   "tablename = 'bermuda'").fetchall()
+        assert indexes == [('idx_bermuda_geom',)]
+    finally:
+        staging.drop(checkfirst=True)
+
+
+@pytest.mark.integration
+def test_generalize_makes_simplified_tables(db):
+    t = table('bermuda', 'POLYGON', 4326, [('name', 'C', 10, 0)])
+    t.create()
+    with engine().connect() as conn:
+        conn.execute("INSERT INTO bermuda VALUES ('a', ST_Multi(ST_Buffer("
+                     "ST_SetSRID(ST_Point(0, 0), 4326), 1, 64)))")
+    try:
+        assert generalize(t, [0.1, 0.01]) == [('bermuda_gen1', 0.01),
+                                              ('bermuda_gen2', 0.1)]
+        with engine().connect() as conn:
+            points = [conn.execute('SELECT ST_NPoints(geom) FROM {}'
+                                   .format(name)).scalar()
+                      for name in ('bermuda', 'bermuda_gen1', 'bermuda_gen2')]
+        assert points[0] > points[1] > points[2]
+    finally:
+        with engine().connect() as conn:
+            conn.execute('DROP TABLE IF EXISTS bermuda_gen1, bermuda_gen2')
+
+
+def test_pg_columnar_reader_writes_hilbert_order(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        rows = PGColumnarShapeReader(shp, 4326).read().splitlines()
+        shapes = list(shp.iterShapes())
+    with Reader(shapefile_layer + '/bermuda.shp') as shp:
+        pg = PGColumnarShapeReader(shp, 4326, batch_size=3, hilbert=True,
+                                   sort_memory=100)
+        sorted_rows = pg.read().splitlines()
+        bounds = shp.bbox
+    points = np.array([s.points[0] for s in shapes])
+    keys = hilbert_keys(np.hstack([points, points]), bounds)
+    assert sorted_rows == [rows[i] for i in np.argsort(keys, kind='stable')]
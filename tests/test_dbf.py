@@ -0,0 +1,147 @@
+from datetime import date
+
+import numpy as np
+import pytest
+from shapefile import POINT, Reader, Writer
+
+from slingshot.db import binary_field, prep_field
+from slingshot.dbf import (
+    binary_cells,
+    binary_rows,
+    Cells,
+    DbfReader,
+    deleted,
+    text_cells,
+    text_rows,
+)
+
+
+def _cells(cells):
+    data = cells.data.tobytes()
+    ends = np.cumsum(cells.lengths).tolist()
+    return [data[a:b] for a, b in zip([0] + ends, ends)]
+
+
+def _column(values, width=None):
+    width = width or max(len(v) for v in values)
+    data = b''.join(v.ljust(width) for v in values)
+    return np.frombuffer(data, np.uint8).reshape(len(values), width)
+
+
+@pytest.fixture
+def dbf(tmpdir):
+    path = str(tmpdir.join('test'))
+    with Writer(path, shapeType=POINT, encoding='cp1252') as w:
+        w.field('name', 'C', 20)
+        w.field('count', 'N', 10)
+        w.field('ratio', 'N', 12, 4)
+        w.field('day', 'D')
+        w.field('flag', 'L')
+        rows = [
+            ['Café\tbar\\baz', 12, 1.5, date(2019, 3, 1), True],
+            ['', None, None, None, None],
+            ['x', -7, -0.25, date(1901, 12, 31), False],
+        ]
+        for i, row in enumerate(rows):
+            w.point(i, i)
+            w.record(*row)
+    return path
+
+
+def test_dbf_reader_reads_header(dbf):
+    with open(dbf + '.dbf', 'rb') as fp, Reader(dbf) as sf:
+        reader = DbfReader(fp)
+        assert len(reader) == 3
+        assert reader.fields == [tuple(f) for f in sf.fields[1:]]
+
+
+def test_dbf_reader_reads_batches(dbf):
+    with open(dbf + '.dbf', 'rb') as fp:
+        reader = DbfReader(fp)
+        batches = list(reader.batches(2))
+    assert [len(b) for b in batches] == [2, 1]
+    assert not deleted(batches[0]).any()
+    assert reader.column(batches[1], 0).tobytes().rstrip() == b'x'
+
+
+def test_text_cells_match_prep_field(dbf):
+    with open(dbf + '.dbf', 'rb') as fp, \
+            Reader(dbf, encoding='cp1252') as sf:
+        reader = DbfReader(fp)
+        batch = next(reader.batches())
+        records = list(sf.iterRecords())
+    for i, field in enumerate(reader.fields):
+        cells = text_cells(reader.column(batch, i), field, 'cp1252')
+        expected = [prep_field(r[i], field[1], 'cp1252').encode('utf-8')
+                    for r in records]
+        if field[1] == 'L':
+            expected = [{b'True': b't', b'False': b'f'}.get(v, v)
+                        for v in expected]
+        assert _cells(cells) == expected
+
+
+def test_binary_cells_match_binary_field(dbf):
+    with open(dbf + '.dbf', 'rb') as fp, \
+            Reader(dbf, encoding='cp1252') as sf:
+        reader = DbfReader(fp)
+        batch = next(reader.batches())
+        records = list(sf.iterRecords())
+    for i, field in enumerate(reader.fields):
+        cells = binary_cells(reader.column(batch, i), field, 'cp1252')
+        encode = binary_field(field[1], field[3], 'cp1252')
+        assert _cells(cells) == [encode(r[i]) for r in records]
+
+
+def test_text_cells_escapes_and_converts_text():
+    column = _column([b'a\tb\\', b'\xe9t\xe9  \x00'])
+    cells = text_cells(column, ('f', 'C', 10, 0), 'latin-1')
+    assert _cells(cells) == [b'a\\\tb\\\\', 'été'.encode('utf-8')]
+
+
+def test_text_cells_decodes_multibyte_encodings():
+    column = _column(['日本'.encode('shift_jis'), b'a\n'])
+    cells = text_cells(column, ('f', 'C', 10, 0), 'shift_jis')
+    assert _cells(cells) == ['日本'.encode('utf-8'), b'a\\\n']
+
+
+def test_text_cells_writes_null_for_bad_values():
+    numbers = _column([b' 12', b'', b'***', b'abc', b'3.7'])
+    assert _cells(text_cells(numbers, ('f', 'N', 5, 0), 'utf-8')) == \
+        [b'12', b'\\N', b'\\N', b'\\N', b'3']
+    dates = _column([b'20200229', b'20190229', b'00000000', b'        ',
+                     b'2019xx01'])
+    assert _cells(text_cells(dates, ('f', 'D', 8, 0), 'utf-8')) == \
+        [b'2020-02-29', b'\\N', b'\\N', b'\\N', b'\\N']
+    flags = _column([b'Y', b'n', b'?', b' '])
+    assert _cells(text_cells(flags, ('f', 'L', 1, 0), 'utf-8')) == \
+        [b't', b'f', b'\\N', b'\\N']
+
+
+def test_binary_cells_rejects_integers_out_of_range():
+    column = _column([b'9999999999'])
+    with pytest.raises(ValueError):
+        binary_cells(column, ('f', 'N', 10, 0), 'utf-8')
+
+
+def test_cells_take_reorders_cells():
+    cells = Cells.from_list([b'a', b'bc', b'', b'def'])
+    assert _cells(cells.take(np.array([3, 0, 2, 1]))) == \
+        [b'def', b'a', b'', b'bc']
+
+
+def test_text_rows_joins_cells():
+    columns = [Cells.from_list([b'a', b'bc']), Cells.from_list([b'', b'd'])]
+    assert _cells(text_rows(columns)) == [b'a\t\n', b'bc\td\n']
+
+
+def test_binary_rows_joins_cells():
+    columns = [Cells.from_list([b'a', b'bc']), Cells.from_list([b'', b'd'])]
+    assert _cells(binary_rows(columns)) == [b'\x00\x02a', b'\x00\x02bcd']
+
+
+def test_dbf_reader_reads_range(dbf):
+    with open(dbf + '.dbf', 'rb') as fp:
+        reader = DbfReader(fp)
+        batches = list(reader.batches(1, start=1, stop=3))
+    assert [reader.column(b, 0).tobytes().rstrip() for b in batches] == \
+        [b'', b'x']
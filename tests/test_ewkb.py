@@ -0,0 +1,75 @@
+from geomet import wkb
+import pytest
+from shapefile import Reader, Shape
+
+from slingshot.db import multiply
+from slingshot.ewkb import ewkb
+
+
+def _shape(shape_type, points, parts=None):
+    return Shape(shapeType=shape_type, points=points, parts=parts or [0])
+
+
+def _loads(data):
+    geom = wkb.loads(data)
+    srid = geom['meta']['srid']
+    return srid, _lists({'type': geom['type'],
+                         'coordinates': geom['coordinates']})
+
+
+def _lists(geom):
+    def convert(c):
+        if isinstance(c, (list, tuple)):
+            return [convert(i) for i in c]
+        return c
+    return {'type': geom['type'], 'coordinates': convert(geom['coordinates'])}
+
+
+def _expected(shape):
+    return _lists(multiply(shape.__geo_interface__))
+
+
+def test_ewkb_encodes_point(shapefile_layer):
+    with Reader(shapefile_layer + '/bermuda.shp') as sf:
+        shape = sf.shape(0)
+    assert _loads(ewkb(shape, 4326)) == (4326, _expected(shape))
+
+
+def test_ewkb_encodes_multipoint():
+    shape = _shape(8, [[0, 0], [1, 2]])
+    assert _loads(ewkb(shape, 4326))[1] == \
+        {'type': 'MultiPoint', 'coordinates': [[0, 0], [1, 2]]}
+
+
+def test_ewkb_promotes_polyline_to_multilinestring():
+    shape = _shape(3, [[0, 0], [1, 1], [2, 0], [3, 3]], [0, 2])
+    assert _loads(ewkb(shape, 2249)) == (2249, _expected(shape))
+    assert _expected(shape)['type'] == 'MultiLineString'
+
+
+def test_ewkb_promotes_polygon_with_hole_to_multipolygon():
+    outer = [[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]
+    hole = [[2, 2], [4, 2], [4, 4], [2, 4], [2, 2]]
+    shape = _shape(5, outer + hole, [0, 5])
+    srid, geom = _loads(ewkb(shape, 4326))
+    assert geom == {'type': 'MultiPolygon', 'coordinates': [[outer, hole]]}
+    assert geom == _expected(shape)
+
+
+def test_ewkb_groups_holes_of_multiple_polygons():
+    a = [[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]
+    b = [[20, 0], [20, 10], [30, 10], [30, 0], [20, 0]]
+    hole = [[22, 2], [24, 2], [24, 4], [22, 4], [22, 2]]
+    shape = _shape(5, a + b + hole, [0, 5, 10])
+    srid, geom = _loads(ewkb(shape, 4326))
+    assert geom == {'type': 'MultiPolygon',
+                    'coordinates': [[a], [b, hole]]}
+
+
+def test_ewkb_returns_none_for_null_shape():
+    assert ewkb(Shape(shapeType=0), 4326) is None
+
+
+def test_ewkb_raises_for_unsupported_shape():
+    with pytest.raises(ValueError):
+        ewkb(_shape(11, [[0, 0, 0]]), 4326)
@@ -0,0 +1,72 @@
+import numpy as np
+
+from slingshot.dbf import Cells
+from slingshot.hilbert import hilbert_keys, sort_rows
+
+
+def _xy2d(n, x, y):
+    d = 0
+    s = n // 2
+    while s > 0:
+        rx = int(x & s > 0)
+        ry = int(y & s > 0)
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x, y = n - 1 - x, n - 1 - y
+            x, y = y, x
+        s //= 2
+    return d
+
+
+def _boxes(points):
+    points = np.asarray(points, float)
+    return np.hstack([points, points])
+
+
+def test_hilbert_keys_match_reference():
+    cells = [(x, y) for x in range(8) for y in range(8)]
+    boxes = _boxes([(x + 0.5, y + 0.5) for x, y in cells])
+    keys = hilbert_keys(boxes, (0, 0, 8, 8), order=3)
+    assert keys.tolist() == [_xy2d(8, x, y) for x, y in cells]
+
+
+def test_hilbert_keys_follow_adjacent_cells():
+    cells = [(x, y) for x in range(16) for y in range(16)]
+    boxes = _boxes([(x + 0.5, y + 0.5) for x, y in cells])
+    keys = hilbert_keys(boxes, (0, 0, 16, 16), order=4)
+    path = np.array(cells)[np.argsort(keys)]
+    assert sorted(keys.tolist()) == list(range(256))
+    assert (np.abs(np.diff(path, axis=0)).sum(axis=1) == 1).all()
+
+
+def test_hilbert_keys_put_null_boxes_first():
+    boxes = np.array([[np.nan] * 4, [5, 5, 7, 7]])
+    keys = hilbert_keys(boxes, (0, 0, 8, 8))
+    assert keys[0] == 0
+    assert keys[1] > 0
+
+
+def _batches(rows, keys, size):
+    for i in range(0, len(rows), size):
+        yield (Cells.from_list(rows[i:i + size]),
+               np.array(keys[i:i + size], np.uint64))
+
+
+def test_sort_rows_sorts_in_memory():
+    rows = [b'c', b'a1', b'', b'a2', b'bbb']
+    keys = [3, 1, 0, 1, 2]
+    out = b''.join(sort_rows(_batches(rows, keys, 2), batch_size=2))
+    assert out == b'a1a2bbbc'
+
+
+def test_sort_rows_merges_spilled_runs():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 50, 1000).tolist()
+    rows = ['{}:{};'.format(k, i).encode() for i, k in enumerate(keys)]
+    expected = b''.join(r for _, r in sorted(zip(keys, rows),
+                                             key=lambda kr: kr[0]))
+    chunks = list(sort_rows(_batches(rows, keys, 64), memory=500,
+                            batch_size=100))
+    assert b''.join(chunks) == expected
+    assert len(chunks) == 10
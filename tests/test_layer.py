@@ -1,9 +1,14 @@
+import io
 import json
 import os
+from zipfile import ZipFile
 
 import attr
 import shapefile
 
+from slingshot.cache import disk_cache
+from slingshot.layer import create_layer, GeoTiff, Manifest, Shapefile
+
 
 def test_shapefile_returns_access(shapefile_object):
     assert shapefile_object.is_public()
@@ -30,6 +35,32 @@ def test_shapefile_returns_fgdc_file(shapefile_object):
     assert shapefile_object.fgdc.read(10) == b"<?xml vers"
 
 
+def test_shapefile_finds_fgdc_among_xml_files(s3, shapefile_object):
+    s3.Object('store', 'bermuda/aaa.xml').put(
+        Body=b'<?xml version="1.0"?><gmd:MD_Metadata/>')
+    layer = Shapefile('store', 'bermuda')
+    assert layer.fgdc.obj.key == 'bermuda/bermuda.xml'
+
+
+def test_shapefile_sniffs_large_xml_files(s3, shapefile_object, monkeypatch):
+    monkeypatch.setattr('slingshot.layer.METADATA_FETCH_SIZE', 10)
+    s3.Object('store', 'bermuda/aaa.xml').put(
+        Body=b'<?xml version="1.0"?><gmd:MD_Metadata/>')
+    layer = Shapefile('store', 'bermuda')
+    fgdc = layer.fgdc
+    assert fgdc.obj.key == 'bermuda/bermuda.xml'
+    assert fgdc.read(10) == b"<?xml vers"
+
+
+def test_shapefile_fetches_metadata_once(s3, shapefile_object):
+    shapefile_object.gbl_record.read()
+    shapefile_object.fgdc.read()
+    s3.Object('store', 'bermuda/bermuda.xml').delete()
+    s3.Object('store', 'bermuda/geoblacklight.json').delete()
+    assert shapefile_object.fgdc.read(10) == b"<?xml vers"
+    assert shapefile_object.gbl_record.read(1) == b"{"
+
+
 def test_shapefile_returns_shp_file(shapefile_object):
     with shapefile.Reader(shp=shapefile_object.shp,
                           dbf=shapefile_object.dbf) as shp:
@@ -42,3 +73,58 @@ def test_shapefile_returns_encoding(shapefile_object):
 
 def test_shapefile_returns_srid_as_int(shapefile_object):
     assert shapefile_object.srid == 4326
+
+
+def test_shapefile_lists_manifest(shapefile_object):
+    manifest = shapefile_object.manifest
+    assert 'bermuda/bermuda.shp' in manifest
+    assert manifest['bermuda/bermuda.prj'].size == 335
+
+
+def test_create_layer_uses_manifest(s3):
+    manifest = Manifest("store", "bermuda")
+    manifest.add("bermuda/bermuda.shp", 0, '"etag"')
+    layer = create_layer("store", "bermuda", manifest=manifest)
+    assert isinstance(layer, Shapefile)
+    assert layer.manifest is manifest
+
+
+def test_shapefile_record_updates_manifest(shapefile_object):
+    shapefile_object.record = attr.evolve(shapefile_object.record,
+                                          dc_title_s='Foobar')
+    entry = shapefile_object.manifest['bermuda/geoblacklight.json']
+    assert entry.etag == shapefile_object.s3.Object(
+        'store', 'bermuda/geoblacklight.json').e_tag
+
+
+def test_geotiff_reads_tiff_layout(s3, geotiff):
+    with ZipFile(geotiff) as zf:
+        s3.Object('store', 'france/france.tiff').put(
+            Body=zf.read('france.tiff'))
+    layer = GeoTiff('store', 'france')
+    assert layer.tiff.image.width == 600
+    assert layer.tiff is layer.tiff
+
+
+def test_geotiff_reads_tiff_without_disk_cache(s3, geotiff, tmp_path):
+    with ZipFile(geotiff) as zf:
+        s3.Object('store', 'france/france.tiff').put(
+            Body=zf.read('france.tiff'))
+    disk_cache.configure(str(tmp_path))
+    try:
+        assert GeoTiff('store', 'france').tiff.image.width == 600
+    finally:
+        disk_cache.directory = None
+    assert not os.listdir(str(tmp_path))
+
+
+def test_geotiff_replaces_tif(s3, geotiff):
+    with ZipFile(geotiff) as zf:
+        s3.Object('store', 'france/france.tiff').put(
+            Body=zf.read('france.tiff'))
+    layer = GeoTiff('store', 'france')
+    assert not layer.tiff.tiled
+    layer.replace_tif(io.BytesIO(b'II*\x00\x08\x00\x00\x00\x00\x00'))
+    assert layer.manifest['france/france.tiff'].size == 10
+    assert s3.Object('store', 'france/france.tiff').get()['Body'].read() == \
+        b'II*\x00\x08\x00\x00\x00\x00\x00'
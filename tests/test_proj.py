@@ -1,4 +1,6 @@
-from slingshot.proj import parser
+import pytest
+
+from slingshot.proj import epsg_table, normalize_name, parser, srid
 
 
 def test_parser_parses_projcs(prj_2249):
@@ -13,3 +15,40 @@ def test_parser_parses_geogcs(prj_4326):
         prj = fp.read()
     res = parser.parse(prj)
     assert res.select('geogcs > authority > code *')[0] == '"4326"'
+
+
+def test_srid_reads_authority_code(prj_2249, prj_4326):
+    with open(prj_2249) as fp:
+        assert srid(fp.read()) == 2249
+    with open(prj_4326) as fp:
+        assert srid(fp.read()) == 4326
+
+
+def test_srid_looks_up_esri_name():
+    wkt = ('PROJCS["NAD_1983_StatePlane_Massachusetts_Mainland_FIPS_2001",'
+           'GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",'
+           'SPHEROID["GRS_1980",6378137.0,298.257222101]],'
+           'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],'
+           'PROJECTION["Lambert_Conformal_Conic"],'
+           'PARAMETER["False_Easting",200000.0],UNIT["Meter",1.0]]')
+    assert srid(wkt) == 26986
+
+
+def test_srid_looks_up_geographic_name():
+    wkt = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",'
+           '6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],'
+           'UNIT["Degree",0.0174532925199433]]')
+    assert srid(wkt) == 4326
+
+
+def test_srid_raises_value_error_for_unknown_projection():
+    wkt = ('GEOGCS["GCS_Made_Up",DATUM["D_Made_Up",SPHEROID["Made_Up",'
+           '6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],'
+           'UNIT["Degree",0.0174532925199433]]')
+    with pytest.raises(ValueError):
+        srid(wkt)
+
+
+def test_normalize_name_normalizes_ogc_name():
+    assert normalize_name('NAD83 / UTM zone 19N') == 'NAD83_UTM_ZONE_19N'
+    assert epsg_table()['NAD83_UTM_ZONE_19N'] == 26919
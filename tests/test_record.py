@@ -1,8 +1,10 @@
 from datetime import datetime, timedelta
+import uuid
 
 import pytest
 
-from slingshot.record import Record, rights_converter, geom_converter
+from slingshot.record import (Record, rights_converter, geom_converter,
+                              make_slug, make_uuid)
 
 
 def test_record_maps_rights():
@@ -47,3 +49,12 @@ def test_record_validates_envelope():
     r = Record(solr_geom='ENVELOPE(1, 2, 4, 3)')
     with pytest.raises(ValueError):
         r = Record(solr_geom='ENVELOPE(1, 2, 3, 4)')
+
+
+def test_make_uuid_creates_uuid_string():
+    assert make_uuid('bermuda', 'mit.edu') == \
+        uuid.UUID('df04b29c-0e51-58a8-8a37-557e4f4917df')
+
+
+def test_make_slug_creates_slug():
+    assert make_slug('bermuda') == 'mit-34clfhaokfmkq'
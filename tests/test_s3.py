@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+from zipfile import ZipFile
+
+import boto3
+import pytest
+
+from slingshot.s3 import _Clients, BlockCache, ClientObject, S3IO, upload
+
+
+@pytest.fixture
+def s3_obj(s3):
+    obj = s3.Object("upload", "data")
+    obj.put(Body=bytes(range(256)) * 40)
+    return obj
+
+
+def test_s3io_reads_with_block_cache(s3_obj):
+    f = S3IO(s3_obj, cache=BlockCache(block_size=1024, capacity=4))
+    f.seek(1000)
+    assert f.read(100) == (bytes(range(256)) * 40)[1000:1100]
+    assert f.tell() == 1100
+    assert f.cache.misses == 2
+    f.seek(1010)
+    assert f.read(10) == (bytes(range(256)) * 40)[1010:1020]
+    assert f.cache.hits == 1
+
+
+def test_s3io_block_cache_reads_to_end(s3_obj):
+    f = S3IO(s3_obj, cache=BlockCache(block_size=1024, capacity=4))
+    f.seek(-10, io.SEEK_END)
+    assert f.read() == (bytes(range(256)) * 40)[-10:]
+    assert f.read() == b''
+
+
+def test_s3io_block_cache_merges_adjacent_blocks(s3_obj):
+    requests = []
+    get = s3_obj.get
+
+    def counting_get(**kwargs):
+        requests.append(kwargs['Range'])
+        return get(**kwargs)
+
+    s3_obj.get = counting_get
+    f = S3IO(s3_obj, cache=BlockCache(block_size=1024, capacity=4))
+    assert f.read(5000) == (bytes(range(256)) * 40)[:5000]
+    assert requests == ['bytes=0-5119']
+
+
+def test_block_cache_evicts_least_recently_used():
+    cache = BlockCache(block_size=1, capacity=2)
+    cache.put(0, b'a')
+    cache.put(1, b'b')
+    cache.get(0)
+    cache.put(2, b'c')
+    assert cache.get(1) is None
+    assert cache.get(0) == b'a'
+    assert len(cache) == 2
+
+
+def test_s3io_block_cache_reads_zipfile(s3, shapefile):
+    s3.Bucket("upload").upload_file(shapefile, "bermuda.zip")
+    f = S3IO(s3.Object("upload", "bermuda.zip"), cache=BlockCache())
+    with ZipFile(f) as zf, ZipFile(shapefile) as expected:
+        for name in expected.namelist():
+            assert zf.read(name) == expected.read(name)
+    assert f.cache.hits > 0
+
+
+def test_upload_uploads_parts_in_order(s3):
+    client = boto3.client("s3")
+    data = os.urandom(11 * 1024 * 1024)
+    upload(io.BytesIO(data), "store", "data", client,
+           chunksize=5 * 1024 * 1024, workers=3, window=2)
+    assert s3.Object("store", "data").get()['Body'].read() == data
+
+
+def test_upload_aborts_on_failure(s3):
+    client = boto3.client("s3")
+
+    class FailingClient:
+        def __getattr__(self, name):
+            return getattr(client, name)
+
+        def upload_part(self, **kwargs):
+            if kwargs['PartNumber'] == 2:
+                raise Exception("Part failed")
+            return client.upload_part(**kwargs)
+
+    data = os.urandom(11 * 1024 * 1024)
+    with pytest.raises(Exception, match="Part failed"):
+        upload(io.BytesIO(data), "store", "data", FailingClient(),
+               chunksize=5 * 1024 * 1024, workers=2)
+    assert 'Uploads' not in client.list_multipart_uploads(Bucket="store")
+
+
+def test_clients_shares_clients_across_threads():
+    registry = _Clients()
+    client = registry.client('s3', endpoint_url='http://example.com')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        other = executor.submit(registry.client, 's3',
+                                endpoint_url='http://example.com').result()
+    assert client is other
+    assert client is not registry.client('s3')
+
+
+def test_clients_caches_resources_per_thread():
+    registry = _Clients()
+    resource = registry.resource('s3')
+    assert registry.resource('s3') is resource
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(registry.resource, 's3').result() is not \
+            resource
+
+
+def test_clients_configures_connection_pool():
+    registry = _Clients()
+    registry.configure(max_pool_connections=32)
+    assert registry.client('s3').meta.config.max_pool_connections == 32
+
+
+def test_s3io_reads_through_client(s3_obj):
+    obj = ClientObject(boto3.client("s3"), "upload", "data")
+    f = S3IO(obj, cache=BlockCache(block_size=1024, capacity=4))
+    f.seek(-10, io.SEEK_END)
+    assert f.read() == (bytes(range(256)) * 40)[-10:]
+    assert obj.content_length == 10240
@@ -0,0 +1,250 @@
+import io
+import json
+import struct
+import threading
+
+import pytest
+import requests_mock
+
+from slingshot.services import GeoServer, HttpSession, Solr
+
+
+GEOSERVER = "http://example.com/geoserver/rest/workspaces"
+
+
+def test_geoserver_adds_shapefile(shapefile_object):
+    geoserver = GeoServer("http://example.com/geoserver/", HttpSession())
+    with requests_mock.Mocker() as m:
+        _catalog(m)
+        m.post(GEOSERVER + "/public/datastores/pg/featuretypes")
+        geoserver.add(shapefile_object)
+        assert _changes(m)[0].text == \
+            '{"featureType": {"name": "bermuda"}}'
+
+
+def test_geoserver_adds_generalized_tables(shapefile_object):
+    geoserver = GeoServer("http://example.com/geoserver/", HttpSession())
+    shapefile_object.generalized = [('bermuda_gen1', 0.001),
+                                    ('bermuda_gen2', 0.01)]
+    with requests_mock.Mocker() as m:
+        _catalog(m)
+        m.post(GEOSERVER + "/public/datastores/pg/featuretypes")
+        geoserver.add(shapefile_object)
+        types = [r.json()['featureType'] for r in _changes(m)]
+    assert [t['name'] for t in types] == \
+        ['bermuda', 'bermuda_gen1', 'bermuda_gen2']
+    assert {"@key": "tolerance", "$": "0.01"} in \
+        types[2]['metadata']['entry']
+
+
+def test_geoserver_uses_tile_size_of_geotiff():
+    geoserver = GeoServer("http://example.com/geoserver/", HttpSession())
+    with requests_mock.Mocker() as m:
+        _catalog(m)
+        m.post(GEOSERVER + "/public/coveragestores")
+        m.post(GEOSERVER + "/public/coveragestores/france/coverages")
+        geoserver.add(_GeoTiff(_tiled_tiff(256)))
+        params = _changes(m)[1].json()['coverage']['parameters']
+        assert {"string": ["SUGGESTED_TILE_SIZE", "256,256"]} in \
+            params['entry']
+
+
+def test_geoserver_replaces_existing_feature_types(shapefile_object):
+    geoserver = GeoServer("http://example.com/geoserver/", HttpSession())
+    shapefile_object.generalized = [('bermuda_gen1', 0.001)]
+    with requests_mock.Mocker() as m:
+        _catalog(m, featuretypes=['bermuda'])
+        m.put(GEOSERVER + "/public/datastores/pg/featuretypes/bermuda")
+        m.post(GEOSERVER + "/public/datastores/pg/featuretypes")
+        geoserver.add(shapefile_object)
+        changes = _changes(m)
+    assert [(r.method, r.json()['featureType']['name']) for r in changes] \
+        == [('PUT', 'bermuda'), ('POST', 'bermuda_gen1')]
+    assert changes[0].qs == {'recalculate': ['nativebbox,latlonbbox']}
+
+
+def test_geoserver_replaces_existing_coverages():
+    geoserver = GeoServer("http://example.com/geoserver/", HttpSession())
+    with requests_mock.Mocker() as m:
+        _catalog(m, coveragestores=['france'], coverages=['france'])
+        m.put(GEOSERVER + "/public/coveragestores/france")
+        m.put(GEOSERVER + "/public/coveragestores/france/coverages/france")
+        geoserver.add(_GeoTiff(_tiled_tiff(256)))
+        assert [r.method for r in _changes(m)] == ['PUT', 'PUT']
+
+
+def test_geoserver_loads_catalog_once(shapefile_object):
+    geoserver = GeoServer("http://example.com/geoserver/", HttpSession())
+    with requests_mock.Mocker() as m:
+        _catalog(m)
+        m.post(GEOSERVER + "/public/datastores/pg/featuretypes")
+        m.put(GEOSERVER + "/public/datastores/pg/featuretypes/bermuda")
+        geoserver.add(shapefile_object)
+        geoserver.add(shapefile_object)
+        loads = [r for r in m.request_history if r.method == 'GET']
+        assert [r.method for r in _changes(m)] == ['POST', 'PUT']
+    assert len(loads) == 9
+    assert ('featuretypes', 'public', 'bermuda') in geoserver.catalog
+
+
+def test_geoserver_skips_missing_workspaces():
+    geoserver = GeoServer("http://example.com/geoserver/", HttpSession())
+    with requests_mock.Mocker() as m:
+        m.get(GEOSERVER + ".json", json={"workspaces": ""})
+        assert geoserver.catalog == set()
+
+
+def _catalog(m, coveragestores=(), coverages=(), featuretypes=()):
+    def listing(key, item, names):
+        items = [{"name": n} for n in names]
+        return {key: {item: items} if items else ""}
+
+    m.get(GEOSERVER + ".json", json=listing(
+        "workspaces", "workspace", ["public", "secure"]))
+    for workspace in ("public", "secure"):
+        url = "{}/{}".format(GEOSERVER, workspace)
+        m.get(url + "/coveragestores.json", json=listing(
+            "coverageStores", "coverageStore", coveragestores))
+        m.get(url + "/coverages.json", json=listing(
+            "coverages", "coverage", coverages))
+        m.get(url + "/datastores.json", json=listing(
+            "dataStores", "dataStore", ["pg"]))
+        m.get(url + "/datastores/pg/featuretypes.json", json=listing(
+            "featureTypes", "featureType", featuretypes))
+
+
+def _changes(m):
+    return [r for r in m.request_history if r.method != 'GET']
+
+
+def test_solr_adds_layer_to_solr():
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update/json/docs')
+        s = Solr('mock://example.com/', HttpSession())
+        s.add({'foo': 'bar'})
+        assert m.request_history[0].json() == {'foo': 'bar'}
+
+
+def test_solr_deletes_by_query():
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update')
+        s = Solr('mock://example.com/', HttpSession())
+        s.delete()
+        assert m.request_history[0].json() == \
+            {'delete': {'query': 'dct_provenance_s:MIT'}}
+
+
+def test_solr_commits_changes():
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update')
+        s = Solr('mock://example.com/', HttpSession())
+        s.commit()
+        assert m.request_history[0].json() == {'commit': {}}
+
+
+class _GeoTiff:
+    format = 'GeoTiff'
+    name = 'france'
+    bucket = 'store'
+    tif = 'france/france.tif'
+
+    def __init__(self, fp):
+        from slingshot.tiff import read_tiff
+        self.tiff = read_tiff(fp)
+
+    def is_public(self):
+        return True
+
+
+def _tiled_tiff(tile):
+    tags = [(256, 4, 100), (257, 4, 100), (322, 3, tile), (323, 3, tile)]
+    ifd = struct.pack('<H', len(tags))
+    for tag, typ, value in tags:
+        fmt = '<HHLHxx' if typ == 3 else '<HHLL'
+        ifd += struct.pack(fmt, tag, typ, 1, value)
+    return io.BytesIO(b'II*\x00\x08\x00\x00\x00' + ifd + b'\x00' * 4)
+
+
+def test_solr_batcher_sends_documents_together():
+    with requests_mock.Mocker() as m:
+        m.post('http://example.com/update/json/docs')
+        s = Solr('http://example.com/', HttpSession())
+        with s.batcher(max_docs=3, max_wait=60) as batcher:
+            futures = [batcher.add({'id': i}) for i in range(3)]
+            for future in futures:
+                assert future.result(timeout=5) is None
+        assert len(m.request_history) == 1
+        req = m.request_history[0]
+        assert req.json() == [{'id': 0}, {'id': 1}, {'id': 2}]
+        assert req.qs == {'commitwithin': ['10000']}
+
+
+def test_solr_batcher_sends_after_waiting():
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update/json/docs')
+        s = Solr('mock://example.com/', HttpSession())
+        with s.batcher(max_docs=100, max_wait=0.01) as batcher:
+            batcher.add({'id': 1}).result(timeout=5)
+            batcher.add({'id': 2}).result(timeout=5)
+        assert [r.json() for r in m.request_history] == \
+            [[{'id': 1}], [{'id': 2}]]
+
+
+def test_solr_batcher_sends_remaining_documents_on_close():
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update/json/docs')
+        s = Solr('mock://example.com/', HttpSession())
+        batcher = s.batcher(max_docs=100, max_wait=60)
+        futures = [batcher.add({'id': i}) for i in range(5)]
+        batcher.close()
+        assert all(f.done() and f.exception() is None for f in futures)
+        assert m.request_history[0].json() == [{'id': i} for i in range(5)]
+
+
+def test_solr_batcher_reports_failures_per_document():
+    def respond(request, context):
+        docs = json.loads(request.body)
+        context.status_code = 400 if {'id': 'bad'} in docs else 200
+        return ''
+
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update/json/docs', text=respond)
+        s = Solr('mock://example.com/', HttpSession())
+        with s.batcher(max_docs=3, max_wait=60) as batcher:
+            good = batcher.add({'id': 1})
+            bad = batcher.add({'id': 'bad'})
+            other = batcher.add({'id': 2})
+        assert good.result() is None
+        assert other.result() is None
+        with pytest.raises(Exception):
+            bad.result()
+
+
+def test_solr_batcher_collects_from_threads():
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update/json/docs')
+        s = Solr('mock://example.com/', HttpSession())
+        with s.batcher(max_docs=8, max_wait=60) as batcher:
+            threads = [threading.Thread(target=batcher.add, args=({'id': i},))
+                       for i in range(16)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        ids = sorted(d['id'] for r in m.request_history for d in r.json())
+        assert ids == list(range(16))
+        assert len(m.request_history) == 2
+
+
+def test_solr_batcher_flushes_queued_documents():
+    with requests_mock.Mocker() as m:
+        m.post('mock://example.com/update/json/docs')
+        s = Solr('mock://example.com/', HttpSession())
+        with s.batcher(max_docs=2, max_wait=60) as batcher:
+            futures = [batcher.add({'id': i}) for i in range(3)]
+            futures[0].result(timeout=5)
+            assert not futures[2].done()
+            batcher.flush()
+            assert futures[2].result(timeout=5) is None
+        assert [r.json() for r in m.request_history] == \
+            [[{'id': 0}, {'id': 1}], [{'id': 2}]]
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from shapefile import (MULTIPOINT, NULL, POINT, POLYGON, POLYLINE, Reader,
+                       Writer)
+
+from slingshot.ewkb import ewkb, ewkb_batch
+from slingshot.shp import ShpReader
+
+
+SQUARE = [[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]
+HOLE = [[2, 2], [4, 2], [4, 4], [2, 4], [2, 2]]
+FAR = [[20, 0], [20, 10], [30, 10], [30, 0], [20, 0]]
+FAR_HOLE = [[22, 2], [24, 2], [24, 4], [22, 4], [22, 2]]
+
+
+def _write(path, shape_type, shapes):
+    with Writer(str(path), shapeType=shape_type) as w:
+        w.field('id', 'N')
+        for i, shape in enumerate(shapes):
+            if shape is None:
+                w.null()
+            elif shape_type == POINT:
+                w.point(*shape)
+            elif shape_type == MULTIPOINT:
+                w.multipoint(shape)
+            elif shape_type == POLYLINE:
+                w.line(shape)
+            else:
+                w.poly(shape)
+            w.record(i)
+    return str(path)
+
+
+def _read(path, size=2):
+    with open(path + '.shp', 'rb') as shp, open(path + '.shx', 'rb') as shx:
+        reader = ShpReader(shp, shx)
+        return reader, list(reader.batches(size))
+
+
+def _assert_matches_pyshp(path, size=2):
+    reader, batches = _read(path, size)
+    geoms = [g for b in batches for g in ewkb_batch(b, 4326)]
+    with Reader(path) as sf:
+        assert geoms == [ewkb(s, 4326) for s in sf.iterShapes()]
+    return reader, batches
+
+
+def test_shp_reader_reads_polygons(tmp_path):
+    path = _write(tmp_path / 'poly', POLYGON,
+                  [[SQUARE], [SQUARE, HOLE], None, [FAR]])
+    reader, batches = _read(path, size=10)
+    batch = batches[0]
+    assert reader.shape_type == POLYGON
+    assert len(reader) == len(batch) == 4
+    assert batch.shape_types.tolist() == [POLYGON, POLYGON, NULL, POLYGON]
+    assert batch.part_offsets.tolist() == [0, 1, 3, 3, 4]
+    assert batch.parts.tolist() == [0, 0, 5, 0]
+    assert batch.point_offsets.tolist() == [0, 5, 15, 15, 20]
+    with Reader(path) as sf:
+        shape = sf.shape(1)
+    assert np.array_equal(batch.coords[5:15], shape.points)
+
+
+def test_ewkb_batch_matches_polygons(tmp_path):
+    _assert_matches_pyshp(_write(
+        tmp_path / 'poly', POLYGON,
+        [[SQUARE], [SQUARE, HOLE], None, [SQUARE, FAR, FAR_HOLE],
+         [FAR, FAR_HOLE], [SQUARE[::-1]]]))
+
+
+def test_ewkb_batch_matches_polylines(tmp_path):
+    _assert_matches_pyshp(_write(tmp_path / 'line', POLYLINE,
+                                 [[SQUARE], [SQUARE, HOLE], None, [FAR]]))
+
+
+def test_ewkb_batch_matches_points(tmp_path):
+    _assert_matches_pyshp(_write(tmp_path / 'point', POINT,
+                                 [(1, 2), None, (3.5, -4), (0, 0)]))
+
+
+def test_ewkb_batch_matches_multipoints(tmp_path):
+    _assert_matches_pyshp(_write(tmp_path / 'multi', MULTIPOINT,
+                                 [[[1, 2], [3, 4]], None, [[5, 6]]]))
+
+
+def test_ewkb_batch_matches_fixture(shapefile_layer):
+    _assert_matches_pyshp(shapefile_layer + '/bermuda', size=100)
+
+
+def test_shp_reader_rejects_unsupported_types(tmp_path):
+    path = str(tmp_path / 'z')
+    with Writer(path, shapeType=11) as w:
+        w.field('id', 'N')
+        w.pointz(1, 2, 3)
+        w.record(1)
+    with pytest.raises(ValueError):
+        _read(path)
+
+
+def test_shp_reader_reads_range(tmp_path):
+    path = _write(tmp_path / 'points', POINT, [[i, i] for i in range(7)])
+    with open(path + '.shp', 'rb') as shp, open(path + '.shx', 'rb') as shx:
+        batches = list(ShpReader(shp, shx).batches(2, start=2, stop=5))
+    assert [len(b) for b in batches] == [2, 1]
+    assert np.concatenate([b.coords for b in batches])[:, 0].tolist() == \
+        [2, 3, 4]
+
+
+def test_shp_reader_reads_bboxes(tmp_path):
+    path = _write(tmp_path / 'poly', POLYGON, [[SQUARE], None, [FAR]])
+    _, batches = _read(path, size=10)
+    bboxes = batches[0].bboxes
+    assert bboxes[0].tolist() == [0, 0, 10, 10]
+    assert np.isnan(bboxes[1]).all()
+    assert bboxes[2].tolist() == [20, 0, 30, 10]
+    path = _write(tmp_path / 'points', POINT, [[1, 2]])
+    _, batches = _read(path)
+    assert batches[0].bboxes.tolist() == [[1, 2, 1, 2]]
@@ -0,0 +1,129 @@
+import io
+import struct
+from zipfile import ZipFile
+
+import pytest
+
+from slingshot.tiff import read_tiff, TiffError
+
+
+def _tiff(images, bigtiff=False, byteorder='<'):
+    """Build a TIFF with no image data from a list of tag dicts.
+
+    Tag values are tuples of ``(type, values)``.
+    """
+    if bigtiff:
+        header = struct.pack(byteorder + '2sHHHQ', b'II' if byteorder == '<'
+                             else b'MM', 43, 8, 0, 16)
+        count_fmt, entry_fmt, off_fmt, inline = 'Q', 'HHQ', 'Q', 8
+    else:
+        header = struct.pack(byteorder + '2sHL', b'II' if byteorder == '<'
+                             else b'MM', 42, 8)
+        count_fmt, entry_fmt, off_fmt, inline = 'H', 'HHL', 'L', 4
+    fmts = {3: 'H', 4: 'L', 16: 'Q'}
+    out = bytearray(header)
+    for n, tags in enumerate(images):
+        entries = struct.calcsize(byteorder + entry_fmt) + inline
+        size = struct.calcsize(byteorder + count_fmt) + len(tags) * entries \
+            + struct.calcsize(byteorder + off_fmt)
+        extra_at = len(out) + size
+        ifd, extra = bytearray(), bytearray()
+        ifd += struct.pack(byteorder + count_fmt, len(tags))
+        for tag, (typ, values) in sorted(tags.items()):
+            data = struct.pack(byteorder + fmts[typ] * len(values), *values)
+            ifd += struct.pack(byteorder + entry_fmt, tag, typ, len(values))
+            if len(data) <= inline:
+                ifd += data.ljust(inline, b'\x00')
+            else:
+                ifd += struct.pack(byteorder + off_fmt,
+                                   extra_at + len(extra))
+                extra += data
+        nxt = extra_at + len(extra) if n < len(images) - 1 else 0
+        ifd += struct.pack(byteorder + off_fmt, nxt)
+        out += ifd + extra
+    return io.BytesIO(bytes(out))
+
+
+def _image(width, height, tile=None, overview=False, compression=8):
+    tags = {256: (4, (width,)), 257: (4, (height,)),
+            259: (3, (compression,)), 258: (3, (8, 8, 8)),
+            277: (3, (3,))}
+    if overview:
+        tags[254] = (4, (1,))
+    if tile:
+        across = -(-width // tile)
+        down = -(-height // tile)
+        tags[322] = (3, (tile,))
+        tags[323] = (3, (tile,))
+        tags[324] = (4, (0,) * across * down)
+    else:
+        tags[278] = (3, (16,))
+        tags[273] = (4, (0,) * -(-height // 16))
+    return tags
+
+
+def test_read_tiff_reads_tiled_image_with_overviews():
+    info = read_tiff(_tiff([_image(2048, 1024, 512),
+                            _image(1024, 512, 512, overview=True),
+                            _image(512, 256, 512, overview=True)]))
+    assert info.tiled
+    assert info.tile_size == (512, 512)
+    assert info.compression == 'deflate'
+    assert len(info.overviews) == 2
+    assert info.image.bits_per_sample == (8, 8, 8)
+    assert info.image.blocks == 8
+    assert info.is_cog
+
+
+def test_read_tiff_reads_bigtiff():
+    info = read_tiff(_tiff([_image(2048, 1024, 256),
+                            _image(1024, 512, 256, overview=True)],
+                           bigtiff=True))
+    assert info.bigtiff
+    assert info.tile_size == (256, 256)
+    assert info.is_cog
+
+
+def test_read_tiff_reads_big_endian():
+    info = read_tiff(_tiff([_image(300, 200, compression=1)], byteorder='>'))
+    assert info.byteorder == '>'
+    assert info.image.width == 300
+    assert info.compression == 'none'
+
+
+def test_striped_tiff_is_not_cog():
+    info = read_tiff(_tiff([_image(2048, 1024)]))
+    assert not info.tiled
+    assert info.tile_size is None
+    assert info.image.block_height == 16
+    assert not info.is_cog
+
+
+def test_large_tiled_tiff_without_overviews_is_not_cog():
+    assert not read_tiff(_tiff([_image(2048, 1024, 512)])).is_cog
+
+
+def test_single_tile_tiff_is_cog():
+    assert read_tiff(_tiff([_image(500, 400, 512)])).is_cog
+
+
+def test_read_tiff_reads_geotiff_fixture(geotiff):
+    with ZipFile(geotiff) as zf:
+        info = read_tiff(io.BytesIO(zf.read('france.tiff')))
+    assert (info.image.width, info.image.height) == (600, 400)
+    assert info.compression == 'jpeg'
+    assert not info.is_cog
+
+
+def test_read_tiff_raises_for_non_tiff():
+    with pytest.raises(TiffError):
+        read_tiff(io.BytesIO(b'GIF89a' + b'\x00' * 10))
+
+
+def test_read_tiff_raises_for_ifd_loop():
+    fp = _tiff([_image(100, 100)])
+    data = bytearray(fp.getvalue())
+    count, = struct.unpack_from('<H', data, 8)
+    struct.pack_into('<L', data, 10 + count * 12, 8)
+    with pytest.raises(TiffError):
+        read_tiff(io.BytesIO(bytes(data)))
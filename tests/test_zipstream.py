@@ -0,0 +1,103 @@
+import io
+import os
+from zipfile import BadZipFile, ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+
+from slingshot.s3 import upload
+from slingshot.zipstream import ZipStream
+
+
+class Unseekable:
+    def __init__(self):
+        self.fp = io.BytesIO()
+
+    def write(self, data):
+        return self.fp.write(data)
+
+    def flush(self):
+        pass
+
+
+class PartClient:
+    def __init__(self):
+        self.parts = {}
+
+    def create_multipart_upload(self, **kwargs):
+        return {'UploadId': 'upload'}
+
+    def upload_part(self, Key, PartNumber, Body, **kwargs):
+        self.parts.setdefault(Key, {})[PartNumber] = Body
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, **kwargs):
+        return {'ETag': 'etag'}
+
+
+@pytest.fixture
+def archive():
+    buf = io.BytesIO()
+    with ZipFile(buf, 'w') as zf:
+        zf.writestr('foo/', b'')
+        zf.writestr('foo/stored.tif', b'\x00' * 1000,
+                    compress_type=ZIP_STORED)
+        zf.writestr('foo/deflated.xml', b'<xml/>' * 1000,
+                    compress_type=ZIP_DEFLATED)
+    return buf.getvalue()
+
+
+def test_zipstream_reads_members(archive):
+    members = {info.filename: fp.read() for info, fp in
+               ZipStream(io.BytesIO(archive))}
+    assert members == {'foo/': b'', 'foo/stored.tif': b'\x00' * 1000,
+                       'foo/deflated.xml': b'<xml/>' * 1000}
+
+
+def test_zipstream_skips_unread_members(archive):
+    names = [info.filename for info, _ in ZipStream(io.BytesIO(archive))]
+    assert names == ['foo/', 'foo/stored.tif', 'foo/deflated.xml']
+
+
+def test_zipstream_reads_data_descriptors():
+    data = os.urandom(5000)
+    out = Unseekable()
+    with ZipFile(out, 'w', compression=ZIP_DEFLATED) as zf:
+        with zf.open('foo.bin', 'w') as fp:
+            fp.write(data)
+    members = [(info, fp.read()) for info, fp in
+               ZipStream(io.BytesIO(out.fp.getvalue()))]
+    assert members[0][0].flag_bits & 0x8
+    assert members[0][1] == data
+
+
+def test_zipstream_reads_fixture(shapefile):
+    with open(shapefile, 'rb') as fp, ZipFile(shapefile) as expected:
+        for info, member in ZipStream(fp):
+            assert member.read() == expected.read(info.filename)
+
+
+def test_zipstream_checks_crc(archive):
+    idx = archive.index(b'\x00' * 1000)
+    corrupt = archive[:idx] + b'\x01' + archive[idx + 1:]
+    with pytest.raises(BadZipFile):
+        for info, fp in ZipStream(io.BytesIO(corrupt)):
+            fp.read()
+
+
+def test_zipstream_reads_full_parts_after_data_descriptors():
+    chunksize = 64 * 1024
+    data = {'a.bin': os.urandom(3 * chunksize + 100),
+            'b.bin': os.urandom(2 * chunksize + 7)}
+    out = Unseekable()
+    with ZipFile(out, 'w', compression=ZIP_DEFLATED) as zf:
+        for name, content in data.items():
+            with zf.open(name, 'w') as fp:
+                fp.write(content)
+    client = PartClient()
+    for info, fp in ZipStream(io.BytesIO(out.fp.getvalue())):
+        assert info.flag_bits & 0x8
+        upload(fp, 'store', info.filename, client, chunksize=chunksize)
+    for name, content in data.items():
+        parts = [client.parts[name][i] for i in sorted(client.parts[name])]
+        assert [len(p) for p in parts[:-1]] == [chunksize] * (len(parts) - 1)
+        assert b''.join(parts) == content